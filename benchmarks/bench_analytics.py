@@ -0,0 +1,69 @@
+"""
+Benchmark gap filling of daily click counters for links of different ages.
+
+    python -m benchmarks.bench_analytics
+
+Compares the previous datetime-loop implementation of `add_missing_dates`
+against the NumPy-backed one in `utils.analytics_utils`.
+"""
+
+from datetime import datetime, timedelta
+import random
+import timeit
+
+from utils.analytics_utils import add_missing_dates
+
+LINK_AGES = {"30 days": 30, "1 year": 365, "5 years": 5 * 365}
+REPEAT = 200
+
+
+def legacy_add_missing_dates(key, url_data):
+    counter = url_data[key]
+    first_date = datetime.strptime(url_data["creation-date"], "%Y-%m-%d")
+    last_date = datetime.strptime(datetime.now().strftime("%Y-%m-%d"), "%Y-%m-%d")
+    date_range = [
+        first_date + timedelta(days=x) for x in range((last_date - first_date).days + 1)
+    ]
+    all_dates = [date.strftime("%Y-%m-%d") for date in date_range]
+    for date in all_dates:
+        if date not in counter:
+            counter[date] = 0
+    url_data[key] = {date: counter[date] for date in sorted(counter.keys())}
+    return url_data
+
+
+def make_url_data(days, fill=0.3):
+    """
+    A link created `days` ago that was clicked on roughly `fill` of its days.
+    """
+    today = datetime.now()
+    counter = {
+        (today - timedelta(days=offset)).strftime("%Y-%m-%d"): random.randint(1, 50)
+        for offset in range(days + 1)
+        if random.random() < fill
+    }
+    return {
+        "creation-date": (today - timedelta(days=days)).strftime("%Y-%m-%d"),
+        "counter": counter,
+    }
+
+
+def bench(fn, url_data):
+    def run():
+        fn("counter", {**url_data, "counter": dict(url_data["counter"])})
+
+    return min(timeit.repeat(run, number=REPEAT, repeat=5)) / REPEAT * 1e6
+
+
+def main():
+    random.seed(0)
+    print(f"{'link age':<10} {'legacy (us)':>12} {'numpy (us)':>12} {'speedup':>8}")
+    for label, days in LINK_AGES.items():
+        url_data = make_url_data(days)
+        legacy = bench(legacy_add_missing_dates, url_data)
+        current = bench(add_missing_dates, url_data)
+        print(f"{label:<10} {legacy:>12.1f} {current:>12.1f} {legacy / current:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Benchmark the XLSX export for links with differently sized breakdowns.
+
+    python -m benchmarks.bench_export
+
+Compares the previous in-memory workbook (cells styled one by one, saved
+to a BytesIO) against the write-only workbook in `utils.export_utils`, by
+wall time and by peak Python heap as seen by tracemalloc.
+"""
+
+from datetime import datetime, timedelta
+import io
+import random
+import tempfile
+import time
+import tracemalloc
+
+from openpyxl import Workbook
+from openpyxl.styles import Alignment, Font
+
+from utils.export_utils import EXCEL_SHEETS, write_excel
+
+# Entries per dimension map
+LINK_SIZES = {"small": 50, "medium": 5_000, "large": 20_000}
+REPEAT = 3
+
+GENERAL_INFO_FIELDS = [
+    "total-clicks",
+    "total_unique_clicks",
+    "url",
+    "_id",
+    "max-clicks",
+    "expiration-time",
+    "password",
+    "creation-date",
+    "creation-time",
+    "expired",
+    "block-bots",
+    "average_daily_clicks",
+    "average_monthly_clicks",
+    "average_weekly_clicks",
+    "average_redirection_time",
+    "last-click",
+    "last-click-browser",
+    "last-click-os",
+    "last-click-country",
+]
+
+
+def legacy_export_to_excel(data):
+    output = io.BytesIO()
+    wb = Workbook()
+    bold_font = Font(bold=True)
+
+    ws_general_info = wb.active
+    ws_general_info.title = "General_Info"
+    for field in GENERAL_INFO_FIELDS:
+        ws_general_info.append([field.upper(), data[field]])
+    for cell in ws_general_info["A"]:
+        cell.font = bold_font
+    ws_general_info.column_dimensions["A"].width = 25
+    ws_general_info.column_dimensions["B"].width = 20
+    for cell in ws_general_info["B"]:
+        cell.alignment = Alignment(horizontal="right")
+
+    for title, field, columns in EXCEL_SHEETS:
+        ws = wb.create_sheet(title)
+        ws.append(columns)
+        ws.column_dimensions["A"].width = 20
+        for key, value in data[field].items():
+            ws.append([key, value])
+        for cell in ws[1]:
+            cell.font = bold_font
+            cell.alignment = Alignment(horizontal="center")
+
+    wb.save(output)
+    return output
+
+
+def streamed_export_to_excel(data):
+    with tempfile.TemporaryFile() as output:
+        write_excel(data, output)
+
+
+def make_url_data(entries):
+    today = datetime.now()
+    days = [
+        (today - timedelta(days=offset)).strftime("%Y-%m-%d")
+        for offset in range(min(entries, 3650))
+    ]
+    url_data = {field: None for field in GENERAL_INFO_FIELDS}
+    url_data.update({"_id": "bench", "url": "https://example.com"})
+    for _, field, _ in EXCEL_SHEETS:
+        if field.endswith("counter"):
+            url_data[field] = {day: random.randint(0, 500) for day in days}
+        else:
+            url_data[field] = {
+                f"{field}-{i}": random.randint(1, 500) for i in range(entries)
+            }
+    return url_data
+
+
+def measure(fn, url_data):
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn(url_data)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn(url_data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings) * 1e3, peak / 2**20
+
+
+def main():
+    random.seed(0)
+    print(
+        f"{'link':<8} {'legacy ms':>10} {'legacy MiB':>11} "
+        f"{'write-only ms':>14} {'write-only MiB':>15}"
+    )
+    for label, entries in LINK_SIZES.items():
+        url_data = make_url_data(entries)
+        legacy_ms, legacy_mib = measure(legacy_export_to_excel, url_data)
+        current_ms, current_mib = measure(streamed_export_to_excel, url_data)
+        print(
+            f"{label:<8} {legacy_ms:>10.1f} {legacy_mib:>11.1f} "
+            f"{current_ms:>14.1f} {current_mib:>15.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
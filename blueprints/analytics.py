@@ -0,0 +1,139 @@
+"""
+Internal analytics API over the click warehouse: predefined reports and
+read-only SQL across all links, answered without touching the primary
+database. Every request needs the ANALYTICS_API_KEY in `X-API-Key`.
+"""
+
+from flask import Blueprint, request, jsonify
+from utils.click_warehouse import REPORTS, QueryError, click_warehouse
+from utils.general import is_positive_integer
+from .limiter import limiter
+
+from datetime import datetime, timedelta, timezone
+import hmac
+import os
+
+analytics = Blueprint("analytics", __name__)
+
+# Reports cover the last week unless a range is given
+ANALYTICS_DEFAULT_DAYS = 7
+ANALYTICS_MAX_LIMIT = 1000
+
+
+def _auth_error():
+    api_key = os.environ.get("ANALYTICS_API_KEY")
+    given = request.headers.get("X-API-Key") or ""
+    if not api_key or not hmac.compare_digest(given.encode(), api_key.encode()):
+        return jsonify({"AuthError": "A valid X-API-Key is required"}), 401
+    return None
+
+
+def _parse_days():
+    """
+    `from` and `to` request parameters (UTC, YYYY-MM-DD, inclusive) as
+    (start, end, error).
+    """
+    try:
+        end = request.values.get("to")
+        end = (
+            datetime.strptime(end, "%Y-%m-%d").date()
+            if end
+            else datetime.now(timezone.utc).date()
+        )
+        start = request.values.get("from")
+        start = (
+            datetime.strptime(start, "%Y-%m-%d").date()
+            if start
+            else end - timedelta(days=ANALYTICS_DEFAULT_DAYS - 1)
+        )
+    except ValueError:
+        return None, None, "from and to must be dates in YYYY-MM-DD format"
+    if start > end:
+        return None, None, "from must not be after to"
+    return start, end, None
+
+
+@analytics.route("/api/internal/analytics/reports", methods=["GET"])
+@limiter.exempt
+def list_reports():
+    auth_error = _auth_error()
+    if auth_error:
+        return auth_error
+    return jsonify({"reports": list(REPORTS)})
+
+
+@analytics.route("/api/internal/analytics/reports/<name>", methods=["GET"])
+@limiter.exempt
+def run_report(name):
+    """
+    A predefined report, e.g. top_countries?scope=tsdice for the countries
+    clicking tsDice links over the last week.
+    """
+    auth_error = _auth_error()
+    if auth_error:
+        return auth_error
+
+    if name not in REPORTS:
+        return jsonify({"ReportError": f"Unknown report {name}"}), 404
+
+    scope = request.values.get("scope", "all")
+    if scope not in ("all", "tsdice"):
+        return jsonify({"ScopeError": "scope must be all or tsdice"}), 400
+
+    limit = request.values.get("limit", "10")
+    if not is_positive_integer(limit) or not 0 < int(limit) <= ANALYTICS_MAX_LIMIT:
+        return (
+            jsonify(
+                {
+                    "LimitError": f"limit must be an integer between 1 and {ANALYTICS_MAX_LIMIT}"
+                }
+            ),
+            400,
+        )
+
+    start, end, window_error = _parse_days()
+    if window_error:
+        return jsonify({"WindowError": window_error}), 400
+
+    rows = click_warehouse.report(
+        name, start, end, tsdice_only=scope == "tsdice", limit=int(limit)
+    )
+    if rows is None:
+        return jsonify({"AnalyticsError": "Analytics are temporarily unavailable"}), 503
+
+    return jsonify(
+        {
+            "report": name,
+            "scope": scope,
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "rows": rows,
+        }
+    )
+
+
+@analytics.route("/api/internal/analytics/query", methods=["POST"])
+@limiter.exempt
+def run_query():
+    """
+    Read-only SQL over the `click_events` view (t, short_code, tsdice,
+    browser, os_name, country, referrer, bot) with optional `params`.
+    """
+    auth_error = _auth_error()
+    if auth_error:
+        return auth_error
+
+    body = request.get_json(silent=True) or {}
+    sql = body.get("sql")
+    params = body.get("params") or []
+    if not isinstance(sql, str) or not sql.strip():
+        return jsonify({"QueryError": "sql must be a non-empty string"}), 400
+    if not isinstance(params, list):
+        return jsonify({"QueryError": "params must be a list"}), 400
+
+    try:
+        columns, rows = click_warehouse.query(sql, params)
+    except QueryError as e:
+        return jsonify({"QueryError": str(e)}), 400
+
+    return jsonify({"columns": columns, "rows": [list(row) for row in rows]})
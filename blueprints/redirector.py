@@ -3,23 +3,33 @@ from flask import (
     Blueprint,
     request,
     jsonify,
+    make_response,
     render_template,
     redirect,
 )
 from utils.url_utils import (
     BOT_USER_AGENTS,
-    get_country,
+    get_country_info,
     get_client_ip,
     validate_emoji_alias,
 )
 from utils.mongo_utils import (
+    BulkheadFullError,
     load_url,
     update_url,
     load_emoji_url,
     update_emoji_url,
 )
+from utils.pipeline_utils import (
+    RECENT_CLICKS_LIMIT,
+    get_hourly_trim_operation,
+    get_unique_stats_operations,
+)
+from utils.access_utils import has_valid_access_token, set_access_cookie
 from cache import cache_query as cq
 from cache.cache_url import UrlData
+from cache.click_stream import publish_click
+from utils.click_log import click_log
 
 from .limiter import limiter
 
@@ -36,6 +46,25 @@ tld_no_cache_extract = tldextract.TLDExtract(cache_dir=None)
 url_redirector = Blueprint("url_redirector", __name__)
 
 
+@url_redirector.app_errorhandler(BulkheadFullError)
+def service_busy(error):
+    """
+    A link lookup was turned away because the database is saturated. The
+    link may well exist, so this is a 503 rather than a 404.
+    """
+    response = make_response(
+        render_template(
+            "error.html",
+            error_code="503",
+            error_message="SERVER BUSY, PLEASE TRY AGAIN",
+            host_url=request.host_url,
+        ),
+        503,
+    )
+    response.headers["Retry-After"] = "1"
+    return response
+
+
 @url_redirector.route("/<short_code>", methods=["GET"])
 @limiter.exempt
 def redirect_url(short_code):
@@ -50,11 +79,12 @@ def redirect_url(short_code):
         "ips": {"$elemMatch": {"$eq": user_ip}},
         "block-bots": 1,
         "average_redirection_time": 1,
+        "tsdice-config": 1,
     }
 
     short_code = unquote(short_code)
 
-    is_emoji = False
+    is_emoji = validate_emoji_alias(short_code)
 
     # Measure redirection time
     start_time = time.perf_counter()
@@ -65,10 +95,10 @@ def redirect_url(short_code):
             "url": cached_url_data.url,
             "password": cached_url_data.password,
             "block-bots": cached_url_data.block_bots,
+            "tsdice-config": cached_url_data.tsdice,
         }
     else:
-        if validate_emoji_alias(short_code):
-            is_emoji = True
+        if is_emoji:
             url_data = load_emoji_url(short_code, projection)
         else:
             url_data = load_url(short_code, projection)
@@ -83,6 +113,7 @@ def redirect_url(short_code):
                     short_code=short_code,
                     password=url_data.get("password"),
                     block_bots=url_data.get("block-bots", False),
+                    tsdice=bool(url_data.get("tsdice-config")),
                 ),
             )
 
@@ -134,7 +165,9 @@ def redirect_url(short_code):
 
     if "password" in url_data:
         password = request.values.get("password")
-        if password != url_data["password"]:
+        if password != url_data["password"] and not has_valid_access_token(
+            short_code, url_data["password"]
+        ):
             return (
                 render_template(
                     "password.html", short_code=short_code, host_url=request.host_url
@@ -175,14 +208,20 @@ def redirect_url(short_code):
     os_name = ua.os.family
     browser = ua.user_agent.family
     referrer = request.headers.get("Referer")
-    country = get_country(user_ip)
+    country, country_code = get_country_info(user_ip)
 
-    is_unique_click = url_data.get("ips", None) is None
+    # A cached lookup doesn't carry the IP match, so uniqueness is decided by
+    # the database at write time instead.
+    if cached_url_data:
+        is_unique_click = None
+    else:
+        is_unique_click = url_data.get("ips", None) is None
 
     if country:
         country = country.replace(".", " ")
 
     updates = {"$inc": {}, "$set": {}, "$addToSet": {}}
+    dimensions = {"browser": browser, "os_name": os_name, "country": country}
 
     if "ips" not in url_data:
         url_data["ips"] = []
@@ -198,6 +237,7 @@ def redirect_url(short_code):
 
         updates["$inc"][f"referrer.{sanitized_referrer}.counts"] = 1
         updates["$addToSet"][f"referrer.{sanitized_referrer}.ips"] = user_ip
+        dimensions["referrer"] = sanitized_referrer
 
     updates["$inc"][f"country.{country}.counts"] = 1
     updates["$addToSet"][f"country.{country}.ips"] = user_ip
@@ -208,6 +248,7 @@ def redirect_url(short_code):
     updates["$inc"][f"os_name.{os_name}.counts"] = 1
     updates["$addToSet"][f"os_name.{os_name}.ips"] = user_ip
 
+    bot_name = None
     for bot in BOT_USER_AGENTS:
         bot_re = re.compile(bot, re.IGNORECASE)
         if bot_re.search(user_agent):
@@ -222,8 +263,8 @@ def redirect_url(short_code):
                     ),
                     403,
                 )
-            sanitized_bot = re.sub(r"[.$\x00-\x1F\x7F-\x9F]", "_", bot)
-            updates["$inc"][f"bots.{sanitized_bot}"] = 1
+            bot_name = re.sub(r"[.$\x00-\x1F\x7F-\x9F]", "_", bot)
+            updates["$inc"][f"bots.{bot_name}"] = 1
             break
     else:
         if crawler_detect.isCrawler(user_agent):
@@ -238,25 +279,63 @@ def redirect_url(short_code):
                     ),
                     403,
                 )
-            updates["$inc"][f"bots.{crawler_detect.getMatches()}"] = 1
+            bot_name = crawler_detect.getMatches()
+            updates["$inc"][f"bots.{bot_name}"] = 1
 
     # increment the counter for the short code
-    today = str(datetime.now()).split()[0]
+    now = datetime.now()
+    today = str(now).split()[0]
     updates["$inc"][f"counter.{today}"] = 1
+    updates["$inc"][f"hourly_counter.{today}.{now:%H}"] = 1
 
     if is_unique_click:
         updates["$inc"][f"unique_counter.{today}"] = 1
 
     updates["$addToSet"]["ips"] = user_ip
 
+    # Keep the materialized stats view in sync within the same write. A
+    # first-time visitor is new for every dimension; for anyone else the
+    # per-dimension unique counts are settled by conditional updates.
+    for field, value in dimensions.items():
+        updates["$inc"][f"stats.{field}.{value}"] = 1
+
+    if is_unique_click:
+        updates["$inc"]["stats.total_unique_clicks"] = 1
+        for field, value in dimensions.items():
+            updates["$inc"][f"stats.unique_{field}.{value}"] = 1
+        stats_operations = []
+    else:
+        stats_operations = get_unique_stats_operations(
+            short_code,
+            user_ip,
+            dimensions,
+            today=today if is_unique_click is None else None,
+        )
+
+    # Only matches on the first click of the day, before its hour is counted
+    stats_operations.append(get_hourly_trim_operation(short_code, today))
+
     updates["$inc"]["total-clicks"] = 1
 
+    # Pushed in the same update as total-clicks, so the last N entries are
+    # always the last N clicks; stats pollers read it to fetch only what
+    # changed since the total they last saw.
+    recent_click = {"t": time.time(), "date": today, "dims": dimensions}
+    if bot_name:
+        recent_click["bot"] = bot_name
+    updates["$push"] = {
+        "recent_clicks": {"$each": [recent_click], "$slice": -RECENT_CLICKS_LIMIT}
+    }
+
     updates["$set"]["last-click"] = str(
         datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
     )
     updates["$set"]["last-click-browser"] = browser
     updates["$set"]["last-click-os"] = os_name
     updates["$set"]["last-click-country"] = country
+    if country_code:
+        # Lets the stats view map countries without a name lookup per render
+        updates["$set"][f"stats.country_code.{country}"] = country_code
 
     # Calculate redirection time
     end_time = time.perf_counter()
@@ -271,9 +350,28 @@ def redirect_url(short_code):
     )
 
     if is_emoji:
-        update_emoji_url(short_code, updates)
+        update_emoji_url(
+            short_code,
+            updates,
+            stats_operations,
+            tsdice=bool(url_data.get("tsdice-config")),
+        )
     else:
-        update_url(short_code, updates)
+        update_url(short_code, updates, stats_operations)
+
+    publish_click(short_code, {**recent_click, "unique": is_unique_click})
+
+    # Raw event for questions the counters above can't answer later on
+    click_event = {"t": recent_click["t"], "code": short_code, **dimensions}
+    if country_code:
+        click_event["country_code"] = country_code
+    if bot_name:
+        click_event["bot"] = bot_name
+    if url_data.get("tsdice-config"):
+        click_event["tsdice"] = True
+    if is_unique_click is not None:
+        click_event["unique"] = is_unique_click
+    click_log.append(click_event)
 
     return redirect(url)
 
@@ -297,7 +395,13 @@ def check_password(short_code):
         if "password" in url_data:
             password = request.form.get("password")
             if password == url_data["password"]:
-                return redirect(f"{request.host_url}{short_code}?password={password}")
+                # The cookie carries the access; the password stays out of
+                # the URL, and so out of history, logs and Referer headers
+                return set_access_cookie(
+                    redirect(f"{request.host_url}{short_code}"),
+                    short_code,
+                    password,
+                )
             else:
                 # show error message for incorrect password
                 return render_template(
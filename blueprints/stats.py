@@ -1,7 +1,17 @@
-from flask import Blueprint, jsonify, render_template, request, redirect
+from flask import (
+    Blueprint,
+    Response,
+    current_app,
+    jsonify,
+    make_response,
+    render_template,
+    request,
+    redirect,
+    send_file,
+    stream_with_context,
+)
 from utils.mongo_utils import (
-    aggregate_emoji_url,
-    aggregate_url,
+    BulkheadFullError,
     load_url,
     load_emoji_url,
 )
@@ -12,24 +22,475 @@ from utils.url_utils import (
 from utils.analytics_utils import (
     calculate_click_averages,
     add_missing_dates,
-    top_four,
+    apply_window,
     convert_country_data,
+    to_compact_stats,
 )
 from utils.export_utils import (
-    export_to_csv,
-    export_to_json,
-    export_to_excel,
-    export_to_xml,
+    EXPORT_FORMATS,
+    bulk_export_response,
+    export_response,
+    write_export,
+)
+from utils.export_jobs import EXPORT_JOB_TTL, export_jobs
+from utils.click_log import click_log
+from utils.cube_utils import CUBE_DIMENSIONS, load_breakdown
+from utils.pipeline_utils import (
+    HOURLY_COUNTER_DAYS,
+    PAGED_DIMENSIONS,
+    STATS_DIMENSIONS,
+    STATS_FIELDS,
+    STATS_SCHEMA_VERSION,
+    STATS_VERSION_PROJECTION,
+    TOP_N_FIELDS,
+)
+from utils.stats_utils import (
+    decode_cursor,
+    get_stats_etag,
+    get_stats_version,
+    load_dimension_page,
+    load_stats,
+    load_stats_batch,
+    load_stats_meta_batch,
+    load_stats_delta,
 )
-from utils.pipeline_utils import get_stats_pipeline
+from utils.general import is_positive_integer
+from utils.access_utils import (
+    access_cookie_name,
+    has_valid_access_token,
+    issue_access_token,
+    issue_download_token,
+    set_access_cookie,
+    verify_access_token,
+    verify_download_token,
+)
+from cache import stats_cache
+from cache.click_stream import click_hub
+from cache.export_cache import export_cache
+from cache.redis_client import get_redis_or_none
 from .limiter import limiter
 
-from datetime import datetime, timezone
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from urllib.parse import unquote
+import gzip
 import json
+import os
+import shutil
+import queue
+import time
+
+try:
+    import msgpack
+except ImportError:  # msgpack encoding of compact stats is optional
+    msgpack = None
 
 stats = Blueprint("stats", __name__)
 
+# Entries per chart on the stats page; the rest are folded into "others"
+STATS_VIEW_TOP_N = 4
+
+# Entries kept per dimension map in the stats payload; the complete maps are
+# paged through /stats/<code>/<dimension>
+STATS_MAX_DIMENSION_ENTRIES = 100
+STATS_BATCH_MAX_LINKS = 500
+# Links whose stats are read, and streamed, together
+STATS_BATCH_FETCH_SIZE = 50
+
+# Charts of the stats page, each loaded from /stats/<code>/panel/<name> after
+# the page itself has rendered from the scalar fields below
+STATS_PANELS = {
+    "counter": ["counter", "unique_counter"],
+    "browser": ["browser", "unique_browser"],
+    "os_name": ["os_name", "unique_os_name"],
+    "referrer": ["referrer", "unique_referrer"],
+    "country": ["country", "unique_country", "country_code"],
+    "bots": ["bots"],
+}
+STATS_SHELL_FIELDS = {
+    field
+    for field in STATS_FIELDS
+    if field != "password"
+    and not any(field in fields for fields in STATS_PANELS.values())
+}
+DIMENSION_PAGE_DEFAULT_LIMIT = 50
+DIMENSION_PAGE_MAX_LIMIT = 500
+
+# Live click stream, off unless enabled since every open stream holds a
+# worker thread; comment line sent when idle so proxies keep the connection
+# open, and lifetime after which the browser reconnects
+LIVE_STATS_ENABLED = os.environ.get("LIVE_STATS_ENABLED", "").lower() == "true"
+LIVE_HEARTBEAT_SECONDS = 15
+LIVE_MAX_SECONDS = 300
+
+# Longest date range of a raw click export, and most click log it may scan
+CLICK_EXPORT_MAX_DAYS = 31
+CLICK_EXPORT_MAX_BYTES = int(
+    os.environ.get("CLICK_EXPORT_MAX_BYTES", 256 * 1024 * 1024)
+)
+
+# Cross-dimension breakdowns cover the last BREAKDOWN_DEFAULT_DAYS unless a
+# range of at most BREAKDOWN_MAX_DAYS is given
+BREAKDOWN_DEFAULT_DAYS = 30
+BREAKDOWN_MAX_DAYS = 366
+
+# Bulk exports: links per request, links per batched stats read, and how
+# many of those reads run ahead of the archive being written
+EXPORT_BULK_MAX_LINKS = 200
+EXPORT_BULK_FETCH_SIZE = 25
+EXPORT_BULK_FETCH_WORKERS = 4
+
+# Links with at least this many clicks are always exported by a background
+# job instead of inside the request
+EXPORT_ASYNC_MIN_CLICKS = int(os.environ.get("EXPORT_ASYNC_MIN_CLICKS", 100_000))
+
+STATS_GRANULARITIES = ("hour", "day", "week", "month")
+# Longest window that can be requested hour by hour
+STATS_MAX_HOURLY_DAYS = HOURLY_COUNTER_DAYS
+
+
+def _parse_window():
+    """
+    Optional `from`, `to` (YYYY-MM-DD) and `granularity` request parameters.
+    Returns (window, error); window is None when none of them were given.
+    """
+    start = request.values.get("from")
+    end = request.values.get("to")
+    granularity = request.values.get("granularity")
+    if not (start or end or granularity):
+        return None, None
+
+    granularity = (granularity or "day").lower()
+    if granularity not in STATS_GRANULARITIES:
+        return None, "granularity must be one of hour, day, week or month"
+
+    try:
+        end_date = datetime.strptime(end, "%Y-%m-%d") if end else datetime.now()
+        start_date = datetime.strptime(start, "%Y-%m-%d") if start else None
+    except ValueError:
+        return None, "from and to must be dates in YYYY-MM-DD format"
+
+    if granularity == "hour":
+        earliest = end_date - timedelta(days=STATS_MAX_HOURLY_DAYS - 1)
+        if start_date is None:
+            start_date = earliest
+        elif start_date < earliest:
+            return None, f"hourly stats are limited to {STATS_MAX_HOURLY_DAYS} days"
+
+    if start_date is not None and start_date > end_date:
+        return None, "from must not be after to"
+
+    return {
+        "from": start_date.strftime("%Y-%m-%d") if start_date else None,
+        "to": end_date.strftime("%Y-%m-%d"),
+        "granularity": granularity,
+    }, None
+
+
+def _parse_days(default_days, max_days):
+    """
+    `from` and `to` request parameters as UTC dates (YYYY-MM-DD, inclusive).
+    Without them the range is the last `default_days` days up to today.
+    Returns (start, end, error).
+    """
+    try:
+        end = request.values.get("to")
+        end = (
+            datetime.strptime(end, "%Y-%m-%d").date()
+            if end
+            else datetime.now(timezone.utc).date()
+        )
+        start = request.values.get("from")
+        start = (
+            datetime.strptime(start, "%Y-%m-%d").date()
+            if start
+            else end - timedelta(days=default_days - 1)
+        )
+    except ValueError:
+        return None, None, "from and to must be dates in YYYY-MM-DD format"
+
+    if start > end:
+        return None, None, "from must not be after to"
+    if (end - start).days >= max_days:
+        return None, None, f"date ranges are limited to {max_days} days"
+    return start, end, None
+
+
+def _load_stats_meta(short_code):
+    if validate_emoji_alias(short_code):
+        return load_emoji_url(
+            short_code, projection=STATS_VERSION_PROJECTION, workload="stats"
+        )
+    return load_url(short_code, projection=STATS_VERSION_PROJECTION, workload="stats")
+
+
+def _parse_fields(fields=None):
+    """
+    Optional `fields` selecting payload fields, either a comma-separated
+    string (the `fields` request parameter by default) or a list.
+    Returns (fields, error); fields is None when none were given.
+    """
+    if fields is None:
+        fields = request.values.get("fields")
+    if not fields:
+        return None, None
+    if isinstance(fields, str):
+        fields = fields.split(",")
+    if not all(isinstance(field, str) for field in fields):
+        return None, "fields must be a list of field names"
+
+    fields = {field.strip() for field in fields if field.strip()}
+    unknown = fields.difference(STATS_FIELDS)
+    if unknown:
+        return None, f"Unknown field(s): {', '.join(sorted(unknown))}"
+    return fields, None
+
+
+def _compact_encoding():
+    """
+    Mimetype and gzip flag for a compact stats response, negotiated from the
+    Accept and Accept-Encoding headers.
+    """
+    mimetypes = ["application/json"]
+    if msgpack is not None:
+        mimetypes.append("application/msgpack")
+    mimetype = request.accept_mimetypes.best_match(mimetypes, "application/json")
+    return mimetype, "gzip" in request.accept_encodings
+
+
+def _compact_response(url_data, mimetype, compress):
+    payload = to_compact_stats(url_data, ["bots", *STATS_DIMENSIONS])
+    if mimetype == "application/msgpack":
+        body = msgpack.packb(payload)
+    else:
+        body = json.dumps(payload, separators=(",", ":")).encode()
+
+    response = make_response(body)
+    response.mimetype = mimetype
+    if compress:
+        response.set_data(gzip.compress(body))
+        response.headers["Content-Encoding"] = "gzip"
+    response.vary.update(["Accept", "Accept-Encoding"])
+    return response
+
+
+def _parse_since(since_version, since):
+    """
+    Starting point of an incremental poll: the stats version given as
+    `since_version`, or else the `since` timestamp (ISO 8601 or POSIX seconds)
+    as a POSIX timestamp. None when it is invalid.
+    """
+    if since_version is not None:
+        return int(since_version) if since_version.isdigit() else None
+    if since.replace(".", "", 1).isdigit():
+        return float(since)
+    try:
+        since = datetime.fromisoformat(since.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return since.timestamp()
+
+
+def _window_key(window):
+    return f"{window['from']}:{window['to']}:{window['granularity']}"
+
+
+def _compute_stats(
+    short_code, version, top_n=None, window=None, fields=None, dimension_limit=None
+):
+    """
+    Stats payload shared by the stats and export routes, cached per version.
+    With `fields`, only those payload fields are computed and returned. With
+    `dimension_limit`, count maps keep only their largest entries.
+    """
+    if top_n:
+        version = f"{version}:top{top_n}"
+    if dimension_limit:
+        version = f"{version}:cap{dimension_limit}"
+    if window:
+        version = f"{version}:{_window_key(window)}"
+    if fields is not None:
+        version = f"{version}:{','.join(sorted(fields))}"
+
+    url_data = stats_cache.get_stats(short_code, version)
+    if url_data is not None:
+        return url_data
+
+    url_data = load_stats(short_code, top_n, window, fields, dimension_limit)
+    if not url_data:
+        return None
+
+    url_data = _finalize_stats(short_code, url_data, window, fields)
+    stats_cache.set_stats(short_code, version, url_data)
+    return url_data
+
+
+def _finalize_stats(short_code, url_data, window=None, fields=None):
+    """
+    Expiry, averages and gap-filled counters on top of a loaded stats
+    document, trimmed to `fields` when given.
+    """
+
+    def wanted(*names):
+        return fields is None or any(name in fields for name in names)
+
+    if wanted("expired"):
+        if url_data["max-clicks"] is not None:
+            url_data["expired"] = url_data["total-clicks"] >= int(
+                url_data["max-clicks"]
+            )
+        else:
+            url_data["expired"] = None
+
+        if url_data["expiration-time"] is not None:
+            expiration_time = convert_to_gmt(url_data["expiration-time"])
+            if not expiration_time:
+                print("Expiration time is not timezone aware")
+            elif expiration_time <= datetime.now(timezone.utc):
+                url_data["expired"] = True
+
+    url_data["short_code"] = short_code
+
+    if wanted(
+        "average_daily_clicks", "average_weekly_clicks", "average_monthly_clicks"
+    ):
+        (
+            url_data["average_daily_clicks"],
+            url_data["average_weekly_clicks"],
+            url_data["average_monthly_clicks"],
+        ) = calculate_click_averages(url_data)
+    url_data["average_redirection_time"] = url_data.get("average_redirection_time", 0)
+
+    if window:
+        if wanted("counter", "unique_counter"):
+            url_data = apply_window(
+                url_data,
+                window["from"] or url_data["creation-date"],
+                window["to"],
+                window["granularity"],
+            )
+    elif wanted("counter", "unique_counter"):
+        if url_data["counter"] != {}:
+            url_data = add_missing_dates("counter", url_data)
+        if "unique_counter" in url_data and url_data["unique_counter"] != {}:
+            url_data = add_missing_dates("unique_counter", url_data)
+
+    if fields is not None:
+        url_data = {
+            key: value
+            for key, value in url_data.items()
+            if key in fields
+            or key in ("short_code", "window", "truncated")
+            or key.startswith("sorted_")
+            and key[len("sorted_") :] in fields
+        }
+    return url_data
+
+
+def _ensure_materialized(short_code, url_meta):
+    """
+    Rebuild the materialized view of a link created before it existed, so
+    narrowed reads of single fields can be served from it.
+    """
+    if (url_meta.get("stats") or {}).get("schema") != STATS_SCHEMA_VERSION:
+        load_stats(short_code)
+
+
+def _format_panel(panel, url_data):
+    if panel == "country":
+        country_codes = url_data.pop("country_code", None) or {}
+        url_data["sorted_country"] = convert_country_data(
+            url_data.get("country", {}), country_codes
+        )
+        url_data["sorted_unique_country"] = convert_country_data(
+            url_data.get("unique_country", {}), country_codes
+        )
+    return url_data
+
+
+def _set_cache_headers(response, etag, url_meta):
+    response.set_etag(etag)
+    last_click = url_meta.get("last-click")
+    if last_click:
+        response.last_modified = datetime.strptime(
+            last_click, "%Y-%m-%d %H:%M:%S"
+        ).replace(tzinfo=timezone.utc)
+    # Protected stats must never be stored by shared caches
+    if url_meta.get("password") is not None:
+        response.headers["Cache-Control"] = "private, no-cache"
+    else:
+        response.headers["Cache-Control"] = "no-cache"
+    # Starting point for incremental polls with `since_version`
+    response.headers["X-Stats-Version"] = str(url_meta.get("total-clicks", 0))
+    return response
+
+
+def _grant_access(response, short_code, url_meta, access_token):
+    """
+    Hand out the access token minted after a successful password check, as a
+    cookie for browsers and a header for API clients (`?token=`).
+    """
+    if access_token:
+        set_access_cookie(response, short_code, url_meta["password"], access_token)
+        response.headers["X-Access-Token"] = access_token
+    return response
+
+
+def _json_access_error(short_code, url_meta):
+    """
+    PasswordError response for JSON endpoints of a protected link, unless the
+    request carries its password or a valid access token.
+    """
+    password = request.values.get("password")
+    if (
+        url_meta["password"] is not None
+        and password != url_meta["password"]
+        and not has_valid_access_token(short_code, url_meta["password"])
+    ):
+        return (
+            jsonify({"PasswordError": "Invalid Password", "entered-pass": password}),
+            400,
+        )
+    return None
+
+
+def _url_not_found():
+    if request.method == "GET":
+        return (
+            render_template(
+                "error.html",
+                error_code="404",
+                error_message="URL NOT FOUND",
+                host_url=request.host_url,
+            ),
+            404,
+        )
+    else:
+        return jsonify({"UrlError": "The requested Url never existed"}), 404
+
+
+@stats.errorhandler(BulkheadFullError)
+def _stats_busy(error):
+    # A full bulkhead says nothing about whether the link exists
+    if request.method == "GET" and request.endpoint == "stats.analytics":
+        response = make_response(
+            render_template(
+                "error.html",
+                error_code="503",
+                error_message="SERVER BUSY, PLEASE TRY AGAIN",
+                host_url=request.host_url,
+            ),
+            503,
+        )
+    else:
+        response = jsonify({"StatsError": "Stats are temporarily unavailable"})
+        response.status_code = 503
+    response.headers["Retry-After"] = "1"
+    return response
+
 
 @stats.route("/stats", methods=["GET", "POST"])
 @stats.route("/stats/", methods=["GET", "POST"])
@@ -50,9 +511,13 @@ def stats_route():
         short_code = unquote(short_code)
 
         if validate_emoji_alias(short_code):
-            url_data = load_emoji_url(short_code, projection={"password": 1})
+            url_data = load_emoji_url(
+                short_code, projection={"password": 1}, workload="stats"
+            )
         else:
-            url_data = load_url(short_code, projection={"password": 1})
+            url_data = load_url(
+                short_code, projection={"password": 1}, workload="stats"
+            )
 
         if not url_data:
             return render_template(
@@ -81,7 +546,12 @@ def stats_route():
             )
 
         if url_data["password"] is not None:
-            return redirect(f"/stats/{short_code}?password={password}")
+            # The cookie carries the access, not the URL
+            return set_access_cookie(
+                redirect(f"/stats/{short_code}"),
+                short_code,
+                url_data["password"],
+            )
         else:
             return redirect(f"/stats/{short_code}")
 
@@ -93,29 +563,20 @@ def stats_route():
 def analytics(short_code):
     password = request.values.get("password")
     short_code = unquote(short_code)
-    pipeline = get_stats_pipeline(short_code)
+    url_meta = _load_stats_meta(short_code)
 
-    if validate_emoji_alias(short_code):
-        url_data = aggregate_emoji_url(pipeline)
-    else:
-        url_data = aggregate_url(pipeline)
+    if not url_meta:
+        return _url_not_found()
 
-    if not url_data:
-        if request.method == "GET":
-            return (
-                render_template(
-                    "error.html",
-                    error_code="404",
-                    error_message="URL NOT FOUND",
-                    host_url=request.host_url,
-                ),
-                404,
-            )
-        else:
-            return jsonify({"UrlError": "The requested Url never existed"}), 404
+    url_meta["password"] = url_meta.get("password", None)
+    access_token = None
 
-    if url_data["password"] is not None:
-        if password != url_data["password"]:
+    # Password checks run against the small projection above; a valid access
+    # token from an earlier check skips them entirely.
+    if url_meta["password"] is not None and not has_valid_access_token(
+        short_code, url_meta["password"]
+    ):
+        if password != url_meta["password"]:
             if request.method == "POST":
                 return (
                     jsonify(
@@ -147,51 +608,90 @@ def analytics(short_code):
                         ),
                         400,
                     )
+        access_token = issue_access_token(short_code, url_meta["password"])
 
-    if url_data["max-clicks"] is not None:
-        url_data["expired"] = url_data["total-clicks"] >= int(url_data["max-clicks"])
+    # Incremental polling: only the counters changed since a version the
+    # client already has
+    since_version = request.values.get("since_version")
+    since = request.values.get("since")
+    if (since_version or since) and request.method == "POST":
+        since = _parse_since(since_version, since)
+        if since is None:
+            return (
+                jsonify(
+                    {
+                        "SinceError": "since_version must be a stats version "
+                        "and since a timestamp"
+                    }
+                ),
+                400,
+            )
+        if isinstance(since, int) and since == url_meta.get("total-clicks", 0):
+            delta = {"version": str(since), "full": False, "changes": {}}
+        else:
+            delta = load_stats_delta(short_code, since)
+            if delta is None:
+                return _url_not_found()
+        response = jsonify({"short_code": short_code, **delta})
+        return _grant_access(response, short_code, url_meta, access_token)
+
+    window, window_error = _parse_window()
+    if window_error:
+        return jsonify({"WindowError": window_error}), 400
+
+    # Field selection and the compact format only apply to the JSON API. The
+    # page only needs the scalar fields; its charts load their own panels.
+    fields = None
+    compact = None
+    if request.method == "GET":
+        _ensure_materialized(short_code, url_meta)
+        fields = STATS_SHELL_FIELDS
+        window = None
     else:
-        url_data["expired"] = None
+        fields, fields_error = _parse_fields()
+        if fields_error:
+            return jsonify({"FieldsError": fields_error}), 400
+        if request.values.get("format") == "compact":
+            compact = _compact_encoding()
 
-    if url_data["expiration-time"] is not None:
-        expiration_time = convert_to_gmt(url_data["expiration-time"])
-        if not expiration_time:
-            print("Expiration time is not timezone aware")
-        elif expiration_time <= datetime.now(timezone.utc):
-            url_data["expired"] = True
+    version = get_stats_version(url_meta)
+    variant = request.method
+    if window:
+        variant = f"{variant}:{_window_key(window)}"
+    if fields is not None:
+        variant = f"{variant}:{','.join(sorted(fields))}"
+    if compact:
+        variant = f"{variant}:compact:{compact[0]}:{compact[1]}"
+    etag = get_stats_etag(short_code, version, url_meta["password"], variant=variant)
 
-    url_data["short_code"] = short_code
+    if request.if_none_match.contains(etag):
+        response = _set_cache_headers(make_response("", 304), etag, url_meta)
+        return _grant_access(response, short_code, url_meta, access_token)
 
-    (
-        url_data["average_daily_clicks"],
-        url_data["average_weekly_clicks"],
-        url_data["average_monthly_clicks"],
-    ) = calculate_click_averages(url_data)
-    url_data["average_redirection_time"] = url_data.get("average_redirection_time", 0)
+    url_data = _compute_stats(
+        short_code,
+        version,
+        window=window,
+        fields=fields,
+        # the page only reads scalar fields
+        dimension_limit=STATS_MAX_DIMENSION_ENTRIES
+        if request.method == "POST"
+        else None,
+    )
 
-    if url_data["counter"] != {}:
-        url_data = add_missing_dates("counter", url_data)
-    if "unique_counter" in url_data and url_data["unique_counter"] != {}:
-        url_data = add_missing_dates("unique_counter", url_data)
+    if not url_data:
+        return _url_not_found()
 
     if request.method == "POST":
-        return jsonify(url_data)
+        if compact:
+            response = _compact_response(url_data, *compact)
+        else:
+            response = jsonify(url_data)
+        response = _set_cache_headers(response, etag, url_meta)
+        return _grant_access(response, short_code, url_meta, access_token)
     else:
         try:
             url_data["hyper_link"] = url_data["url"]
-            url_data["sorted_country"] = convert_country_data(url_data["country"])
-            url_data["sorted_referrer"] = json.dumps(top_four(url_data["referrer"]))
-            url_data["sorted_os_name"] = top_four(url_data["os_name"])
-            url_data["sorted_browser"] = top_four(url_data["browser"])
-            url_data["sorted_unique_browser"] = top_four(url_data["unique_browser"])
-            url_data["sorted_unique_os_name"] = top_four(url_data["unique_os_name"])
-            url_data["sorted_unique_country"] = convert_country_data(
-                url_data["unique_country"]
-            )
-            url_data["sorted_unique_referrer"] = json.dumps(
-                top_four(url_data["unique_referrer"])
-            )
-            url_data["sorted_bots"] = top_four(url_data["bots"])
             url_data["analysis_data"] = {
                 "average_daily_clicks": url_data["average_daily_clicks"],
                 "average_weekly_clicks": url_data["average_weekly_clicks"],
@@ -199,9 +699,641 @@ def analytics(short_code):
             }
         except Exception:
             pass
-        return render_template(
-            "stats_view.html", json_data=url_data, host_url=request.host_url
+        if url_meta["password"] is not None:
+            url_data["access_token"] = access_token or issue_access_token(
+                short_code, url_meta["password"]
+            )
+        response = make_response(
+            render_template(
+                "stats_view.html",
+                json_data=url_data,
+                host_url=request.host_url,
+                export_formats=list(EXPORT_FORMATS),
+                live_enabled=LIVE_STATS_ENABLED,
+            )
         )
+        response = _set_cache_headers(response, etag, url_meta)
+        return _grant_access(response, short_code, url_meta, access_token)
+
+
+@stats.route(
+    "/stats/<short_code>/panel/"
+    "<any(counter, browser, os_name, referrer, country, bots):panel>",
+    methods=["GET"],
+)
+@limiter.exempt
+def stats_panel(short_code, panel):
+    """
+    Data behind one chart of the stats page, versioned and cached on its own
+    so the page renders without waiting for every breakdown.
+    """
+    short_code = unquote(short_code)
+    url_meta = _load_stats_meta(short_code)
+
+    if not url_meta:
+        return jsonify({"UrlError": "The requested Url never existed"}), 404
+
+    url_meta["password"] = url_meta.get("password", None)
+    access_error = _json_access_error(short_code, url_meta)
+    if access_error:
+        return access_error
+
+    # Only the time series follows the page's date window
+    window = None
+    if panel == "counter":
+        window, window_error = _parse_window()
+        if window_error:
+            return jsonify({"WindowError": window_error}), 400
+
+    version = get_stats_version(url_meta)
+    variant = f"panel:{panel}"
+    if window:
+        variant = f"{variant}:{_window_key(window)}"
+    etag = get_stats_etag(short_code, version, url_meta["password"], variant=variant)
+
+    if request.if_none_match.contains(etag):
+        return _set_cache_headers(make_response("", 304), etag, url_meta)
+
+    _ensure_materialized(short_code, url_meta)
+    url_data = _compute_stats(
+        short_code,
+        version,
+        top_n=STATS_VIEW_TOP_N if panel in TOP_N_FIELDS else None,
+        window=window,
+        fields=set(STATS_PANELS[panel]),
+        dimension_limit=STATS_MAX_DIMENSION_ENTRIES,
+    )
+    if not url_data:
+        return jsonify({"UrlError": "The requested Url never existed"}), 404
+
+    response = jsonify({"panel": panel, **_format_panel(panel, url_data)})
+    return _set_cache_headers(response, etag, url_meta)
+
+
+@stats.route(
+    "/stats/<short_code>/<any(referrer, bots, country, browser, os_name):dimension>",
+    methods=["GET", "POST"],
+)
+@limiter.exempt
+def dimension_breakdown(short_code, dimension):
+    short_code = unquote(short_code)
+    url_meta = _load_stats_meta(short_code)
+
+    if not url_meta:
+        return jsonify({"UrlError": "The requested Url never existed"}), 404
+
+    url_meta["password"] = url_meta.get("password", None)
+    access_error = _json_access_error(short_code, url_meta)
+    if access_error:
+        return access_error
+
+    limit = request.values.get("limit", DIMENSION_PAGE_DEFAULT_LIMIT)
+    if not is_positive_integer(limit) or not 0 < int(limit) <= DIMENSION_PAGE_MAX_LIMIT:
+        return (
+            jsonify(
+                {
+                    "LimitError": f"limit must be an integer between 1 and {DIMENSION_PAGE_MAX_LIMIT}"
+                }
+            ),
+            400,
+        )
+
+    after = None
+    cursor = request.values.get("cursor")
+    if cursor:
+        after = decode_cursor(cursor)
+        if after is None:
+            return jsonify({"CursorError": "Invalid cursor"}), 400
+
+    # Links created before the materialized view existed are rebuilt first
+    if PAGED_DIMENSIONS[dimension].startswith("$stats."):
+        _ensure_materialized(short_code, url_meta)
+
+    page = load_dimension_page(short_code, dimension, int(limit), after)
+    if page is None:
+        return jsonify({"UrlError": "The requested Url never existed"}), 404
+
+    return jsonify({"short_code": short_code, "dimension": dimension, **page})
+
+
+@stats.route("/stats/<short_code>/live", methods=["GET"])
+@limiter.exempt
+def live_clicks(short_code):
+    """
+    Server-sent events: a `click` event for every click on the link while
+    the stream is open. Only served when LIVE_STATS_ENABLED is set.
+    """
+    if not LIVE_STATS_ENABLED:
+        return jsonify({"LiveError": "Live updates are disabled"}), 404
+
+    short_code = unquote(short_code)
+    url_meta = _load_stats_meta(short_code)
+
+    if not url_meta:
+        return jsonify({"UrlError": "The requested Url never existed"}), 404
+
+    url_meta["password"] = url_meta.get("password", None)
+    access_error = _json_access_error(short_code, url_meta)
+    if access_error:
+        return access_error
+
+    if get_redis_or_none() is None:
+        return jsonify({"LiveError": "Live updates are unavailable"}), 503
+
+    version = url_meta.get("total-clicks", 0)
+
+    def generate():
+        viewer = click_hub.subscribe(short_code)
+        deadline = time.monotonic() + LIVE_MAX_SECONDS
+        try:
+            yield f"retry: 5000\nevent: version\ndata: {version}\n\n"
+            while time.monotonic() < deadline:
+                try:
+                    click = viewer.get(timeout=LIVE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: click\ndata: {json.dumps(click, default=str)}\n\n"
+        finally:
+            click_hub.unsubscribe(short_code, viewer)
+
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+@stats.route("/stats/<short_code>/breakdown", methods=["GET", "POST"])
+@limiter.exempt
+def cross_breakdown(short_code):
+    """
+    Clicks of the link crossed by up to three of country, browser and
+    os_name (`dims=country,browser`), summed from its daily cubes. Values
+    past each day's cap are counted as "other".
+    """
+    short_code = unquote(short_code)
+    url_meta = _load_stats_meta(short_code)
+
+    if not url_meta:
+        return jsonify({"UrlError": "The requested Url never existed"}), 404
+
+    url_meta["password"] = url_meta.get("password", None)
+    access_error = _json_access_error(short_code, url_meta)
+    if access_error:
+        return access_error
+
+    dimensions = [
+        dimension.strip()
+        for dimension in request.values.get("dims", "").split(",")
+        if dimension.strip()
+    ]
+    if (
+        not dimensions
+        or len(set(dimensions)) != len(dimensions)
+        or not set(dimensions) <= set(CUBE_DIMENSIONS)
+    ):
+        return (
+            jsonify(
+                {
+                    "DimsError": "dims must be distinct values of country, browser and os_name"
+                }
+            ),
+            400,
+        )
+
+    start, end, window_error = _parse_days(BREAKDOWN_DEFAULT_DAYS, BREAKDOWN_MAX_DAYS)
+    if window_error:
+        return jsonify({"WindowError": window_error}), 400
+
+    rows = load_breakdown(short_code, dimensions, start.isoformat(), end.isoformat())
+    if rows is None:
+        return jsonify({"StatsError": "Stats are temporarily unavailable"}), 503
+
+    return jsonify(
+        {
+            "short_code": short_code,
+            "dims": dimensions,
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "rows": rows,
+        }
+    )
+
+
+@stats.route("/stats/<short_code>/clicks", methods=["GET", "POST"])
+@limiter.limit("60/hour")
+@limiter.limit("10/minute")
+def raw_clicks(short_code):
+    """
+    Raw click events of the link between the `from` and `to` dates (UTC,
+    YYYY-MM-DD, inclusive; both default to today), streamed as one JSON
+    object per line in the order the clicks happened.
+    """
+    short_code = unquote(short_code)
+    url_meta = _load_stats_meta(short_code)
+
+    if not url_meta:
+        return jsonify({"UrlError": "The requested Url never existed"}), 404
+
+    url_meta["password"] = url_meta.get("password", None)
+    access_error = _json_access_error(short_code, url_meta)
+    if access_error:
+        return access_error
+
+    start, end, window_error = _parse_days(1, CLICK_EXPORT_MAX_DAYS)
+    if window_error:
+        return jsonify({"WindowError": window_error}), 400
+
+    # Clicks of the last moments may still be queued in this process
+    click_log.flush()
+    if click_log.scan_size(short_code, start, end) > CLICK_EXPORT_MAX_BYTES:
+        return jsonify(
+            {"WindowError": "Too many clicks in this range, pick fewer days"}
+        ), 413
+
+    def generate():
+        for event in click_log.iter_clicks(short_code, start, end):
+            event.pop("code", None)
+            yield json.dumps(event, default=str) + "\n"
+
+    download_name = f"my-ket-horse-clicks-{start}-{end}.ndjson"
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/x-ndjson",
+        headers={"Content-Disposition": f"attachment; filename={download_name}"},
+    )
+
+
+def _batch_access_error(short_code, url_meta, passwords, tokens):
+    """
+    `(status, error)` of a link of a batch request that can't be served, or
+    None when its stats may be read.
+    """
+    if url_meta is None:
+        return 404, {"UrlError": "The requested Url never existed"}
+    password = url_meta.get("password")
+    if (
+        password is not None
+        and passwords.get(short_code) != password
+        and not verify_access_token(
+            tokens.get(short_code)
+            or request.cookies.get(access_cookie_name(short_code)),
+            short_code,
+            password,
+        )
+    ):
+        return 400, {"PasswordError": "Invalid Password"}
+    return None
+
+
+@stats.route("/api/stats/batch", methods=["POST"])
+@limiter.limit("100/hour")
+@limiter.limit("10/minute")
+def stats_batch():
+    """
+    Stats of many links in one request, streamed as one JSON object per line
+    in the order the short codes were given. Access to every link is checked
+    on its metadata first; stats are then read and sent a group at a time.
+    """
+    body = request.get_json(silent=True) or {}
+    short_codes = body.get("short_codes")
+    passwords = body.get("passwords") or {}
+    tokens = body.get("tokens") or {}
+
+    if (
+        not isinstance(short_codes, list)
+        or not short_codes
+        or not all(isinstance(code, str) for code in short_codes)
+    ):
+        return jsonify({"BatchError": "short_codes must be a non-empty list"}), 400
+    if len(short_codes) > STATS_BATCH_MAX_LINKS:
+        return (
+            jsonify(
+                {
+                    "BatchError": f"At most {STATS_BATCH_MAX_LINKS} short codes per request"
+                }
+            ),
+            400,
+        )
+    if not isinstance(passwords, dict) or not isinstance(tokens, dict):
+        return (
+            jsonify({"BatchError": "passwords and tokens must map short codes"}),
+            400,
+        )
+
+    fields, fields_error = _parse_fields(body.get("fields"))
+    if fields_error:
+        return jsonify({"FieldsError": fields_error}), 400
+
+    short_codes = list(dict.fromkeys(unquote(code) for code in short_codes))
+    url_metas = load_stats_meta_batch(short_codes)
+    if url_metas is None:
+        return jsonify({"StatsError": "Stats are temporarily unavailable"}), 503
+    errors = {
+        short_code: _batch_access_error(
+            short_code, url_metas.get(short_code), passwords, tokens
+        )
+        for short_code in short_codes
+    }
+
+    def generate():
+        for i in range(0, len(short_codes), STATS_BATCH_FETCH_SIZE):
+            group = short_codes[i : i + STATS_BATCH_FETCH_SIZE]
+            readable = [code for code in group if errors[code] is None]
+            url_docs = {}
+            if readable:
+                url_docs = load_stats_batch(
+                    readable, fields, STATS_MAX_DIMENSION_ENTRIES
+                )
+            for short_code in group:
+                error = errors[short_code]
+                url_data = None if url_docs is None else url_docs.get(short_code)
+                if error is None and url_docs is None:
+                    error = 503, {"StatsError": "Stats are temporarily unavailable"}
+                elif error is None and url_data is None:
+                    # deleted since its metadata was read
+                    error = 404, {"UrlError": "The requested Url never existed"}
+                if error:
+                    status, error = error
+                    line = {"short_code": short_code, "status": status, "error": error}
+                else:
+                    url_data = _finalize_stats(short_code, url_data, fields=fields)
+                    line = {"short_code": short_code, "status": 200, "stats": url_data}
+                yield json.dumps(line, default=str) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+def _format_list():
+    formats = list(EXPORT_FORMATS)
+    return f"{', '.join(formats[:-1])} or {formats[-1]}"
+
+
+def _export_cache_key(short_code, format, version, password):
+    return get_stats_etag(short_code, version, password, variant=f"export:{format}")
+
+
+def _submit_export_job(short_code, format, version, password):
+    # The secret keeps job ids, and so download tokens, unguessable
+    key = f"{current_app.secret_key}|{short_code}|{format}|{version}|{password}"
+    cache_key = _export_cache_key(short_code, format, version, password)
+
+    def build(output):
+        cached = export_cache.get(cache_key)
+        if not cached:
+            url_data = _compute_stats(short_code, version)
+            if not url_data:
+                raise LookupError(f"{short_code} does not exist")
+            # Built into the cache first, so /export serves it from now on
+            cached = export_cache.put(
+                cache_key, lambda file: write_export(url_data, format, file)
+            )
+            if not cached:
+                write_export(url_data, format, output)
+                return
+        with open(cached, "rb") as file:
+            shutil.copyfileobj(file, output)
+
+    return export_jobs.submit(key, build, short_code=short_code, format=format)
+
+
+def _export_job_response(job):
+    status_url = f"{request.host_url}api/export/jobs/{job['id']}"
+    body = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "short_code": job.get("short_code"),
+        "format": job.get("format"),
+        "status_url": status_url,
+    }
+    if job["status"] == "done":
+        body["size"] = job.get("size")
+        body["download_url"] = (
+            f"{status_url}/download?token={issue_download_token(job['id'])}"
+        )
+
+    response = jsonify(body)
+    if job["status"] in ("queued", "running"):
+        response.status_code = 202
+        response.headers["Location"] = status_url
+        response.headers["Retry-After"] = "1"
+    return response
+
+
+@stats.route("/api/export/jobs", methods=["POST"])
+@limiter.exempt
+def create_export_job():
+    """
+    Queue an export to be built in the background. Identical requests share
+    one job; poll `status_url` until it is done, then fetch `download_url`.
+    """
+    short_code = unquote(request.values.get("short_code") or "")
+    format = (request.values.get("format") or "").lower()
+
+    if format not in EXPORT_FORMATS:
+        return (
+            jsonify(
+                {"FormatError": f"Invalid format; format must be {_format_list()}"}
+            ),
+            400,
+        )
+
+    url_meta = _load_stats_meta(short_code) if short_code else None
+    if not url_meta:
+        return jsonify({"UrlError": "The requested Url never existed"}), 404
+
+    url_meta["password"] = url_meta.get("password", None)
+    access_error = _json_access_error(short_code, url_meta)
+    if access_error:
+        return access_error
+
+    job = _submit_export_job(
+        short_code, format, get_stats_version(url_meta), url_meta["password"]
+    )
+    return _export_job_response(job)
+
+
+@stats.route("/api/export/jobs/<job_id>", methods=["GET"])
+@limiter.exempt
+def export_job_status(job_id):
+    job = export_jobs.get(job_id)
+    if job is None:
+        return jsonify({"JobError": "Unknown or expired export job"}), 404
+    return _export_job_response(job)
+
+
+@stats.route("/api/export/jobs/<job_id>/download", methods=["GET"])
+@limiter.exempt
+def download_export_job(job_id):
+    job = export_jobs.get(job_id)
+    if job is None:
+        return jsonify({"JobError": "Unknown or expired export job"}), 404
+    if job["status"] != "done":
+        return jsonify({"JobError": "The export is not ready yet"}), 409
+    if not verify_download_token(request.values.get("token"), job_id, EXPORT_JOB_TTL):
+        return jsonify({"TokenError": "Invalid or expired download token"}), 403
+
+    response = _send_export(export_jobs.artifact_path(job_id), job["format"])
+    if response is None:
+        return jsonify({"JobError": "Unknown or expired export job"}), 404
+    return response
+
+
+def _send_export(path, format):
+    """
+    Export file served straight from disk, or None if it was evicted
+    in the meantime.
+    """
+    mimetype, download_name = EXPORT_FORMATS[format]
+    try:
+        return send_file(
+            path,
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=download_name,
+            etag=False,
+        )
+    except FileNotFoundError:
+        return None
+
+
+def _prefetch(fetch, groups, workers):
+    """
+    `fetch(group)` of every group in order, with up to `workers` groups
+    fetched in parallel ahead of the one being consumed.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        groups = iter(groups)
+        for group in groups:
+            pending.append((group, executor.submit(fetch, group)))
+            if len(pending) >= workers:
+                break
+        while pending:
+            group, future = pending.popleft()
+            for next_group in groups:
+                pending.append((next_group, executor.submit(fetch, next_group)))
+                break
+            yield group, future.result()
+
+
+@stats.route("/api/export/bulk", methods=["POST"])
+@limiter.limit("30/hour")
+@limiter.limit("5/minute")
+def bulk_export():
+    """
+    Exports of many links streamed as one zip archive with a folder per
+    link. Access is checked on every link's metadata first. Exports still
+    in the artifact cache are copied from it; links too popular to export
+    inside a request get a background job instead. The rest are read with
+    batched queries, a few batches ahead of the archive writer, so memory
+    stays bounded by the batches in flight.
+    """
+    body = request.get_json(silent=True) or {}
+    short_codes = body.get("short_codes")
+    format = str(body.get("format") or "csv").lower()
+    passwords = body.get("passwords") or {}
+    tokens = body.get("tokens") or {}
+
+    if (
+        not isinstance(short_codes, list)
+        or not short_codes
+        or not all(isinstance(code, str) for code in short_codes)
+    ):
+        return jsonify({"BulkError": "short_codes must be a non-empty list"}), 400
+    if len(short_codes) > EXPORT_BULK_MAX_LINKS:
+        return (
+            jsonify(
+                {
+                    "BulkError": f"At most {EXPORT_BULK_MAX_LINKS} short codes per request"
+                }
+            ),
+            400,
+        )
+    if not isinstance(passwords, dict) or not isinstance(tokens, dict):
+        return (
+            jsonify({"BulkError": "passwords and tokens must map short codes"}),
+            400,
+        )
+    if format not in EXPORT_FORMATS:
+        return (
+            jsonify(
+                {"FormatError": f"Invalid format; format must be {_format_list()}"}
+            ),
+            400,
+        )
+
+    short_codes = list(dict.fromkeys(unquote(code) for code in short_codes))
+    url_metas = load_stats_meta_batch(short_codes)
+    if url_metas is None:
+        return jsonify({"StatsError": "Stats are temporarily unavailable"}), 503
+
+    errors = {}
+    cache_keys = {}
+    for short_code in short_codes:
+        url_meta = url_metas.get(short_code)
+        access_error = _batch_access_error(short_code, url_meta, passwords, tokens)
+        if access_error:
+            errors[short_code] = access_error[1]
+            continue
+        version = get_stats_version(url_meta)
+        password = url_meta.get("password")
+        cache_key = _export_cache_key(short_code, format, version, password)
+        popular = url_meta.get("total-clicks", 0) >= EXPORT_ASYNC_MIN_CLICKS
+        if popular and not export_cache.get(cache_key):
+            job = _submit_export_job(short_code, format, version, password)
+            errors[short_code] = {
+                "ExportError": "Too many clicks to export in bulk, "
+                "the export is built by a background job",
+                "job_id": job["id"],
+                "status_url": f"{request.host_url}api/export/jobs/{job['id']}",
+            }
+            continue
+        cache_keys[short_code] = cache_key
+
+    groups = [
+        short_codes[i : i + EXPORT_BULK_FETCH_SIZE]
+        for i in range(0, len(short_codes), EXPORT_BULK_FETCH_SIZE)
+    ]
+
+    def fetch(group):
+        # Only links that are readable and not cached need their stats
+        codes = [
+            code
+            for code in group
+            if code in cache_keys and not export_cache.get(cache_keys[code])
+        ]
+        return load_stats_batch(codes) if codes else {}
+
+    def links():
+        for group, url_docs in _prefetch(fetch, groups, EXPORT_BULK_FETCH_WORKERS):
+            for short_code in group:
+                if short_code in errors:
+                    yield short_code, None, errors[short_code]
+                    continue
+                cached = export_cache.get(cache_keys[short_code])
+                if cached:
+                    yield short_code, cached, None
+                    continue
+                url_data = None if url_docs is None else url_docs.get(short_code)
+                if url_docs is None:
+                    error = {"StatsError": "Stats are temporarily unavailable"}
+                    yield short_code, None, error
+                    continue
+                if url_data is None:
+                    # deleted since its metadata was read
+                    error = {"UrlError": "The requested Url never existed"}
+                    yield short_code, None, error
+                    continue
+                url_data = _finalize_stats(short_code, url_data)
+                # Built into the cache, so /export can serve it from now on
+                cached = export_cache.put(
+                    cache_keys[short_code],
+                    lambda file: write_export(url_data, format, file),
+                )
+                yield short_code, cached or url_data, None
+
+    return bulk_export_response(stream_with_context(links()), format)
 
 
 @stats.route("/export/<short_code>/<format>", methods=["GET", "POST"])
@@ -210,15 +1342,14 @@ def export(short_code, format):
     format = format.lower()
     password = request.values.get("password")
     short_code = unquote(short_code)
-    pipeline = get_stats_pipeline(short_code)
 
-    if format not in ["csv", "json", "xlsx", "xml"]:
+    if format not in EXPORT_FORMATS:
         if request.method == "GET":
             return (
                 render_template(
                     "error.html",
                     error_code="400",
-                    error_message="Invalid format, format must be json, csv, xml or xlsx",
+                    error_message=f"Invalid format, format must be {_format_list()}",
                     host_url=request.host_url,
                 ),
                 400,
@@ -226,34 +1357,23 @@ def export(short_code, format):
         else:
             return (
                 jsonify(
-                    {
-                        "FormatError": "Invalid format; format must be json, csv, xlsx or xml"
-                    }
+                    {"FormatError": f"Invalid format; format must be {_format_list()}"}
                 ),
                 400,
             )
 
-    if validate_emoji_alias(short_code):
-        url_data = aggregate_emoji_url(pipeline)
-    else:
-        url_data = aggregate_url(pipeline)
+    url_meta = _load_stats_meta(short_code)
 
-    if not url_data:
-        if request.method == "GET":
-            return (
-                render_template(
-                    "error.html",
-                    error_code="404",
-                    error_message="URL NOT FOUND",
-                    host_url=request.host_url,
-                ),
-                404,
-            )
-        else:
-            return jsonify({"UrlError": "The requested Url never existed"}), 404
+    if not url_meta:
+        return _url_not_found()
 
-    if url_data["password"] is not None:
-        if password != url_data["password"]:
+    url_meta["password"] = url_meta.get("password", None)
+    access_token = None
+
+    if url_meta["password"] is not None and not has_valid_access_token(
+        short_code, url_meta["password"]
+    ):
+        if password != url_meta["password"]:
             if request.method == "POST":
                 return (
                     jsonify(
@@ -274,38 +1394,44 @@ def export(short_code, format):
                     ),
                     400,
                 )
+        access_token = issue_access_token(short_code, url_meta["password"])
 
-    url_data["short_code"] = short_code
+    version = get_stats_version(url_meta)
+    # The ETag doubles as the artifact cache key: both change with the stats
+    # version, the format and the password
+    etag = _export_cache_key(short_code, format, version, url_meta["password"])
 
-    if url_data["max-clicks"] is not None:
-        url_data["expired"] = url_data["total-clicks"] >= int(url_data["max-clicks"])
-    else:
-        url_data["expired"] = None
-
-    if url_data["expiration-time"] is not None:
-        expiration_time = convert_to_gmt(url_data["expiration-time"])
-        if not expiration_time:
-            print("Expiration time is not timezone aware")
-        elif expiration_time <= datetime.now(timezone.utc):
-            url_data["expired"] = True
-
-    (
-        url_data["average_daily_clicks"],
-        url_data["average_weekly_clicks"],
-        url_data["average_monthly_clicks"],
-    ) = calculate_click_averages(url_data)
-
-    if url_data["counter"] != {}:
-        url_data = add_missing_dates("counter", url_data)
-
-    if url_data["unique_counter"] != {}:
-        url_data = add_missing_dates("unique_counter", url_data)
-
-    if format == "json":
-        return export_to_json(url_data)
-    elif format == "csv":
-        return export_to_csv(url_data)
-    elif format == "xlsx":
-        return export_to_excel(url_data)
-    elif format == "xml":
-        return export_to_xml(url_data)
+    if request.if_none_match.contains(etag):
+        response = _set_cache_headers(make_response("", 304), etag, url_meta)
+        return _grant_access(response, short_code, url_meta, access_token)
+
+    # No clicks since the last build: serve the file as it is
+    cached = export_cache.get(etag)
+    if cached:
+        response = _send_export(cached, format)
+        if response is not None:
+            response = _set_cache_headers(response, etag, url_meta)
+            return _grant_access(response, short_code, url_meta, access_token)
+
+    # Web workers never build the exports of very popular links themselves
+    if url_meta.get("total-clicks", 0) >= EXPORT_ASYNC_MIN_CLICKS:
+        job = _submit_export_job(short_code, format, version, url_meta["password"])
+        response = _export_job_response(job)
+        return _grant_access(response, short_code, url_meta, access_token)
+
+    url_data = _compute_stats(short_code, version)
+
+    if not url_data:
+        return _url_not_found()
+
+    cached = export_cache.put(
+        etag, lambda output: write_export(url_data, format, output)
+    )
+    response = _send_export(cached, format) if cached else None
+    if response is not None:
+        response = _set_cache_headers(response, etag, url_meta)
+        return _grant_access(response, short_code, url_meta, access_token)
+
+    response = export_response(url_data, format)
+    response = _set_cache_headers(response, etag, url_meta)
+    return _grant_access(response, short_code, url_meta, access_token)
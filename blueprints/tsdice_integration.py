@@ -20,6 +20,8 @@ from utils.mongo_utils import (
     emoji_urls_collection,
 )
 from utils.general import humanize_number
+from utils.counter_utils import get_global_counters
+from utils.pipeline_utils import empty_stats
 from datetime import datetime
 from urllib.parse import unquote
 import os
@@ -152,6 +154,7 @@ def share_particle_config():
         "counter": {},
         "total-clicks": 0,
         "ips": [],
+        "stats": empty_stats(),
         "creation-date": datetime.now().strftime("%Y-%m-%d"),
         "creation-time": datetime.now().strftime("%H:%M:%S"),
         "creation-ip-address": get_client_ip(),
@@ -194,20 +197,21 @@ def tsdice_leaderboard():
     Shows top 20 most clicked tsdice links
     """
 
-    # Get top configs from both collections
+    # tsdice links are all emoji links
     top_configs = list(emoji_urls_collection.find(
         {"tsdice-config": True}
     ).sort("total-clicks", -1).limit(20))
 
-    # Calculate stats
-    total_configs = emoji_urls_collection.count_documents({"tsdice-config": True})
-    total_clicks = sum(config.get("total-clicks", 0) for config in top_configs)
+    # Totals come from the global counters, not a count over the collection
+    tsdice_counters = (get_global_counters() or {}).get(
+        "tsdice", {"links": 0, "clicks": 0}
+    )
 
     return render_template(
         "tsdice_leaderboard.html",
         configs=top_configs,
-        total_configs=humanize_number(total_configs),
-        total_clicks=humanize_number(total_clicks),
+        total_configs=humanize_number(tsdice_counters["links"]),
+        total_clicks=humanize_number(tsdice_counters["clicks"]),
         host_url=request.host_url
     )
 
@@ -219,45 +223,28 @@ def tsdice_analytics():
     Public endpoint for embedding stats
     """
 
-    pipeline = [
-        {"$match": {"tsdice-config": True}},
-        {"$group": {
-            "_id": None,
-            "total_configs_shared": {"$sum": 1},
-            "total_clicks": {"$sum": "$total-clicks"},
-            "avg_clicks_per_config": {"$avg": "$total-clicks"}
-        }},
-        {"$project": {
-            "_id": 0,
-            "total_configs_shared": 1,
-            "total_clicks": 1,
-            "avg_clicks_per_config": {"$round": ["$avg_clicks_per_config", 2]}
-        }}
-    ]
-
-    try:
-        result = list(emoji_urls_collection.aggregate(pipeline))
-        if result:
-            stats = result[0]
-        else:
-            stats = {
-                "total_configs_shared": 0,
-                "total_clicks": 0,
-                "avg_clicks_per_config": 0
-            }
-
-        # Add humanized versions
-        stats["total_configs_shared_display"] = humanize_number(stats["total_configs_shared"])
-        stats["total_clicks_display"] = humanize_number(stats["total_clicks"])
-
-        return jsonify(stats)
-    except Exception as e:
+    counters = get_global_counters()
+    if counters is None:
         return jsonify({
             "error": "Failed to fetch analytics",
             "total_configs_shared": 0,
             "total_clicks": 0
         }), 500
 
+    configs = counters["tsdice"]["links"]
+    clicks = counters["tsdice"]["clicks"]
+    stats = {
+        "total_configs_shared": configs,
+        "total_clicks": clicks,
+        "avg_clicks_per_config": round(clicks / configs, 2) if configs else 0,
+    }
+
+    # Add humanized versions
+    stats["total_configs_shared_display"] = humanize_number(stats["total_configs_shared"])
+    stats["total_clicks_display"] = humanize_number(stats["total_clicks"])
+
+    return jsonify(stats)
+
 
 @tsdice.route("/result/tsdice/<short_code>")
 def tsdice_result(short_code):
@@ -24,11 +24,11 @@ from utils.mongo_utils import (
     check_if_slug_exists,
     check_if_emoji_alias_exists,
     validate_blocked_url,
-    urls_collection,
 )
 from utils.general import is_positive_integer, humanize_number
+from utils.pipeline_utils import empty_stats
+from utils.counter_utils import get_global_counters
 from .limiter import limiter
-from cache import dual_cache
 
 import json
 from datetime import datetime
@@ -137,6 +137,7 @@ def shorten_url():
         "counter": {},
         "total-clicks": 0,
         "ips": [],
+        "stats": empty_stats(),
         "creation-date": datetime.now().strftime("%Y-%m-%d"),
         "creation-time": datetime.now().strftime("%H:%M:%S"),
         "creation-ip-address": get_client_ip(),
@@ -237,6 +238,7 @@ def emoji():
         "counter": {},
         "total-clicks": 0,
         "ips": [],
+        "stats": empty_stats(),
         "creation-date": datetime.now().strftime("%Y-%m-%d"),
         "creation-time": datetime.now().strftime("%H:%M:%S"),
         "creation-ip-address": get_client_ip(),
@@ -313,27 +315,20 @@ def result(short_code):
         )
 
 
-METRIC_PIPELINE = [
-    {
-        "$group": {
-            "_id": None,
-            "total-shortlinks": {"$sum": 1},
-            "total-clicks": {"$sum": "$total-clicks"},
-        }
-    }
-]
-
-
 @url_shortener.route("/metric")
 @limiter.exempt
 def metric():
-    def query():
-        result = urls_collection.aggregate(METRIC_PIPELINE).next()
-        del result["_id"]
-        result["total-clicks-raw"] = result["total-clicks"]
-        result["total-shortlinks-raw"] = result["total-shortlinks"]
-        result["total-clicks"] = humanize_number(result["total-clicks"])
-        result["total-shortlinks"] = humanize_number(result["total-shortlinks"])
-        return result
-
-    return jsonify(dual_cache.get_or_set("metrics", query))
+    counters = get_global_counters()
+    if counters is None:
+        return jsonify({"MetricError": "Metrics are temporarily unavailable"}), 503
+
+    total_clicks = counters["urls"]["clicks"] + counters["emojis"]["clicks"]
+    total_shortlinks = counters["urls"]["links"] + counters["emojis"]["links"]
+    return jsonify(
+        {
+            "total-clicks": humanize_number(total_clicks),
+            "total-shortlinks": humanize_number(total_shortlinks),
+            "total-clicks-raw": total_clicks,
+            "total-shortlinks-raw": total_shortlinks,
+        }
+    )
@@ -1,10 +1,12 @@
 """
 Main cache module.
-Intializes the cache query and dual cache instances.
+Intializes the cache query, stats and dual cache instances.
 """
 
 from .dual_cache import DualCache
 from .cache_url import UrlCache
+from .cache_stats import StatsCache
 
 cache_query = UrlCache(ttl_seconds=300)
+stats_cache = StatsCache(ttl_seconds=300)
 dual_cache = DualCache(primary_ttl=300, stale_ttl=1800, lock_ttl=30)
@@ -1,22 +1,25 @@
-from typing import Optional
+from typing import Any, Callable, Optional
 from redis import Redis
-from .redis_client import get_redis
+from .redis_client import call_redis, get_redis_or_none
 
 
 class BaseCache:
-    def __init__(self):
-        try:
-            self.r: Optional[Redis] = get_redis()
-        except Exception as e:
-            print(f"[BaseCache] Could not initialize Redis: {e}")
-            self.r = None
+    @property
+    def r(self) -> Optional[Redis]:
+        """
+        Redis client for the current process, resolved lazily so the pool is
+        created after fork. None while Redis is unavailable.
+        """
+        return get_redis_or_none()
+
+    def _call(self, operation: Callable[[Redis], Any], default: Any = None) -> Any:
+        return call_redis(operation, default)
 
     def get(self, key: str):
-        return self.r.get(key) if self.r else None
+        return self._call(lambda r: r.get(key))
 
     def set(self, key: str, value: str, ex: int):
-        return self.r.setex(key, ex, value) if self.r else None
+        return self._call(lambda r: r.setex(key, ex, value))
 
     def delete(self, key: str):
-        if self.r:
-            self.r.delete(key)
+        self._call(lambda r: r.delete(key))
@@ -0,0 +1,30 @@
+import json
+from typing import Any, Dict, Optional
+from .base_cache import BaseCache
+
+
+class StatsCache(BaseCache):
+    """
+    Computed stats payloads keyed by short code and a version stamp, so an
+    entry goes stale on its own as soon as the link records a new click.
+    """
+
+    def __init__(self, ttl_seconds: int = 300):
+        super().__init__()
+        self.ttl_seconds = ttl_seconds
+
+    def _key(self, short_code: str, version: str) -> str:
+        return f"stats:{short_code}:{version}"
+
+    def get_stats(self, short_code: str, version: str) -> Optional[Dict[str, Any]]:
+        raw = self.get(self._key(short_code, version))
+        if not raw:
+            return None
+        try:
+            return json.loads(raw)
+        except (json.JSONDecodeError, TypeError) as e:
+            print(f"[StatsCache] Redis GET error: {e}")
+            return None
+
+    def set_stats(self, short_code: str, version: str, stats: Dict[str, Any]) -> None:
+        self.set(self._key(short_code, version), json.dumps(stats), self.ttl_seconds)
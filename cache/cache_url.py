@@ -2,7 +2,6 @@ import json
 from typing import Optional
 from dataclasses import dataclass
 from .base_cache import BaseCache
-from redis.exceptions import RedisError
 
 
 @dataclass
@@ -11,6 +10,7 @@ class UrlData:
     short_code: str
     password: Optional[str]
     block_bots: bool
+    tsdice: bool = False
 
 
 class UrlCache(BaseCache):
@@ -19,24 +19,19 @@ class UrlCache(BaseCache):
         self.ttl_seconds = ttl_seconds
 
     def set_url_data(self, short_code: str, url_data: UrlData) -> None:
-        if not self.r:
-            return
-        try:
-            key = f"meta:{short_code}"
-            self.r.set(key, json.dumps(url_data.__dict__), ex=self.ttl_seconds)
-        except RedisError as e:
-            print(f"[UrlCache] Redis SET error: {e}")
+        key = f"meta:{short_code}"
+        self._call(
+            lambda r: r.set(key, json.dumps(url_data.__dict__), ex=self.ttl_seconds)
+        )
 
     def get_url_data(self, short_code: str) -> Optional[UrlData]:
-        if not self.r:
+        key = f"meta:{short_code}"
+        raw = self._call(lambda r: r.get(key))
+        if not raw:
             return None
         try:
-            key = f"meta:{short_code}"
-            raw = self.r.get(key)
-            if not raw:
-                return None
             data = json.loads(raw)
             return UrlData(**data)
-        except (RedisError, json.JSONDecodeError, TypeError) as e:
+        except (json.JSONDecodeError, TypeError) as e:
             print(f"[UrlCache] Redis GET error: {e}")
             return None
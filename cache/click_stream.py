@@ -0,0 +1,150 @@
+import json
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from redis.exceptions import RedisError
+
+from .redis_client import call_redis, get_redis_or_none
+
+# Clicks buffered per viewer; a viewer that falls further behind loses the
+# oldest updates rather than holding memory for everyone else.
+LIVE_QUEUE_SIZE = int(os.environ.get("LIVE_QUEUE_SIZE", 100))
+LIVE_POLL_SECONDS = 0.5
+LIVE_RETRY_SECONDS = 5
+
+
+def click_channel(short_code: str) -> str:
+    return f"clicks:{short_code}"
+
+
+def publish_click(short_code: str, click: Dict[str, Any]) -> None:
+    """
+    Announce a recorded click to live viewers. Best effort: skipped when
+    Redis is unavailable.
+    """
+    message = json.dumps(click, default=str)
+    call_redis(lambda r: r.publish(click_channel(short_code), message))
+
+
+class ClickHub:
+    """
+    Per-process fan-out of click announcements. All viewers of a link in this
+    process share a single Redis subscription, held by one listener thread
+    that owns the PubSub connection; viewers only ever touch their own queue.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._viewers: Dict[str, Set[queue.Queue]] = {}
+        self._subscribed: Set[str] = set()
+        self._changed = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def subscribe(self, short_code: str) -> queue.Queue:
+        viewer: queue.Queue = queue.Queue(maxsize=LIVE_QUEUE_SIZE)
+        with self._lock:
+            self._viewers.setdefault(short_code, set()).add(viewer)
+            self._ensure_listener()
+        self._changed.set()
+        return viewer
+
+    def unsubscribe(self, short_code: str, viewer: queue.Queue) -> None:
+        with self._lock:
+            viewers = self._viewers.get(short_code)
+            if viewers is not None:
+                viewers.discard(viewer)
+                if not viewers:
+                    del self._viewers[short_code]
+        self._changed.set()
+
+    def viewer_count(self, short_code: str) -> int:
+        with self._lock:
+            return len(self._viewers.get(short_code, ()))
+
+    def dispatch(self, short_code: str, click: Dict[str, Any]) -> None:
+        with self._lock:
+            viewers = list(self._viewers.get(short_code, ()))
+        for viewer in viewers:
+            try:
+                viewer.put_nowait(click)
+            except queue.Full:
+                try:
+                    viewer.get_nowait()
+                    viewer.put_nowait(click)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def _ensure_listener(self) -> None:
+        # Threads don't survive a fork; start one per worker process
+        if self._thread is None or self._pid != os.getpid():
+            self._subscribed = set()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._listen, name="click-hub", daemon=True
+            )
+            self._thread.start()
+
+    def _wanted_channels(self) -> Set[str]:
+        with self._lock:
+            return {click_channel(code) for code in self._viewers}
+
+    def _sync_subscriptions(self, pubsub) -> None:
+        wanted = self._wanted_channels()
+        added: List[str] = sorted(wanted - self._subscribed)
+        removed: List[str] = sorted(self._subscribed - wanted)
+        if added:
+            pubsub.subscribe(*added)
+        if removed:
+            pubsub.unsubscribe(*removed)
+        self._subscribed = wanted
+
+    def _listen(self) -> None:
+        pubsub = None
+        while True:
+            if pubsub is None:
+                client = get_redis_or_none()
+                if client is None:
+                    time.sleep(LIVE_RETRY_SECONDS)
+                    continue
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                self._subscribed = set()
+
+            try:
+                if self._changed.is_set():
+                    self._changed.clear()
+                    self._sync_subscriptions(pubsub)
+
+                if not self._subscribed:
+                    self._changed.wait(LIVE_POLL_SECONDS)
+                    continue
+
+                message = pubsub.get_message(timeout=LIVE_POLL_SECONDS)
+            except RedisError as e:
+                print(f"[ClickHub] Redis error, resubscribing: {e}")
+                try:
+                    pubsub.close()
+                except RedisError:
+                    pass
+                pubsub = None
+                self._changed.set()
+                time.sleep(LIVE_RETRY_SECONDS)
+                continue
+
+            if not message or message.get("type") != "message":
+                continue
+
+            channel = message["channel"]
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            try:
+                click = json.loads(message["data"])
+            except ValueError:
+                continue
+            self.dispatch(channel.split(":", 1)[1], click)
+
+
+click_hub = ClickHub()
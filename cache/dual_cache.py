@@ -13,7 +13,9 @@ class DualCache(BaseCache):
         self.lock_ttl = lock_ttl
 
     def _lock(self, key: str) -> bool:
-        return self.r and self.r.set(key, "1", nx=True, ex=self.lock_ttl)
+        return bool(
+            self._call(lambda r: r.set(key, "1", nx=True, ex=self.lock_ttl), False)
+        )
 
     def _run_in_thread(self, fn: Callable):
         thread = threading.Thread(target=fn, daemon=True)
@@ -31,6 +33,10 @@ class DualCache(BaseCache):
         def deserialize(raw):
             return json.loads(raw)
 
+        # Redis unavailable (unconfigured or circuit open) — go straight to the DB
+        if self.r is None:
+            return query_fn()
+
         primary_key = f"{base_key}:live"
         stale_key = f"{base_key}:stale"
         lock_key = f"{base_key}:lock"
@@ -0,0 +1,104 @@
+import os
+import tempfile
+import threading
+from typing import Any, BinaryIO, Callable, Optional
+
+# Built export files are kept on local disk (where send_file can hand them to
+# the server without copying) up to this many bytes in total; 0 disables.
+EXPORT_CACHE_DIR = os.environ.get("EXPORT_CACHE_DIR") or os.path.join(
+    tempfile.gettempdir(), "ket-horse-export-cache"
+)
+EXPORT_CACHE_MAX_BYTES = int(os.environ.get("EXPORT_CACHE_MAX_BYTES", 512 * 2**20))
+
+
+class ExportCache:
+    """
+    Size-bounded LRU cache of export artifacts on disk. Keys already encode
+    the link, format and stats version, so entries never need invalidating;
+    stale ones simply stop being asked for and age out. Recency is tracked
+    through file modification times, which every worker of a host shares.
+    """
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.artifact")
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Path of the cached artifact for `key`, marked as recently used, or
+        None on a miss.
+        """
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def put(self, key: str, write: Callable[[BinaryIO], Any]) -> Optional[str]:
+        """
+        Build the artifact for `key` with `write(file)` and cache it. Returns
+        its path, or None when the cache is disabled or the disk write failed.
+        Errors raised by `write` itself are passed on.
+        """
+        if not self.enabled:
+            return None
+        tmp_path = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as file:
+                write(file)
+            os.replace(tmp_path, self._path(key))
+            tmp_path = None
+        except OSError as e:
+            print(f"[ExportCache] Error writing {key}: {e}")
+            return None
+        finally:
+            # Half-written files never stay behind, whatever `write` raised
+            if tmp_path is not None:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+
+        self._evict(keep=self._path(key))
+        return self._path(key)
+
+    def _evict(self, keep: str) -> None:
+        with self._lock:
+            entries = []
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if not entry.name.endswith(".artifact"):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.unlink(path)
+                except OSError:
+                    continue
+                total -= size
+
+
+export_cache = ExportCache(EXPORT_CACHE_DIR, EXPORT_CACHE_MAX_BYTES)
@@ -1,23 +1,169 @@
 import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
 import redis
 from redis.exceptions import RedisError
 
-_redis_instance = None  # singleton
+# Short timeouts so a Redis brown-out costs milliseconds, not a full socket
+# timeout, before callers fall back to MongoDB.
+REDIS_CONNECT_TIMEOUT = float(os.environ.get("REDIS_CONNECT_TIMEOUT", 0.25))
+REDIS_SOCKET_TIMEOUT = float(os.environ.get("REDIS_SOCKET_TIMEOUT", 0.25))
+REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", 32))
+
+# Circuit breaker settings
+REDIS_FAILURE_THRESHOLD = int(os.environ.get("REDIS_FAILURE_THRESHOLD", 3))
+REDIS_COOLDOWN_SECONDS = float(os.environ.get("REDIS_COOLDOWN_SECONDS", 30))
+
+
+class CircuitBreaker:
+    """
+    Skips Redis for `cooldown_seconds` after `failure_threshold` consecutive
+    failures. Once the cool-off window has passed a single probe call is let
+    through (half-open); its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, failure_threshold: int = 3, cooldown_seconds: float = 30):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.failures: int = 0
+        self.opened_at: Optional[float] = None
+        self._probing: bool = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown_seconds:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._probing:
+                return False
+            if time.monotonic() - self.opened_at >= self.cooldown_seconds:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.reset()
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self._probing:
+                    print(
+                        f"[RedisClient] Circuit opened for {self.cooldown_seconds}s "
+                        f"after {self.failures} failure(s)."
+                    )
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+
+breaker = CircuitBreaker(REDIS_FAILURE_THRESHOLD, REDIS_COOLDOWN_SECONDS)
+
+# Per-process state; rebuilt lazily the first time it is used after a fork so
+# gunicorn workers never share sockets with the master.
+_pid: Optional[int] = None
+_pool: Optional[redis.ConnectionPool] = None
+_redis_instance: Optional[redis.Redis] = None
+_init_lock = threading.Lock()
 
 
 def get_redis() -> redis.Redis:
-    global _redis_instance
-    if _redis_instance is None:
+    global _pid, _pool, _redis_instance
+    if _redis_instance is None or _pid != os.getpid():
         redis_uri = os.environ.get("REDIS_URI", None)
         if not redis_uri:
             raise RuntimeError("[RedisClient] No REDIS_URI provided.")
 
-        try:
-            _redis_instance = redis.Redis.from_url(redis_uri)
-            _redis_instance.ping()
-            print("[RedisClient] Connected to Redis.")
-        except RedisError as e:
-            print(f"[RedisClient] Redis connection failed: {e}")
-            raise e
+        with _init_lock:
+            if _redis_instance is None or _pid != os.getpid():
+                _pool = redis.ConnectionPool.from_url(
+                    redis_uri,
+                    max_connections=REDIS_MAX_CONNECTIONS,
+                    socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+                    socket_timeout=REDIS_SOCKET_TIMEOUT,
+                    health_check_interval=30,
+                )
+                _redis_instance = redis.Redis(connection_pool=_pool)
+                _pid = os.getpid()
+                breaker.reset()
 
     return _redis_instance
+
+
+def get_redis_or_none() -> Optional[redis.Redis]:
+    """
+    Return the client for this process, or None when Redis is not configured
+    or the circuit breaker is currently open.
+    """
+    if breaker.state == "open":
+        return None
+    try:
+        return get_redis()
+    except RuntimeError:
+        return None
+
+
+def call_redis(operation: Callable[[redis.Redis], Any], default: Any = None) -> Any:
+    """
+    Run `operation` against Redis through the circuit breaker.
+    Returns `default` instead of raising when Redis is unavailable.
+    """
+    if not breaker.allow():
+        return default
+    try:
+        client = get_redis()
+    except RuntimeError:
+        # Also ends a half-open probe, so the breaker can't stay probing
+        breaker.record_failure()
+        return default
+
+    try:
+        result = operation(client)
+    except RedisError as e:
+        breaker.record_failure()
+        print(f"[RedisClient] Redis error: {e}")
+        return default
+
+    breaker.record_success()
+    return result
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """
+    Connection pool utilization for the current process.
+    """
+    stats: Dict[str, Any] = {
+        "pid": os.getpid(),
+        "breaker": breaker.state,
+        "consecutive_failures": breaker.failures,
+    }
+    if _pool is None or _pid != os.getpid():
+        stats["initialized"] = False
+        return stats
+
+    in_use = len(_pool._in_use_connections)
+    stats.update(
+        {
+            "initialized": True,
+            "max_connections": _pool.max_connections,
+            "created_connections": _pool._created_connections,
+            "in_use_connections": in_use,
+            "available_connections": len(_pool._available_connections),
+            "utilization": round(in_use / _pool.max_connections, 3),
+        }
+    )
+    return stats
@@ -1,4 +1,6 @@
 import atexit
+import hmac
+import os
 
 from flask import (
     Flask,
@@ -11,6 +13,7 @@ from flask_cors import CORS
 from flask_wtf.csrf import CSRFProtect
 # from flask_compress import Compress  # Disabled: Vercel handles compression at edge level
 
+from blueprints.analytics import analytics
 from blueprints.api import api
 from blueprints.contact import contact
 from blueprints.docs import docs
@@ -20,7 +23,8 @@ from blueprints.stats import stats
 from blueprints.url_shortener import url_shortener
 from blueprints.redirector import url_redirector
 from blueprints.tsdice_integration import tsdice
-from utils.mongo_utils import client
+from utils.mongo_utils import close_client, get_bulkhead_stats
+from cache.redis_client import get_pool_stats
 
 app = Flask(__name__)
 CORS(app)
@@ -59,6 +63,7 @@ app.register_blueprint(seo)
 app.register_blueprint(contact)
 app.register_blueprint(api)
 app.register_blueprint(stats)
+app.register_blueprint(analytics)
 
 
 @app.after_request
@@ -77,6 +82,28 @@ def add_security_headers(response):
     return response
 
 
+@app.route("/health")
+@limiter.exempt
+def health():
+    """
+    ok or degraded for anyone; pool and bulkhead internals only with the
+    HEALTH_API_KEY in `X-API-Key`.
+    """
+    redis_stats = get_pool_stats()
+    mongodb_stats = get_bulkhead_stats()
+    degraded = redis_stats["breaker"] != "closed" or any(
+        bulkhead["in_use"] >= bulkhead["max_concurrent"]
+        for bulkhead in mongodb_stats.values()
+    )
+    body = {"status": "degraded" if degraded else "ok"}
+
+    api_key = os.environ.get("HEALTH_API_KEY")
+    given = request.headers.get("X-API-Key") or ""
+    if api_key and hmac.compare_digest(given.encode(), api_key.encode()):
+        body.update({"redis": redis_stats, "mongodb": mongodb_stats})
+    return jsonify(body)
+
+
 @app.errorhandler(404)
 def page_not_found(error):
     return (
@@ -105,13 +132,13 @@ def internal_server_error(e):
 
 
 def shutdown_session():
-    client.close()
+    close_client()
 
 
 @atexit.register
 def cleanup():
     try:
-        client.close()
+        close_client()
         print("MongoDB connection closed successfully")
     except Exception as e:
         print(f"Error closing MongoDB connection: {e}")
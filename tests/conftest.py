@@ -4,6 +4,9 @@ import mongomock
 from flask_wtf.csrf import CSRFProtect
 from blueprints.url_shortener import url_shortener
 from blueprints.stats import stats
+from blueprints.redirector import url_redirector
+from blueprints.analytics import analytics
+from blueprints.tsdice_integration import tsdice
 
 
 @pytest.fixture
@@ -18,6 +21,9 @@ def client():
 
     app.register_blueprint(url_shortener)
     app.register_blueprint(stats)
+    app.register_blueprint(url_redirector)
+    app.register_blueprint(analytics)
+    app.register_blueprint(tsdice)
 
     with app.test_client() as client:
         yield client
@@ -28,3 +34,29 @@ def mock_db():
     # Create a mock database
     mock_db = mongomock.MongoClient().db
     return mock_db
+
+
+@pytest.fixture(autouse=True)
+def export_dirs(tmp_path, monkeypatch):
+    # Keep export jobs and cached artifacts of different tests apart
+    from cache.export_cache import export_cache
+    from utils.export_jobs import export_jobs
+
+    monkeypatch.setattr(export_cache, "directory", str(tmp_path / "export-cache"))
+    monkeypatch.setattr(export_jobs, "directory", str(tmp_path / "export-jobs"))
+
+
+@pytest.fixture(autouse=True)
+def click_log_dirs(tmp_path, monkeypatch):
+    from utils import click_log as click_log_module
+    from utils.click_log import click_log
+    from utils.click_warehouse import click_warehouse
+
+    monkeypatch.setattr(click_log, "directory", str(tmp_path / "click-log"))
+    # Subscribers that can't reach the test database give up without waiting
+    monkeypatch.setattr(click_log_module, "CLICK_LOG_RETRY_SECONDS", 0)
+    monkeypatch.setattr(click_warehouse, "path", str(tmp_path / "clicks.sqlite3"))
+    yield
+    # Nothing a test queued may end up in the next test's directories
+    click_log.flush()
+    click_log.drain()
@@ -0,0 +1,142 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from utils.click_log import click_log
+from utils.click_warehouse import click_warehouse
+
+API_KEY = {"X-API-Key": "analytics-key"}
+
+
+@pytest.fixture(autouse=True)
+def analytics_key(monkeypatch):
+    monkeypatch.setenv("ANALYTICS_API_KEY", "analytics-key")
+
+
+def _log_clicks():
+    now = datetime.now(timezone.utc).timestamp()
+    last_month = now - 30 * 24 * 3600
+    for t, code, tsdice, country in [
+        (now, "😀🎲", True, "Germany"),
+        (now, "😀🎲", True, "Germany"),
+        (now, "🎲🎲", True, "France"),
+        (now, "plain", False, "France"),
+        (now, "plain", False, "France"),
+        (now, "plain", False, "Japan"),
+        (last_month, "😀🎲", True, "Japan"),
+    ]:
+        event = {"t": t, "code": code, "country": country}
+        if tsdice:
+            event["tsdice"] = True
+        click_log.append(event)
+    click_log.flush()
+    click_log.drain()
+
+
+def test_click_log_batches_feed_warehouse():
+    _log_clicks()
+    columns, rows = click_warehouse.query(
+        "SELECT short_code, COUNT(*) FROM click_events "
+        "GROUP BY short_code ORDER BY short_code"
+    )
+    assert columns == ["short_code", "COUNT(*)"]
+    assert rows == [("plain", 3), ("🎲🎲", 1), ("😀🎲", 3)]
+
+
+def test_report_top_countries_of_tsdice_links(client):
+    _log_clicks()
+
+    response = client.get(
+        "/api/internal/analytics/reports/top_countries",
+        query_string={"scope": "tsdice"},
+        headers=API_KEY,
+    )
+    assert response.status_code == 200
+    assert response.json["rows"] == [
+        {"key": "Germany", "clicks": 2},
+        {"key": "France", "clicks": 1},
+    ]
+
+    response = client.get(
+        "/api/internal/analytics/reports/top_countries",
+        query_string={"limit": 1},
+        headers=API_KEY,
+    )
+    assert response.json["rows"] == [{"key": "France", "clicks": 3}]
+
+    start = datetime.now(timezone.utc) - timedelta(days=40)
+    response = client.get(
+        "/api/internal/analytics/reports/top_links",
+        query_string={"from": f"{start:%Y-%m-%d}", "scope": "tsdice"},
+        headers=API_KEY,
+    )
+    assert [row["key"] for row in response.json["rows"]] == ["😀🎲", "🎲🎲"]
+
+
+@pytest.mark.parametrize(
+    "query_string, status",
+    [
+        ({"scope": "everyone"}, 400),
+        ({"limit": 0}, 400),
+        ({"from": "2024-02-01", "to": "2024-01-01"}, 400),
+        ({"to": "tomorrow"}, 400),
+    ],
+)
+def test_report_invalid_request(client, query_string, status):
+    response = client.get(
+        "/api/internal/analytics/reports/top_countries",
+        query_string=query_string,
+        headers=API_KEY,
+    )
+    assert response.status_code == status
+
+
+def test_analytics_requires_api_key(client, monkeypatch):
+    response = client.get("/api/internal/analytics/reports")
+    assert response.status_code == 401
+    response = client.get(
+        "/api/internal/analytics/reports", headers={"X-API-Key": "wrong"}
+    )
+    assert response.status_code == 401
+
+    response = client.get("/api/internal/analytics/reports", headers=API_KEY)
+    assert "top_countries" in response.json["reports"]
+    response = client.get("/api/internal/analytics/reports/unknown", headers=API_KEY)
+    assert response.status_code == 404
+
+    monkeypatch.delenv("ANALYTICS_API_KEY")
+    response = client.get("/api/internal/analytics/reports", headers=API_KEY)
+    assert response.status_code == 401
+
+
+def test_query_is_read_only(client):
+    _log_clicks()
+
+    response = client.post(
+        "/api/internal/analytics/query",
+        json={
+            "sql": "SELECT country, COUNT(*) AS clicks FROM click_events "
+            "WHERE short_code = ? GROUP BY country",
+            "params": ["plain"],
+        },
+        headers=API_KEY,
+    )
+    assert response.status_code == 200
+    assert response.json["columns"] == ["country", "clicks"]
+    assert sorted(response.json["rows"]) == [["France", 2], ["Japan", 1]]
+
+    for sql in (
+        "DELETE FROM clicks",
+        "DROP VIEW click_events",
+        "ATTACH DATABASE 'other.db' AS other",
+        "PRAGMA query_only = OFF",
+        "SELECT 1; DELETE FROM clicks",
+    ):
+        response = client.post(
+            "/api/internal/analytics/query", json={"sql": sql}, headers=API_KEY
+        )
+        assert response.status_code == 400, sql
+        assert "QueryError" in response.json
+
+    _, rows = click_warehouse.query("SELECT COUNT(*) FROM clicks")
+    assert rows == [(7,)]
@@ -0,0 +1,128 @@
+import pytest
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from cache import redis_client
+from cache.click_stream import ClickHub, publish_click
+from cache.redis_client import CircuitBreaker, call_redis
+
+
+def test_circuit_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(failure_threshold=2, cooldown_seconds=30)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_circuit_breaker_half_open_probe(mocker):
+    breaker = CircuitBreaker(failure_threshold=1, cooldown_seconds=10)
+    clock = mocker.patch("cache.redis_client.time.monotonic", return_value=100.0)
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    clock.return_value = 111.0
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+    # only a single probe is let through
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_circuit_breaker_failed_probe_reopens(mocker):
+    breaker = CircuitBreaker(failure_threshold=1, cooldown_seconds=10)
+    clock = mocker.patch("cache.redis_client.time.monotonic", return_value=100.0)
+    breaker.record_failure()
+    clock.return_value = 111.0
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+
+@pytest.fixture
+def fresh_breaker(mocker):
+    breaker = CircuitBreaker(failure_threshold=2, cooldown_seconds=30)
+    mocker.patch.object(redis_client, "breaker", breaker)
+    return breaker
+
+
+def test_call_redis_without_uri_returns_default(mocker, fresh_breaker):
+    mocker.patch.dict("os.environ", {}, clear=True)
+    mocker.patch.object(redis_client, "_redis_instance", None)
+    assert call_redis(lambda r: r.get("key"), default="fallback") == "fallback"
+
+
+def test_call_redis_without_uri_ends_probe(mocker, fresh_breaker):
+    clock = mocker.patch("cache.redis_client.time.monotonic", return_value=100.0)
+    fresh_breaker.record_failure()
+    fresh_breaker.record_failure()
+    clock.return_value = 131.0
+    mocker.patch("cache.redis_client.get_redis", side_effect=RuntimeError("no uri"))
+
+    assert call_redis(lambda r: r.get("key"), default="fallback") == "fallback"
+    assert fresh_breaker.state == "open"
+    clock.return_value = 162.0
+    assert fresh_breaker.allow()
+
+
+def test_call_redis_skips_redis_when_open(mocker, fresh_breaker):
+    client = mocker.MagicMock()
+    client.get.side_effect = RedisConnectionError("down")
+    mocker.patch("cache.redis_client.get_redis", return_value=client)
+
+    assert call_redis(lambda r: r.get("key")) is None
+    assert call_redis(lambda r: r.get("key")) is None
+    assert fresh_breaker.state == "open"
+
+    assert call_redis(lambda r: r.get("key"), default="skipped") == "skipped"
+    assert client.get.call_count == 2
+
+
+def test_dual_cache_queries_db_when_redis_unavailable(mocker):
+    from cache.dual_cache import DualCache
+
+    mocker.patch("cache.base_cache.get_redis_or_none", return_value=None)
+    cache = DualCache()
+    assert cache.get_or_set("metrics", lambda: {"total": 1}) == {"total": 1}
+
+
+def test_click_hub_shares_one_subscription_per_link(mocker):
+    hub = ClickHub()
+    mocker.patch.object(hub, "_ensure_listener")
+    pubsub = mocker.Mock()
+
+    viewers = [hub.subscribe("abc") for _ in range(3)]
+    hub._sync_subscriptions(pubsub)
+    hub._sync_subscriptions(pubsub)
+    pubsub.subscribe.assert_called_once_with("clicks:abc")
+    assert hub.viewer_count("abc") == 3
+
+    hub.dispatch("abc", {"date": "2024-01-01"})
+    hub.dispatch("other", {"date": "2024-01-02"})
+    assert [viewer.get_nowait() for viewer in viewers] == [{"date": "2024-01-01"}] * 3
+    assert all(viewer.empty() for viewer in viewers)
+
+    for viewer in viewers:
+        hub.unsubscribe("abc", viewer)
+    hub._sync_subscriptions(pubsub)
+    pubsub.unsubscribe.assert_called_once_with("clicks:abc")
+
+
+def test_click_hub_drops_oldest_clicks_for_slow_viewers(mocker):
+    mocker.patch("cache.click_stream.LIVE_QUEUE_SIZE", 2)
+    hub = ClickHub()
+    mocker.patch.object(hub, "_ensure_listener")
+    viewer = hub.subscribe("abc")
+
+    for n in range(3):
+        hub.dispatch("abc", {"n": n})
+    assert [viewer.get_nowait(), viewer.get_nowait()] == [{"n": 1}, {"n": 2}]
+
+
+def test_publish_click_is_skipped_without_redis(mocker):
+    mocker.patch("cache.redis_client.get_redis", side_effect=RuntimeError)
+    publish_click("abc", {"date": "2024-01-01"})
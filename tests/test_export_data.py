@@ -1,15 +1,20 @@
 import io
+import pytest
 from openpyxl import load_workbook
 from utils.export_utils import (
     export_to_excel,
     export_to_csv,
     export_to_json,
     export_to_xml,
+    iter_columnar_zip,
+    iter_csv_zip,
+    iter_json,
+    iter_xml,
 )
 import csv
 import json
 import zipfile
-from dicttoxml import dicttoxml
+import xml.etree.ElementTree as ET
 
 # Mock data
 data = {
@@ -108,6 +113,13 @@ def test_export_to_excel(mocker):
         assert ws_general_info.cell(row=row_idx, column=1).value == row[0]
         assert ws_general_info.cell(row=row_idx, column=2).value == row[1]
 
+    # Styles are shared named styles rather than per-cell formatting
+    assert ws_general_info["A1"].style == "export_label"
+    assert ws_general_info["A1"].font.bold
+    assert ws_general_info["B1"].alignment.horizontal == "right"
+    assert wb["Browser"]["A1"].style == "export_header"
+    assert wb["Browser"]["A1"].alignment.horizontal == "center"
+
     # Check the content of other sheets
     def check_sheet_content(sheet_name, expected_data):
         ws = wb[sheet_name]
@@ -128,19 +140,13 @@ def test_export_to_excel(mocker):
     check_sheet_content("Bots", data["bots"])
 
 
-def test_export_to_csv(mocker):
-    # Mock send_file
-    mock_send_file = mocker.patch("utils.export_utils.send_file")
-
-    # Call the function
-    export_to_csv(data)
-
-    # Assert send_file was called
-    assert mock_send_file.called
-    assert mock_send_file.call_count == 1
+def test_export_to_csv():
+    response = export_to_csv(data)
+    assert response.is_streamed
+    assert response.mimetype == "application/zip"
 
-    # Get the file-like object passed to send_file
-    file_obj = mock_send_file.call_args[0][0]
+    # Read the streamed archive back
+    file_obj = io.BytesIO(b"".join(response.response))
 
     # Load the zip file from the file-like object
     with zipfile.ZipFile(file_obj, "r") as zipf:
@@ -197,6 +203,7 @@ def test_export_to_csv(mocker):
             with zipf.open(filename) as file:
                 with io.TextIOWrapper(file, encoding="utf-8") as text_file:
                     reader = csv.reader(text_file)
+                    next(reader)  # header
                     for row in reader:
                         key, value = row
                         assert expected_data[key] == int(value)
@@ -214,46 +221,119 @@ def test_export_to_csv(mocker):
         check_csv_content("bots.csv", data["bots"])
 
 
-def test_export_to_json(mocker):
-    # Mock send_file
-    mock_send_file = mocker.patch("utils.export_utils.send_file")
-
-    # Call the function
-    export_to_json(data)
-
-    # Assert send_file was called
-    assert mock_send_file.called
-    assert mock_send_file.call_count == 1
-
-    # Get the file-like object passed to send_file
-    file_obj = mock_send_file.call_args[0][0]
+def test_export_to_json():
+    response = export_to_json(data)
+    assert response.is_streamed
+    assert response.mimetype == "application/json"
 
-    # Read the JSON data from the file-like object
-    json_data = json.load(file_obj)
+    # Read the JSON data from the streamed body
+    json_data = json.loads(b"".join(response.response))
 
     # Check if the JSON data matches the input data
     assert json_data == data
 
 
-def test_export_to_xml(mocker):
-    # Mock send_file
-    mock_send_file = mocker.patch("utils.export_utils.send_file")
-
-    # Call the function
-    export_to_xml(data)
-
-    # Assert send_file was called
-    assert mock_send_file.called
-    assert mock_send_file.call_count == 1
-
-    # Get the file-like object passed to send_file
-    file_obj = mock_send_file.call_args[0][0]
-
-    # Read the XML data from the file-like object
-    xml_data = file_obj.read()
-
-    # Convert the input data to XML
-    expected_xml = dicttoxml(data)
+def test_export_to_xml():
+    response = export_to_xml(data)
+    assert response.is_streamed
+    assert response.headers["Content-Disposition"] == "attachment; filename=data.xml"
+
+    # Read the XML data from the streamed body
+    root = ET.fromstring(b"".join(response.response))
+    assert root.tag == "root"
+    assert root.find("total-clicks").text == "100"
+    assert root.find("browser/Chrome").text == "50"
+    assert root.find("expired").text == "false"
+
+
+def test_iter_xml_layout():
+    # The layout the XML export had when it was built with dicttoxml
+    sample = {
+        "_id": "a<b",
+        "total-clicks": 3,
+        "expired": False,
+        "password": None,
+        "average": 0.5,
+        "counter": {"2024-10-01": 2, "7": 1},
+        "referrer": {"bing com": 1, "a/b": 2},
+        "tags": ["x", 1],
+    }
+    assert b"".join(iter_xml(sample)) == (
+        b'<?xml version="1.0" encoding="UTF-8" ?><root>'
+        b'<_id type="str">a&lt;b</_id>'
+        b'<total-clicks type="int">3</total-clicks>'
+        b'<expired type="bool">false</expired>'
+        b'<password type="null"></password>'
+        b'<average type="float">0.5</average>'
+        b'<counter type="dict"><key name="2024-10-01" type="int">2</key>'
+        b'<n7 type="int">1</n7></counter>'
+        b'<referrer type="dict"><bing_com type="int">1</bing_com>'
+        b'<key name="a/b" type="int">2</key></referrer>'
+        b'<tags type="list"><item type="str">x</item>'
+        b'<item type="int">1</item></tags>'
+        b"</root>"
+    )
+
+
+def test_streamed_exports_are_chunked(mocker):
+    mocker.patch("utils.export_utils.EXPORT_CHUNK_SIZE", 256)
+    big = {**data, "referrer": {f"site{i}.example": i for i in range(2000)}}
+
+    chunks = list(iter_json(big))
+    assert len(chunks) > 1
+    assert json.loads(b"".join(chunks)) == big
+
+    chunks = list(iter_xml(big))
+    assert len(chunks) > 1
+    root = ET.fromstring(b"".join(chunks))
+    assert len(root.find("referrer")) == 2000
+
+    chunks = [chunk for chunk in iter_csv_zip(big) if chunk]
+    assert len(chunks) > 1
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as zipf:
+        rows = list(csv.reader(io.StringIO(zipf.read("referrer.csv").decode())))
+    assert rows[0] == ["Referrer", "Count"]
+    assert len(rows) == 2001
+
+
+@pytest.mark.parametrize("format", ["parquet", "arrow"])
+def test_export_columnar(format):
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+
+    archive = b"".join(iter_columnar_zip(data, format))
+    with zipfile.ZipFile(io.BytesIO(archive)) as zipf:
+        assert sorted(zipf.namelist()) == [
+            f"counter.{format}",
+            f"dimensions.{format}",
+            f"general_info.{format}",
+        ]
 
-    # Check if the XML data matches the expected XML
-    assert xml_data == expected_xml
+        def read(name):
+            raw = io.BytesIO(zipf.read(f"{name}.{format}"))
+            if format == "parquet":
+                return pq.read_table(raw)
+            return pa.ipc.open_file(raw).read_all()
+
+        counter = read("counter")
+        assert counter.schema.field("date").type == pa.date32()
+        assert counter.column("clicks").to_pylist() == [10, 20]
+        assert counter.column("unique_clicks").to_pylist() == [8, 12]
+
+        dimensions = read("dimensions").to_pylist()
+        assert {
+            "dimension": "browser",
+            "key": "Chrome",
+            "clicks": 50,
+            "unique_clicks": 40,
+        } in dimensions
+        assert {
+            "dimension": "bots",
+            "key": "Googlebot",
+            "clicks": 5,
+            "unique_clicks": None,
+        } in dimensions
+
+        general_info = read("general_info").to_pylist()
+        assert general_info[0]["total-clicks"] == 100
+        assert general_info[0]["url"] == "https://example.com"
@@ -0,0 +1,82 @@
+import threading
+
+import pytest
+
+from utils import mongo_utils
+from utils.mongo_utils import Bulkhead, BulkheadFullError
+
+
+def test_get_client_is_created_lazily_per_process(mocker):
+    mock_client_cls = mocker.patch("utils.mongo_utils.MongoClient")
+    mocker.patch.object(mongo_utils, "_client", None)
+    mocker.patch.object(mongo_utils, "_client_pid", None)
+
+    first = mongo_utils.get_client()
+    assert mongo_utils.get_client() is first
+    assert mock_client_cls.call_count == 1
+    kwargs = mock_client_cls.call_args.kwargs
+    assert (
+        kwargs["serverSelectionTimeoutMS"]
+        == mongo_utils.MONGO_SERVER_SELECTION_TIMEOUT_MS
+    )
+    assert kwargs["maxPoolSize"] == mongo_utils.MONGO_MAX_POOL_SIZE
+
+    # simulate running in a forked worker
+    mocker.patch("utils.mongo_utils.os.getpid", return_value=-1)
+    mongo_utils.get_client()
+    assert mock_client_cls.call_count == 2
+
+
+def test_bulkhead_rejects_when_full():
+    bulkhead = Bulkhead("stats", max_concurrent=1, timeout=0.01)
+    with bulkhead.slot():
+        assert bulkhead.stats()["in_use"] == 1
+        with pytest.raises(BulkheadFullError):
+            with bulkhead.slot():
+                pass
+    assert bulkhead.stats() == {"max_concurrent": 1, "in_use": 0, "rejected": 1}
+
+
+def test_bulkheads_are_independent():
+    stats_bulkhead = Bulkhead("stats", max_concurrent=1, timeout=0.01)
+    redirect_bulkhead = Bulkhead("redirect", max_concurrent=1, timeout=0.01)
+    held = threading.Event()
+    release = threading.Event()
+
+    def slow_aggregation():
+        with stats_bulkhead.slot():
+            held.set()
+            release.wait(1)
+
+    worker = threading.Thread(target=slow_aggregation)
+    worker.start()
+    held.wait(1)
+    with redirect_bulkhead.slot():
+        pass
+    release.set()
+    worker.join()
+
+
+def test_aggregate_url_raises_when_bulkhead_full(mocker, mock_db):
+    mock_db.urls.insert_one({"_id": "abc"})
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+    mocker.patch.dict(
+        mongo_utils.bulkheads, {"stats": Bulkhead("stats", 1, timeout=0.01)}
+    )
+    with mongo_utils.bulkheads["stats"].slot():
+        with pytest.raises(BulkheadFullError):
+            mongo_utils.aggregate_url([{"$match": {"_id": "abc"}}])
+        with pytest.raises(BulkheadFullError):
+            mongo_utils.aggregate_urls([{"$match": {"_id": "abc"}}])
+    assert mongo_utils.aggregate_url([{"$match": {"_id": "abc"}}]) == {"_id": "abc"}
+
+
+def test_load_url_raises_when_bulkhead_full(mocker, mock_db):
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+    mocker.patch.dict(
+        mongo_utils.bulkheads, {"redirect": Bulkhead("redirect", 1, timeout=0.01)}
+    )
+    with mongo_utils.bulkheads["redirect"].slot():
+        with pytest.raises(BulkheadFullError):
+            mongo_utils.load_url("abc")
+    assert mongo_utils.load_url("abc") is None
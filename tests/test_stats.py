@@ -1,8 +1,45 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from flask.testing import FlaskClient
 import pytest
 from datetime import timedelta
+import json
+import os
+import threading
+import time
 import urllib.parse
+from utils import mongo_utils
+from utils.access_utils import access_cookie_name
+
+
+@pytest.fixture(autouse=True)
+def aggregate_without_dimension_cap(mocker):
+    # mongomock has no $sortArray, so the dimension cap stage is left out of
+    # aggregations here; test_stats_payload_caps_dimension_maps covers it
+    def without_cap(aggregate):
+        def run(pipeline):
+            return aggregate(
+                [
+                    stage
+                    for stage in pipeline
+                    if not any(
+                        key.startswith("truncated.")
+                        for key in stage.get("$addFields", {})
+                    )
+                ]
+            )
+
+        return run
+
+    for name in (
+        "aggregate_url",
+        "aggregate_urls",
+        "aggregate_emoji_url",
+        "aggregate_emoji_urls",
+    ):
+        mocker.patch(
+            f"utils.stats_utils.{name}",
+            side_effect=without_cap(getattr(mongo_utils, name)),
+        )
 
 
 def test_get_request_handling(client):
@@ -64,7 +101,8 @@ def test_post_correct_password(client, mocker):
         "/stats", data={"short_code": "validcode", "password": "correctpassword"}
     )
     assert response.status_code == 302
-    assert response.headers["Location"] == "/stats/validcode?password=correctpassword"
+    assert response.headers["Location"] == "/stats/validcode"
+    assert client.get_cookie(access_cookie_name("validcode"))
 
 
 def test_post_valid_short_code_without_password_protection(client, mocker):
@@ -84,9 +122,7 @@ def test_handling_emoji_aliases(client, mocker):
         "/stats", data={"short_code": "😀", "password": "correctpassword"}
     )
     assert response.status_code == 302
-    assert (
-        response.headers["Location"] == "/stats/%F0%9F%98%80?password=correctpassword"
-    )
+    assert response.headers["Location"] == "/stats/%F0%9F%98%80"
 
 
 def test_stats_get_url_not_fount(client: FlaskClient, mocker):
@@ -718,3 +754,1253 @@ def test_stats_post_sorting_aggregation(client: FlaskClient, mocker, mock_db):
         "example.com": 2,
         "mobile-site.co.uk": 1,
     }
+
+
+def test_stats_post_served_from_materialized_view(client: FlaskClient, mocker, mock_db):
+    today_str = datetime.now().strftime("%Y-%m-%d")
+    mock_db.urls.insert_one(
+        {
+            "_id": "materialized",
+            "url": "https://example.com",
+            "total-clicks": 3,
+            "ips": ["1.1.1.1", "2.2.2.2"],
+            "counter": {today_str: 3},
+            "unique_counter": {today_str: 2},
+            "creation-date": today_str,
+            "stats": {
+                "schema": 1,
+                "total_unique_clicks": 2,
+                "browser": {"Chrome": 2, "Firefox": 1},
+                "unique_browser": {"Chrome": 1, "Firefox": 1},
+                "country": {"Germany": 3},
+                "unique_country": {"Germany": 2},
+            },
+        }
+    )
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+    full_aggregation = mocker.patch("utils.stats_utils.get_stats_pipeline")
+
+    response = client.post("/stats/materialized")
+    assert response.status_code == 200
+    assert not full_aggregation.called
+    assert response.json["total_unique_clicks"] == 2
+    assert response.json["browser"] == {"Chrome": 2, "Firefox": 1}
+    assert response.json["unique_browser"] == {"Chrome": 1, "Firefox": 1}
+    assert response.json["unique_country"] == {"Germany": 2}
+    assert response.json["os_name"] == {}
+    assert response.json["counter"] == {today_str: 3}
+
+
+def test_stats_backfills_materialized_view(client: FlaskClient, mocker, mock_db):
+    today_str = datetime.now().strftime("%Y-%m-%d")
+    mock_db.urls.insert_one(
+        {
+            "_id": "legacy",
+            "url": "https://example.com",
+            "total-clicks": 2,
+            "ips": ["1.1.1.1"],
+            "counter": {today_str: 2},
+            "creation-date": today_str,
+        }
+    )
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+    mocker.patch(
+        "utils.stats_utils.aggregate_url",
+        return_value={
+            "_id": "legacy",
+            "url": "https://example.com",
+            "total-clicks": 2,
+            "total_unique_clicks": 1,
+            "browser": {"Chrome": 2},
+            "unique_browser": {"Chrome": 1},
+            "creation-date": today_str,
+        },
+    )
+
+    from utils.stats_utils import load_stats
+
+    assert load_stats("legacy")["browser"] == {"Chrome": 2}
+    stats = mock_db.urls.find_one({"_id": "legacy"})["stats"]
+    assert stats["schema"] == 1
+    assert stats["browser"] == {"Chrome": 2}
+    assert stats["unique_browser"] == {"Chrome": 1}
+    assert stats["total_unique_clicks"] == 1
+
+
+def _insert_materialized(mock_db, short_code, **extra):
+    today_str = datetime.now().strftime("%Y-%m-%d")
+    mock_db.urls.insert_one(
+        {
+            "_id": short_code,
+            "url": "https://example.com",
+            "total-clicks": 1,
+            "counter": {today_str: 1},
+            "creation-date": today_str,
+            "last-click": f"{today_str} 10:00:00",
+            "stats": {"schema": 1, "total_unique_clicks": 1},
+            **extra,
+        }
+    )
+
+
+def test_stats_conditional_get_returns_304(client: FlaskClient, mocker, mock_db):
+    _insert_materialized(mock_db, "etag")
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+
+    response = client.post("/stats/etag")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert response.headers["Last-Modified"]
+
+    load_stats = mocker.patch("blueprints.stats.load_stats")
+    response = client.post("/stats/etag", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert not load_stats.called
+
+    # a new click changes the version stamp
+    mock_db.urls.update_one({"_id": "etag"}, {"$inc": {"total-clicks": 1}})
+    load_stats.return_value = None
+    response = client.post("/stats/etag", headers={"If-None-Match": etag})
+    assert load_stats.called
+
+
+def test_stats_version_changes_when_link_expires(client: FlaskClient, mocker, mock_db):
+    expires = datetime.now(timezone.utc) + timedelta(hours=1)
+    _insert_materialized(
+        mock_db, "expiring", **{"expiration-time": expires.isoformat()}
+    )
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+
+    response = client.post("/stats/expiring")
+    assert response.json["expired"] is None
+    etag = response.headers["ETag"]
+
+    # no click, only the clock passing the expiration time
+    mock_db.urls.update_one(
+        {"_id": "expiring"},
+        {"$set": {"expiration-time": (expires - timedelta(hours=2)).isoformat()}},
+    )
+    response = client.post("/stats/expiring", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json["expired"] is True
+
+
+def test_stats_busy_database_is_not_a_missing_link(client: FlaskClient, mocker):
+    from utils.mongo_utils import BulkheadFullError
+
+    mocker.patch("blueprints.stats.load_url", side_effect=BulkheadFullError("full"))
+
+    response = client.post("/stats/busy")
+    assert response.status_code == 503
+    assert response.json == {"StatsError": "Stats are temporarily unavailable"}
+
+    response = client.get("/stats/busy")
+    assert response.status_code == 503
+    assert b"503" in response.data
+
+
+def test_stats_busy_stats_bulkhead_is_not_a_missing_link(
+    client: FlaskClient, mocker, mock_db
+):
+    from utils.mongo_utils import Bulkhead
+
+    _insert_materialized(mock_db, "busy")
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+    mocker.patch.dict(
+        mongo_utils.bulkheads,
+        {
+            "stats": Bulkhead("stats", 1, timeout=0.01),
+            "redirect": Bulkhead("redirect", 1, timeout=0.01),
+        },
+    )
+
+    # Stats reads only wait for the stats bulkhead, never for redirects
+    with mongo_utils.bulkheads["redirect"].slot():
+        assert client.post("/stats/busy").status_code == 200
+
+    with mongo_utils.bulkheads["stats"].slot():
+        response = client.post("/stats/busy")
+        assert response.status_code == 503
+        response = client.get("/stats/busy/panel/browser")
+        assert response.status_code == 503
+
+
+def test_stats_conditional_get_requires_password(client: FlaskClient, mocker, mock_db):
+    _insert_materialized(mock_db, "private", password="secret")
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+
+    response = client.post("/stats/private", data={"password": "secret"})
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "private, no-cache"
+    etag = response.headers["ETag"]
+
+    client.delete_cookie(access_cookie_name("private"))
+    response = client.post("/stats/private", headers={"If-None-Match": etag})
+    assert response.status_code == 400
+
+    response = client.post(
+        "/stats/private",
+        data={"password": "secret"},
+        headers={"If-None-Match": etag},
+    )
+    assert response.status_code == 304
+
+
+def test_export_conditional_get(client: FlaskClient, mocker, mock_db):
+    _insert_materialized(mock_db, "exported")
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+
+    response = client.get("/export/exported/json")
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    response = client.get("/export/exported/json", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    # each format is its own representation
+    response = client.get("/export/exported/xml", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+
+
+def test_stats_access_token_skips_password_check(client: FlaskClient, mocker, mock_db):
+    _insert_materialized(mock_db, "token", password="secret")
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+
+    response = client.post("/stats/token", data={"password": "secret"})
+    assert response.status_code == 200
+    token = response.headers["X-Access-Token"]
+    assert client.get_cookie(access_cookie_name("token"))
+
+    # the cookie alone is enough for follow-up stats and export requests
+    assert client.post("/stats/token").status_code == 200
+    assert client.get("/export/token/json").status_code == 200
+
+    client.delete_cookie(access_cookie_name("token"))
+    assert client.post("/stats/token").status_code == 400
+    assert client.post("/stats/token", data={"token": token}).status_code == 200
+
+    # tokens are bound to the link and die with a password change
+    _insert_materialized(mock_db, "other", password="secret")
+    assert client.post("/stats/other", data={"token": token}).status_code == 400
+    mock_db.urls.update_one({"_id": "token"}, {"$set": {"password": "changed"}})
+    assert client.post("/stats/token", data={"token": token}).status_code == 400
+
+
+def test_stats_get_renders_shell_without_dimensions(
+    client: FlaskClient, mocker, mock_db
+):
+    _insert_materialized(mock_db, "shell")
+    mock_db.urls.update_one(
+        {"_id": "shell"}, {"$set": {"stats.browser": {"Chrome": 1}}}
+    )
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+    aggregate = mocker.patch("utils.stats_utils.aggregate_url")
+    render = mocker.patch("blueprints.stats.render_template", return_value="")
+
+    response = client.get("/stats/shell")
+    assert response.status_code == 200
+    assert not aggregate.called
+
+    json_data = render.call_args.kwargs["json_data"]
+    assert json_data["total-clicks"] == 1
+    assert json_data["total_unique_clicks"] == 1
+    assert "average_daily_clicks" in json_data["analysis_data"]
+    assert "browser" not in json_data
+    assert "counter" not in json_data
+    assert "password" not in json_data
+
+
+def test_stats_panel_top_n_computed_by_database(client: FlaskClient, mocker, mock_db):
+    _insert_materialized(mock_db, "topn")
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+    url_doc = mock_db.urls.find_one({"_id": "topn"})
+    url_doc["stats"]["browser"] = {"Chrome": 6, "Firefox": 5, "Safari": 4}
+    url_doc["sorted_browser"] = {"Chrome": 6, "Firefox": 5, "others": 4}
+    url_doc["sorted_unique_browser"] = {}
+    aggregate = mocker.patch("utils.stats_utils.aggregate_url", return_value=url_doc)
+
+    response = client.get("/stats/topn/panel/browser")
+    assert response.status_code == 200
+    assert response.json["sorted_browser"] == {"Chrome": 6, "Firefox": 5, "others": 4}
+    assert response.json["browser"] == {"Chrome": 6, "Firefox": 5, "Safari": 4}
+    assert "os_name" not in response.json
+
+    pipeline = aggregate.call_args[0][0]
+    assert set(pipeline[1]["$project"]) == {
+        "stats.schema",
+        "stats.browser",
+        "stats.unique_browser",
+    }
+    top_n = pipeline[2]["$addFields"]
+    assert set(top_n) == {"sorted_browser", "sorted_unique_browser"}
+    # the maps themselves are cut after the top-N buckets are computed
+    assert "stats.browser" in pipeline[3]["$addFields"]
+    assert top_n["sorted_browser"]["$let"]["vars"]["items"]["$sortArray"]["input"] == {
+        "$objectToArray": {"$ifNull": ["$stats.browser", {}]}
+    }
+
+
+def test_stats_panels(client: FlaskClient, mocker, mock_db):
+    today_str = datetime.now().strftime("%Y-%m-%d")
+    _insert_materialized(
+        mock_db,
+        "panels",
+        password="secret",
+        stats={
+            "schema": 1,
+            "country": {"Kosovo": 1},
+            "unique_country": {"Kosovo": 1},
+            "country_code": {"Kosovo": "XK"},
+        },
+    )
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+
+    assert client.get("/stats/panels/panel/country").status_code == 400
+    assert client.get("/stats/panels/panel/ips?password=secret").status_code == 404
+
+    response = client.get("/stats/panels/panel/country?password=secret")
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "private, no-cache"
+    assert response.json["sorted_country"] == [{"id": "XK", "value": 1}]
+    assert response.json["sorted_unique_country"] == [{"id": "XK", "value": 1}]
+    assert "counter" not in response.json
+
+    response = client.get("/stats/panels/panel/counter?password=secret")
+    assert response.json["counter"] == {today_str: 1}
+    assert "country" not in response.json
+
+    # each panel is its own representation
+    etag = response.headers["ETag"]
+    response = client.get(
+        "/stats/panels/panel/counter?password=secret",
+        headers={"If-None-Match": etag},
+    )
+    assert response.status_code == 304
+    response = client.get(
+        "/stats/panels/panel/bots?password=secret",
+        headers={"If-None-Match": etag},
+    )
+    assert response.status_code != 304
+
+
+def test_stats_window_and_granularity(client: FlaskClient, mocker, mock_db):
+    _insert_materialized(mock_db, "window", **{"creation-date": "2024-01-01"})
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+    url_doc = mock_db.urls.find_one({"_id": "window"})
+    url_doc["counter"] = {"2024-01-02": 1, "2024-01-09": 2, "2024-01-10": 3}
+    url_doc["unique_counter"] = {"2024-01-02": 1}
+    aggregate = mocker.patch("utils.stats_utils.aggregate_url", return_value=url_doc)
+
+    response = client.post(
+        "/stats/window",
+        data={"from": "2024-01-01", "to": "2024-01-14", "granularity": "week"},
+    )
+    assert response.status_code == 200
+    assert response.json["counter"] == {"2024-01-01": 1, "2024-01-08": 5}
+    assert response.json["unique_counter"] == {"2024-01-01": 1, "2024-01-08": 0}
+    assert response.json["window"] == {
+        "from": "2024-01-01",
+        "to": "2024-01-14",
+        "granularity": "week",
+    }
+
+    # only the requested window is read from the database
+    projection = aggregate.call_args[0][0][1]["$project"]
+    conditions = projection["counter"]["$arrayToObject"]["$filter"]["cond"]["$and"]
+    assert conditions == [
+        {"$gte": ["$$this.k", "2024-01-01"]},
+        {"$lte": ["$$this.k", "2024-01-14"]},
+    ]
+    assert "hourly_counter" not in projection
+
+
+def test_stats_hourly_granularity(client: FlaskClient, mocker, mock_db):
+    _insert_materialized(mock_db, "hourly")
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+    url_doc = mock_db.urls.find_one({"_id": "hourly"})
+    url_doc["hourly_counter"] = {"2024-01-02": {"09": 4}}
+    mocker.patch("utils.stats_utils.aggregate_url", return_value=url_doc)
+
+    response = client.post(
+        "/stats/hourly",
+        data={"from": "2024-01-02", "to": "2024-01-02", "granularity": "hour"},
+    )
+    assert response.status_code == 200
+    assert len(response.json["counter"]) == 24
+    assert response.json["counter"]["2024-01-02 09:00"] == 4
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"granularity": "year"},
+        {"from": "01-01-2024"},
+        {"from": "2024-02-01", "to": "2024-01-01"},
+        {"from": "2024-01-01", "to": "2024-03-01", "granularity": "hour"},
+    ],
+)
+def test_stats_invalid_window(client: FlaskClient, mocker, mock_db, params):
+    _insert_materialized(mock_db, "badwindow")
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+
+    response = client.post("/stats/badwindow", data=params)
+    assert response.status_code == 400
+    assert "WindowError" in response.json
+
+
+def test_stats_fields_selection(client: FlaskClient, mocker, mock_db):
+    _insert_materialized(
+        mock_db,
+        "sparse",
+        stats={"schema": 1, "browser": {"Chrome": 1}, "os_name": {"Linux": 1}},
+    )
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+
+    response = client.post(
+        "/stats/sparse", data={"fields": "total-clicks,browser,average_daily_clicks"}
+    )
+    assert response.status_code == 200
+    assert response.json == {
+        "short_code": "sparse",
+        "total-clicks": 1,
+        "browser": {"Chrome": 1},
+        "average_daily_clicks": 1.0,
+    }
+
+    response = client.post("/stats/sparse", data={"fields": "counter,unique_counter"})
+    assert response.status_code == 200
+    assert response.json["counter"] == {datetime.now().strftime("%Y-%m-%d"): 1}
+    assert response.json["unique_counter"] == {}
+
+    response = client.post("/stats/sparse", data={"fields": "browser,ips"})
+    assert response.status_code == 400
+    assert response.json == {"FieldsError": "Unknown field(s): ips"}
+
+
+def test_stats_fields_skip_unrequested_transforms(mocker, mock_db):
+    from utils.pipeline_utils import get_stats_pipeline
+    from utils.stats_utils import load_stats
+
+    pipeline = get_stats_pipeline("legacy", fields={"total-clicks"})
+    assert pipeline[1] == {
+        "$project": {"total-clicks": {"$ifNull": ["$total-clicks", 0]}}
+    }
+    assert len(pipeline) == 2
+
+    # the raw map is read for the unique counts, but not returned
+    pipeline = get_stats_pipeline("legacy", fields={"unique_browser"})
+    assert set(pipeline[1]["$project"]) == {"browser"}
+    assert set(pipeline[2]["$addFields"]) == {"unique_browser"}
+    assert pipeline[3] == {"$project": {"browser": 0}}
+
+    # partial results are never written back as the materialized view
+    mock_db.urls.insert_one({"_id": "legacy", "total-clicks": 2})
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+    mocker.patch(
+        "utils.stats_utils.aggregate_url",
+        return_value={"_id": "legacy", "total-clicks": 2},
+    )
+    assert load_stats("legacy", fields={"total-clicks"})["total-clicks"] == 2
+    assert "stats" not in mock_db.urls.find_one({"_id": "legacy"})
+
+
+def test_stats_payload_caps_dimension_maps(client: FlaskClient, mocker, mock_db):
+    _insert_materialized(mock_db, "popular")
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+    # what the database returns for the cut maps
+    top_referrers = {f"site{i}.com": i for i in range(150, 50, -1)}
+    aggregate = mocker.patch(
+        "utils.stats_utils.aggregate_url",
+        return_value={
+            **mock_db.urls.find_one({"_id": "popular"}),
+            "stats": {"schema": 1, "referrer": top_referrers},
+            "truncated": {"referrer": 150},
+        },
+    )
+
+    response = client.post("/stats/popular")
+    assert response.status_code == 200
+    assert response.json["referrer"] == top_referrers
+    assert response.json["truncated"] == {"referrer": 150}
+
+    # the maps are cut by the database, not after they were read
+    cap = aggregate.call_args[0][0][-1]["$addFields"]
+    sliced = cap["stats.referrer"]["$arrayToObject"]["$slice"]
+    assert sliced[0]["$sortArray"]["sortBy"] == {"v": -1, "k": 1}
+    assert sliced[1] == 100
+    assert cap["truncated.referrer"]["$cond"][0]["$gt"][1] == 100
+
+
+def test_stats_dimension_pages(client: FlaskClient, mocker, mock_db):
+    _insert_materialized(mock_db, "paged", password="secret")
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+    aggregate = mocker.patch(
+        "utils.stats_utils.aggregate_url",
+        return_value={
+            "total": 5,
+            "items": [
+                {"k": "a.com", "v": 9},
+                {"k": "b.com", "v": 4},
+                {"k": "c.com", "v": 4},
+            ],
+        },
+    )
+
+    response = client.get("/stats/paged/referrer?limit=2")
+    assert response.status_code == 400
+
+    response = client.get("/stats/paged/referrer?limit=2&password=secret")
+    assert response.status_code == 200
+    assert response.json["items"] == [
+        {"key": "a.com", "count": 9},
+        {"key": "b.com", "count": 4},
+    ]
+    assert response.json["total"] == 5
+    cursor = response.json["next_cursor"]
+
+    response = client.get(
+        f"/stats/paged/referrer?limit=2&password=secret&cursor={cursor}"
+    )
+    assert response.status_code == 200
+    stage = aggregate.call_args[0][0][1]["$project"]["items"]["$slice"]
+    assert stage[1] == 3
+    assert stage[0]["$filter"]["cond"]["$or"][0] == {"$lt": ["$$this.v", 4]}
+
+    for query in ("limit=0", "limit=501", "cursor=garbage"):
+        response = client.get(f"/stats/paged/referrer?password=secret&{query}")
+        assert response.status_code == 400
+
+    assert client.get("/stats/paged/ips?password=secret").status_code == 404
+
+
+def test_stats_compact_format(client: FlaskClient, mocker, mock_db):
+    import gzip
+    import json
+
+    msgpack = pytest.importorskip("msgpack")
+
+    today = datetime.now()
+    two_days_ago = (today - timedelta(days=2)).strftime("%Y-%m-%d")
+    _insert_materialized(
+        mock_db,
+        "compact",
+        counter={two_days_ago: 3, today.strftime("%Y-%m-%d"): 1},
+        **{"creation-date": two_days_ago},
+        stats={
+            "schema": 1,
+            "browser": {"Chrome": 3, "Firefox": 1},
+            "unique_browser": {"Chrome": 1, "Safari": 1},
+            "country": {"Germany": 4},
+            "country_code": {"Germany": "DE"},
+        },
+    )
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+
+    response = client.post("/stats/compact", data={"format": "compact"})
+    assert response.status_code == 200
+    assert response.mimetype == "application/json"
+    payload = response.json
+    assert payload["format"] == "compact"
+    assert payload["counter"] == {
+        "start": two_days_ago,
+        "step": "day",
+        "values": [3, 0, 1],
+    }
+    assert payload["browser"] == {
+        "keys": ["Chrome", "Firefox", "Safari"],
+        "counts": [3, 1, 0],
+        "unique": [1, 0, 1],
+    }
+    assert payload["country"]["codes"] == ["DE"]
+    assert "unique_browser" not in payload
+    assert "country_code" not in payload
+
+    response = client.post(
+        "/stats/compact",
+        data={"format": "compact"},
+        headers={"Accept": "application/msgpack", "Accept-Encoding": "gzip"},
+    )
+    assert response.status_code == 200
+    assert response.mimetype == "application/msgpack"
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert msgpack.unpackb(gzip.decompress(response.data)) == payload
+    assert len(response.data) < len(json.dumps(payload))
+
+
+def test_stats_batch(client: FlaskClient, mocker, mock_db):
+    import json
+
+    from blueprints import stats as stats_blueprint
+
+    _insert_materialized(mock_db, "first")
+    _insert_materialized(mock_db, "locked", password="secret")
+    mock_db.emojis.insert_one(
+        {
+            "_id": "😊",
+            "url": "https://example.com",
+            "total-clicks": 4,
+            "creation-date": datetime.now().strftime("%Y-%m-%d"),
+            "stats": {"schema": 1, "total_unique_clicks": 2},
+        }
+    )
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+    mocker.patch("utils.mongo_utils.emoji_urls_collection", mock_db.emojis)
+    aggregate = mocker.spy(mock_db.urls, "aggregate")
+    load_stats = mocker.patch("utils.stats_utils.load_stats")
+
+    response = client.post(
+        "/api/stats/batch",
+        json={
+            "short_codes": ["first", "😊", "missing", "locked", "first"],
+            "fields": ["total-clicks", "expired"],
+        },
+    )
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [(line["short_code"], line["status"]) for line in lines] == [
+        ("first", 200),
+        ("😊", 200),
+        ("missing", 404),
+        ("locked", 400),
+    ]
+    assert lines[0]["stats"] == {
+        "short_code": "first",
+        "total-clicks": 1,
+        "expired": None,
+    }
+    assert lines[1]["stats"]["total-clicks"] == 4
+
+    # access is checked on the metadata of every link, then only the stats
+    # of readable links are loaded; no per-link fallbacks
+    meta_read, stats_read = [call[0][0] for call in aggregate.call_args_list]
+    assert meta_read[0] == {"$match": {"_id": {"$in": ["first", "missing", "locked"]}}}
+    assert "stats.browser" not in meta_read[1]["$project"]
+    assert stats_read[0] == {"$match": {"_id": {"$in": ["first"]}}}
+    assert not load_stats.called
+
+    response = client.post(
+        "/api/stats/batch",
+        json={"short_codes": ["locked"], "passwords": {"locked": "secret"}},
+    )
+    line = json.loads(response.data)
+    assert line["status"] == 200
+    assert line["stats"]["total-clicks"] == 1
+
+    # stats are read, and streamed, one group at a time
+    mocker.patch("blueprints.stats.STATS_BATCH_FETCH_SIZE", 1)
+    load_batch = mocker.spy(stats_blueprint, "load_stats_batch")
+    response = client.post("/api/stats/batch", json={"short_codes": ["first", "😊"]})
+    assert len(response.data.decode().splitlines()) == 2
+    assert [call[0][0] for call in load_batch.call_args_list] == [["first"], ["😊"]]
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        {},
+        {"short_codes": "first"},
+        {"short_codes": [1, 2]},
+        {"short_codes": ["first"] * 501},
+        {"short_codes": ["first"], "passwords": ["secret"]},
+        {"short_codes": ["first"], "fields": ["ips"]},
+    ],
+)
+def test_stats_batch_invalid_request(client: FlaskClient, body):
+    response = client.post("/api/stats/batch", json=body)
+    assert response.status_code == 400
+
+
+def test_stats_since_returns_changed_counters(client: FlaskClient, mocker, mock_db):
+    _insert_materialized(
+        mock_db,
+        "polled",
+        **{"total-clicks": 5},
+        counter={"2024-01-01": 3, "2024-01-02": 2},
+        recent_clicks=[
+            {"t": 100.0, "date": "2024-01-01", "dims": {"browser": "Firefox"}},
+            {"t": 200.0, "date": "2024-01-02", "dims": {"browser": "Chrome"}},
+        ],
+        stats={
+            "schema": 1,
+            "total_unique_clicks": 2,
+            "browser": {"Chrome": 2, "Firefox": 3},
+            "unique_browser": {"Chrome": 1, "Firefox": 1},
+        },
+    )
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+
+    response = client.post("/stats/polled")
+    assert response.headers["X-Stats-Version"] == "5"
+
+    response = client.post("/stats/polled", data={"since_version": "4"})
+    assert response.status_code == 200
+    assert response.json == {
+        "short_code": "polled",
+        "version": "5",
+        "full": False,
+        "changes": {
+            "total-clicks": 5,
+            "total_unique_clicks": 2,
+            "last-click": mock_db.urls.find_one({"_id": "polled"})["last-click"],
+            "counter": {"2024-01-02": 2},
+            "browser": {"Chrome": 2},
+            "unique_browser": {"Chrome": 1},
+        },
+    }
+
+    # nothing new: answered from the version check alone
+    load_stats_delta = mocker.patch("blueprints.stats.load_stats_delta")
+    response = client.post("/stats/polled", data={"since_version": "5"})
+    assert response.json["changes"] == {}
+    assert not load_stats_delta.called
+    mocker.stopall()
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+
+    # older than the recent clicks ring: the client has to refetch
+    response = client.post("/stats/polled", data={"since_version": "1"})
+    assert response.json["full"] is True
+
+    # all digits in `since` are epoch seconds, never a version
+    response = client.post("/stats/polled", data={"since": "150"})
+    assert set(response.json["changes"]["browser"]) == {"Chrome"}
+
+    response = client.post("/stats/polled", data={"since": "1970-01-01T00:02:30Z"})
+    assert set(response.json["changes"]["browser"]) == {"Chrome"}
+
+    response = client.post("/stats/polled", data={"since": "yesterday"})
+    assert response.status_code == 400
+    response = client.post("/stats/polled", data={"since_version": "v5"})
+    assert response.status_code == 400
+
+
+def test_stats_live_disabled_by_default(client: FlaskClient, mocker, mock_db):
+    _insert_materialized(mock_db, "live")
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+    subscribe = mocker.patch("blueprints.stats.click_hub.subscribe")
+
+    response = client.get("/stats/live/live")
+    assert response.status_code == 404
+    assert "LiveError" in response.json
+    assert not subscribe.called
+
+    # The page never opens a stream on its own
+    response = client.get("/stats/live")
+    assert response.status_code == 200
+    assert b"EventSource" not in response.data
+    assert b"liveButton" not in response.data
+
+    mocker.patch("blueprints.stats.LIVE_STATS_ENABLED", True)
+    response = client.get("/stats/live")
+    assert b"liveButton" in response.data
+
+
+def test_stats_live_requires_redis(client: FlaskClient, mocker, mock_db):
+    _insert_materialized(mock_db, "live")
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+    mocker.patch("blueprints.stats.LIVE_STATS_ENABLED", True)
+    mocker.patch("blueprints.stats.get_redis_or_none", return_value=None)
+
+    response = client.get("/stats/live/live")
+    assert response.status_code == 503
+
+
+def test_stats_live_streams_clicks(client: FlaskClient, mocker, mock_db):
+    import queue
+
+    _insert_materialized(mock_db, "live", password="secret")
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+    mocker.patch("blueprints.stats.LIVE_STATS_ENABLED", True)
+    mocker.patch("blueprints.stats.get_redis_or_none", return_value=object())
+    viewer = queue.Queue()
+    viewer.put({"date": "2024-01-01", "dims": {"browser": "Chrome"}})
+    mocker.patch("blueprints.stats.click_hub.subscribe", return_value=viewer)
+    unsubscribe = mocker.patch("blueprints.stats.click_hub.unsubscribe")
+
+    assert client.get("/stats/live/live").status_code == 400
+
+    response = client.get("/stats/live/live?password=secret", buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    events = iter(response.response)
+    assert next(events) == b"retry: 5000\nevent: version\ndata: 1\n\n"
+    assert next(events).startswith(b'event: click\ndata: {"date": "2024-01-01"')
+    response.close()
+    unsubscribe.assert_called_once_with("live", viewer)
+
+
+def _wait_for_job(client, status_url):
+    for _ in range(200):
+        response = client.get(status_url)
+        if response.json["status"] not in ("queued", "running"):
+            return response
+        time.sleep(0.01)
+    raise AssertionError("export job did not finish")
+
+
+def test_export_jobs(client: FlaskClient, mocker, mock_db):
+    _insert_materialized(mock_db, "jobbed", password="secret")
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+
+    data = {"short_code": "jobbed", "format": "json"}
+    assert client.post("/api/export/jobs", data=data).status_code == 400
+    assert (
+        client.post("/api/export/jobs", data={**data, "format": "pdf"}).status_code
+        == 400
+    )
+
+    response = client.post("/api/export/jobs", data={**data, "password": "secret"})
+    assert response.status_code in (200, 202)
+    job_id = response.json["job_id"]
+    status_url = urllib.parse.urlparse(response.json["status_url"]).path
+
+    # identical requests share the job
+    response = client.post("/api/export/jobs", data={**data, "password": "secret"})
+    assert response.json["job_id"] == job_id
+
+    response = _wait_for_job(client, status_url)
+    assert response.status_code == 200
+    assert response.json["status"] == "done"
+    download_url = urllib.parse.urlparse(response.json["download_url"])
+
+    assert client.get(f"{download_url.path}?token=forged").status_code == 403
+    response = client.get(f"{download_url.path}?{download_url.query}")
+    assert response.status_code == 200
+    assert response.mimetype == "application/json"
+    assert json.loads(response.data)["short_code"] == "jobbed"
+
+    assert client.get("/api/export/jobs/unknown").status_code == 404
+
+    # exports of very popular links are handed to the same job system...
+    mocker.patch("blueprints.stats.EXPORT_ASYNC_MIN_CLICKS", 1)
+    response = client.get("/export/jobbed/csv?password=secret")
+    assert response.json["job_id"] != job_id
+    assert response.json["format"] == "csv"
+    _wait_for_job(client, urllib.parse.urlparse(response.json["status_url"]).path)
+
+    # ...whose finished artifacts are served from the export cache
+    load_stats = mocker.patch("blueprints.stats.load_stats")
+    response = client.get("/export/jobbed/json?password=secret")
+    assert response.status_code == 200
+    assert json.loads(response.data)["short_code"] == "jobbed"
+    assert not load_stats.called
+
+
+def test_export_job_failure_is_retried(tmp_path):
+    from utils.export_jobs import ExportJobs
+
+    jobs = ExportJobs(str(tmp_path), workers=1)
+
+    def broken(output):
+        raise ValueError("boom")
+
+    def wait(job_id):
+        for _ in range(200):
+            job = jobs.get(job_id)
+            if job["status"] not in ("queued", "running"):
+                return job
+            time.sleep(0.01)
+        raise AssertionError("export job did not finish")
+
+    job = jobs.submit("key", broken, short_code="x", format="json")
+    assert wait(job["id"])["status"] == "failed"
+
+    job = jobs.submit("key", lambda output: output.write(b"ok"), format="json")
+    assert wait(job["id"])["status"] == "done"
+    with open(jobs.artifact_path(job["id"]), "rb") as file:
+        assert file.read() == b"ok"
+
+
+def test_export_job_heartbeat_keeps_long_builds_alive(tmp_path, mocker):
+    from utils.export_jobs import ExportJobs
+
+    mocker.patch("utils.export_jobs.EXPORT_JOB_TIMEOUT", 0.2)
+    jobs = ExportJobs(str(tmp_path), workers=1)
+    release = threading.Event()
+
+    def slow(output):
+        release.wait(5)
+        output.write(b"ok")
+
+    job = jobs.submit("slow", slow, format="json")
+    time.sleep(0.5)
+    assert jobs.get(job["id"])["status"] == "running"
+    # an identical request joins the job instead of rebuilding it
+    assert jobs.submit("slow", slow, format="json")["status"] == "running"
+    release.set()
+    for _ in range(200):
+        if jobs.get(job["id"])["status"] == "done":
+            break
+        time.sleep(0.01)
+    assert jobs.get(job["id"])["status"] == "done"
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".tmp")] == []
+
+
+def test_export_served_from_artifact_cache(client: FlaskClient, mocker, mock_db):
+    _insert_materialized(mock_db, "cached")
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+
+    response = client.get("/export/cached/csv")
+    assert response.status_code == 200
+    body = response.data
+
+    # no clicks since: the file is served from disk without recomputing
+    load_stats = mocker.patch("blueprints.stats.load_stats")
+    response = client.get("/export/cached/csv")
+    assert response.status_code == 200
+    assert response.data == body
+    assert not load_stats.called
+
+    mock_db.urls.update_one({"_id": "cached"}, {"$inc": {"total-clicks": 1}})
+    load_stats.return_value = None
+    assert client.get("/export/cached/csv").status_code == 404
+    assert load_stats.called
+
+
+def test_export_cache_evicts_least_recently_used(tmp_path):
+    from cache.export_cache import ExportCache
+
+    cache = ExportCache(str(tmp_path), max_bytes=10)
+    first = cache.put("first", lambda output: output.write(b"1234"))
+    second = cache.put("second", lambda output: output.write(b"1234"))
+    os.utime(first, (1, 1))
+    os.utime(second, (2, 2))
+    assert cache.get("first") == first  # now the most recently used
+
+    cache.put("third", lambda output: output.write(b"1234"))
+    assert cache.get("second") is None
+    assert cache.get("first") and cache.get("third")
+
+    def broken(output):
+        output.write(b"12")
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        cache.put("fourth", broken)
+    assert cache.get("fourth") is None
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_export_parquet(client: FlaskClient, mocker, mock_db):
+    pytest.importorskip("pyarrow")
+    _insert_materialized(mock_db, "columnar")
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+
+    response = client.get("/export/columnar/parquet")
+    assert response.status_code == 200
+    assert response.mimetype == "application/zip"
+    assert "parquet" in response.headers["Content-Disposition"]
+
+    response = client.post("/export/columnar/pdf")
+    assert response.status_code == 400
+    assert "parquet" in response.json["FormatError"]
+
+
+def test_export_bulk(client: FlaskClient, mocker, mock_db):
+    import io
+    import zipfile
+
+    _insert_materialized(mock_db, "first")
+    _insert_materialized(mock_db, "second")
+    _insert_materialized(mock_db, "locked", password="secret")
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+    mocker.patch("blueprints.stats.EXPORT_BULK_FETCH_SIZE", 2)
+    aggregate = mocker.spy(mock_db.urls, "aggregate")
+
+    response = client.post(
+        "/api/export/bulk",
+        json={
+            "short_codes": ["first", "missing", "second", "locked", "first"],
+            "format": "json",
+        },
+    )
+    assert response.status_code == 200
+    assert response.mimetype == "application/zip"
+    assert "bulk-export-json" in response.headers["Content-Disposition"]
+
+    with zipfile.ZipFile(io.BytesIO(response.data)) as zipf:
+        assert zipf.namelist() == [
+            "first/export.json",
+            "second/export.json",
+            "errors.json",
+        ]
+        assert json.loads(zipf.read("first/export.json"))["_id"] == "first"
+        assert json.loads(zipf.read("errors.json")) == {
+            "missing": {"UrlError": "The requested Url never existed"},
+            "locked": {"PasswordError": "Invalid Password"},
+        }
+    # access is checked on the metadata of all links, then the stats are read
+    # with one batched query per group of EXPORT_BULK_FETCH_SIZE links
+    assert aggregate.call_count == 3
+    assert aggregate.call_args_list[1][0][0][0] == {
+        "$match": {"_id": {"$in": ["first"]}}
+    }
+
+    body = {
+        "short_codes": ["locked"],
+        "format": "csv",
+        "passwords": {"locked": "secret"},
+    }
+    response = client.post("/api/export/bulk", json=body)
+    with zipfile.ZipFile(io.BytesIO(response.data)) as zipf:
+        names = zipf.namelist()
+        assert names
+        assert all(name.startswith("locked/") for name in names)
+
+    # built exports are cached: the same archive again only reads metadata
+    aggregate.reset_mock()
+    response = client.post("/api/export/bulk", json=body)
+    with zipfile.ZipFile(io.BytesIO(response.data)) as zipf:
+        assert zipf.namelist() == names
+    assert aggregate.call_count == 1
+
+    # exports of very popular links are left to a background job
+    mocker.patch("blueprints.stats.EXPORT_ASYNC_MIN_CLICKS", 1)
+    submit = mocker.patch("blueprints.stats.export_jobs.submit")
+    submit.return_value = {"id": "job", "status": "queued"}
+    response = client.post(
+        "/api/export/bulk", json={"short_codes": ["second"], "format": "csv"}
+    )
+    with zipfile.ZipFile(io.BytesIO(response.data)) as zipf:
+        error = json.loads(zipf.read("errors.json"))["second"]
+    assert error["job_id"] == "job"
+    assert error["status_url"].endswith("/api/export/jobs/job")
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        {},
+        {"short_codes": []},
+        {"short_codes": ["a"], "format": "pdf"},
+        {"short_codes": ["a"] * 201},
+    ],
+)
+def test_export_bulk_invalid_request(client: FlaskClient, body):
+    response = client.post("/api/export/bulk", json=body)
+    assert response.status_code == 400
+
+
+def test_raw_clicks_export(client: FlaskClient, mocker, mock_db):
+    from utils.click_log import click_log
+
+    _insert_materialized(mock_db, "raw")
+    _insert_materialized(mock_db, "locked", password="secret")
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+
+    now = datetime.now(timezone.utc)
+    old = now - timedelta(days=3)
+    for t, code in [
+        (old.timestamp(), "raw"),
+        (now.timestamp() - 2, "raw"),
+        (now.timestamp() - 1, "other"),
+        (now.timestamp(), "raw"),
+    ]:
+        click_log.append({"t": t, "code": code, "browser": "Firefox"})
+
+    # A segment of another worker process of the same hour, merged in order
+    click_log.flush()
+    segment = click_log._segment_path(now.timestamp(), "raw").rsplit(".", 2)[0]
+    with open(f"{segment}.1.ndjson", "a") as file:
+        file.write(json.dumps({"t": now.timestamp() - 1.5, "code": "raw"}) + "\n")
+        file.write('{"t": 1, "code": "raw", "brow')
+
+    # only the segments of the link's bucket are read
+    read = mocker.spy(click_log, "_iter_segment")
+    response = client.get("/stats/raw/clicks")
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    other = click_log._segment_path(now.timestamp(), "other")
+    assert other not in [call[0][0] for call in read.call_args_list]
+    events = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [event["t"] for event in events] == [
+        now.timestamp() - 2,
+        now.timestamp() - 1.5,
+        now.timestamp(),
+    ]
+    assert "code" not in events[0]
+
+    response = client.get("/stats/raw/clicks", query_string={"from": f"{old:%Y-%m-%d}"})
+    assert len(response.data.decode().splitlines()) == 4
+
+    response = client.get("/stats/raw/clicks", query_string={"from": "2020-01-01"})
+    assert response.status_code == 400
+    response = client.get("/stats/raw/clicks", query_string={"to": "yesterday"})
+    assert response.status_code == 400
+    response = client.get("/stats/locked/clicks")
+    assert response.status_code == 400
+    response = client.get("/stats/missing/clicks")
+    assert response.status_code == 404
+
+    mocker.patch("blueprints.stats.CLICK_EXPORT_MAX_BYTES", 10)
+    response = client.get("/stats/raw/clicks")
+    assert response.status_code == 413
+
+
+def test_click_log_retention(tmp_path):
+    from datetime import date
+    from utils.click_log import ClickLog
+
+    click_log = ClickLog(str(tmp_path), retention_days=2)
+    for day in ("2024-01-01", "2024-01-02", "2024-01-03"):
+        os.makedirs(tmp_path / day)
+
+    click_log.sweep(date(2024, 1, 4))
+    assert sorted(os.listdir(tmp_path)) == ["2024-01-02", "2024-01-03"]
+
+
+def test_click_log_subscribers_run_off_the_writer(tmp_path):
+    from utils.click_log import ClickLog
+
+    click_log = ClickLog(str(tmp_path))
+    release = threading.Event()
+    handled, attempts = [], []
+
+    def slow(events):
+        release.wait(5)
+        handled.append(len(events))
+
+    def flaky(events):
+        attempts.append(len(events))
+        return len(attempts) > 2
+
+    click_log.subscribe(slow)
+    click_log.subscribe(flaky)
+    now = datetime.now(timezone.utc)
+    click_log.append({"t": now.timestamp(), "code": "a"})
+
+    # The batch is on disk while the subscribers are still busy with it
+    click_log.flush()
+    assert len(list(click_log.iter_clicks("a", now.date(), now.date()))) == 1
+    assert not click_log.drain(0.05)
+
+    release.set()
+    assert click_log.drain(5)
+    assert handled == [1]
+    assert attempts == [1, 1, 1]
+
+
+def test_breakdown_from_daily_cubes(client: FlaskClient, mocker, mock_db):
+    from utils.click_log import click_log
+
+    _insert_materialized(mock_db, "cubed")
+    mocker.patch("utils.mongo_utils.urls_collection", mock_db.urls)
+    mocker.patch("utils.mongo_utils.stats_cubes_collection", mock_db.cubes)
+    mocker.patch("utils.cube_utils.CUBE_MAX_VALUES", 2)
+
+    # mongomock's bulk_write doesn't take pymongo's current UpdateOne
+    def update_cubes(operations):
+        for operation in operations:
+            mock_db.cubes.update_one(
+                operation._filter, operation._doc, upsert=operation._upsert
+            )
+
+    mocker.patch("utils.cube_utils.update_cubes", side_effect=update_cubes)
+
+    now = datetime.now(timezone.utc).timestamp()
+    for country, browser, os_name in [
+        ("Germany", "Chrome", "Windows"),
+        ("Germany", "Chrome", "Linux"),
+        ("Germany", "Firefox", "Linux"),
+        ("France", "Chrome", "Mac OS X"),
+        (None, "Chrome", "Windows"),
+    ]:
+        click_log.append(
+            {
+                "t": now,
+                "code": "cubed",
+                "country": country,
+                "browser": browser,
+                "os_name": os_name,
+            }
+        )
+    click_log.flush()
+    click_log.drain()
+    # Later batches are ranked against the counts of the earlier ones
+    click_log.append(
+        {"t": now, "code": "cubed", "country": "France", "browser": "Safari"}
+    )
+    click_log.flush()
+    click_log.drain()
+
+    cube = mock_db.cubes.find_one()
+    assert cube["link"] == "cubed"
+    assert cube["total"] == 6
+    assert cube["counts"]["country"] == {"Germany": 3, "France": 2, "unknown": 1}
+    assert cube["counts"]["os_name"] == {
+        "Windows": 2,
+        "Linux": 2,
+        "Mac OS X": 1,
+        "unknown": 1,
+    }
+
+    response = client.get(
+        "/stats/cubed/breakdown", query_string={"dims": "country,browser"}
+    )
+    assert response.status_code == 200
+    assert response.json["rows"] == [
+        {"country": "Germany", "browser": "Chrome", "clicks": 2},
+        {"country": "France", "browser": "Chrome", "clicks": 1},
+        {"country": "France", "browser": "other", "clicks": 1},
+        {"country": "Germany", "browser": "Firefox", "clicks": 1},
+        {"country": "other", "browser": "Chrome", "clicks": 1},
+    ]
+
+    response = client.get("/stats/cubed/breakdown", query_string={"dims": "os_name"})
+    assert response.json["rows"] == [
+        {"os_name": "Linux", "clicks": 2},
+        {"os_name": "Windows", "clicks": 2},
+        {"os_name": "other", "clicks": 2},
+    ]
+
+    response = client.get(
+        "/stats/cubed/breakdown",
+        query_string={"dims": "country", "from": "2020-01-01", "to": "2020-01-31"},
+    )
+    assert response.json["rows"] == []
+
+    for dims in ("", "country,country", "referrer"):
+        response = client.get("/stats/cubed/breakdown", query_string={"dims": dims})
+        assert response.status_code == 400
+
+
+def test_cubes_break_out_late_popular_values(mocker):
+    from utils.cube_utils import get_cube_updates, load_breakdown
+
+    mocker.patch("utils.cube_utils.CUBE_MAX_VALUES", 2)
+    now = datetime.now(timezone.utc)
+    day = f"{now:%Y-%m-%d}"
+
+    def clicks(*countries):
+        return [
+            {"t": now.timestamp(), "code": "late", "country": country}
+            for country in countries
+        ]
+
+    # Two rare countries come first, a popular one only later in the day
+    (first,) = get_cube_updates(clicks("Chad", "Fiji"), {})
+    counts = {f"late|{day}": {"country": {"Chad": 1, "Fiji": 1}}}
+    (second,) = get_cube_updates(clicks("Japan", "Japan", "Japan"), counts)
+    assert first._doc["$inc"]["cells.Chad|unknown|unknown"] == 1
+    assert second._doc["$inc"]["cells.Japan|unknown|unknown"] == 3
+    assert second._doc["$inc"]["counts.country.Japan"] == 3
+
+    # Reads rank by the day's counts and fold the rest
+    mocker.patch(
+        "utils.cube_utils.load_cubes",
+        return_value=[
+            {
+                "cells": {
+                    "Chad|unknown|unknown": 1,
+                    "Fiji|unknown|unknown": 1,
+                    "Japan|unknown|unknown": 3,
+                },
+                "counts": {"country": {"Chad": 1, "Fiji": 1, "Japan": 3}},
+            }
+        ],
+    )
+    assert load_breakdown("late", ["country"], day, day) == [
+        {"country": "Japan", "clicks": 3},
+        {"country": "Chad", "clicks": 1},
+        {"country": "other", "clicks": 1},
+    ]
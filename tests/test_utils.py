@@ -9,8 +9,10 @@ from utils.url_utils import (
 from utils.general import humanize_number, is_positive_integer
 from utils.analytics_utils import (
     convert_country_name,
+    convert_country_data,
     add_missing_dates,
-    top_four,
+    to_compact_stats,
+    to_daily_series,
     calculate_click_averages,
 )
 from flask import Flask
@@ -278,87 +280,53 @@ def test_add_missing_dates_empty_counter(mocker):
     assert result == expected_result
 
 
-# Test top four
-
-
-def test_top_four_less_than_six_countries():
-    country_data = {
-        "USA": 100,
-        "Germany": 80,
-        "Japan": 60,
-        "Canada": 40,
-        "Australia": 20,
-    }
-    result = top_four(country_data)
-    assert result == country_data
-
-
-def test_top_four_exactly_six_countries():
-    country_data = {
-        "USA": 100,
-        "Germany": 80,
-        "Japan": 60,
-        "Canada": 40,
-        "Australia": 20,
-        "France": 10,
-    }
-    result = top_four(country_data)
-    expected_result = {
-        "USA": 100,
-        "Germany": 80,
-        "Japan": 60,
-        "Canada": 40,
-        "others": 30,  # Sum of "Australia" and "France"
+def test_add_missing_dates_keeps_clicks_outside_range(mocker):
+    url_data = {
+        "creation-date": "2024-01-03",
+        "clicks": {"2024-01-02": 2, "2024-01-05": 1},
     }
-    assert result == expected_result
+    mocker.patch("utils.analytics_utils.datetime").now.return_value = datetime(
+        2024, 1, 4
+    )
+    result = add_missing_dates("clicks", url_data)
+    assert list(result["clicks"].items()) == [
+        ("2024-01-02", 2),
+        ("2024-01-03", 0),
+        ("2024-01-04", 0),
+        ("2024-01-05", 1),
+    ]
 
 
-def test_top_four_more_than_six_countries():
-    country_data = {
-        "USA": 100,
-        "Germany": 80,
-        "Japan": 60,
-        "Canada": 40,
-        "Australia": 20,
-        "France": 10,
-        "Brazil": 5,
-    }
-    result = top_four(country_data)
-    expected_result = {
-        "USA": 100,
-        "Germany": 80,
-        "Japan": 60,
-        "Canada": 40,
-        "others": 35,  # Sum of "Australia", "France", and "Brazil"
-    }
-    assert result == expected_result
+def test_to_daily_series_skips_malformed_keys():
+    counter = {"2024-01-02": 2, "not-a-date": 5, "2024-01-04": 1}
+    start, values = to_daily_series(counter, "2024-01-02", "2024-01-04")
+    assert str(start) == "2024-01-02"
+    assert values.tolist() == [2, 0, 1]
 
 
-def test_top_four_with_ties():
-    country_data = {
-        "USA": 100,
-        "Germany": 80,
-        "Japan": 80,
-        "Canada": 60,
-        "Australia": 60,
-        "France": 40,
-        "Brazil": 20,
+def test_to_compact_stats_gives_each_series_its_step():
+    url_data = {
+        "window": {"from": "2024-01-02", "to": "2024-01-03", "granularity": "hour"},
+        "counter": {"2024-01-02 01:00": 1, "2024-01-02 00:00": 2},
+        "unique_counter": {"2024-01-03": 1, "2024-01-02": 2},
     }
-    result = top_four(country_data)
-    expected_result = {
-        "USA": 100,
-        "Germany": 80,
-        "Japan": 80,
-        "Canada": 60,
-        "others": 120,  # Sum of "Australia", "France", and "Brazil"
+    compact = to_compact_stats(url_data, [])
+    assert "granularity" not in compact
+    assert compact["counter"] == {
+        "start": "2024-01-02 00:00",
+        "step": "hour",
+        "values": [2, 1],
+    }
+    assert compact["unique_counter"] == {
+        "start": "2024-01-02",
+        "step": "day",
+        "values": [2, 1],
     }
-    assert result == expected_result
 
 
-def test_top_four_empty_country_data():
-    country_data = {}
-    result = top_four(country_data)
-    assert result == {}
+def test_convert_country_data_prefers_stored_codes():
+    result = convert_country_data({"Kosovo": 3, "Germany": 2}, {"Kosovo": "XK"})
+    assert result == [{"id": "XK", "value": 3}, {"id": "DE", "value": 2}]
 
 
 # Test calculate click averages
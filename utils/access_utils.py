@@ -0,0 +1,87 @@
+import hashlib
+import hmac
+import os
+
+from flask import current_app, request
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+# How long a successful password check is remembered
+ACCESS_TOKEN_MAX_AGE = int(os.environ.get("ACCESS_TOKEN_MAX_AGE", 15 * 60))
+
+
+def _serializer():
+    return URLSafeTimedSerializer(current_app.secret_key, salt="link-access")
+
+
+def _password_fingerprint(password):
+    """
+    Keyed digest of the stored password, so tokens die as soon as the
+    password changes without ever embedding the password itself.
+    """
+    return hmac.new(
+        current_app.secret_key.encode(), password.encode(), hashlib.sha256
+    ).hexdigest()[:16]
+
+
+def access_cookie_name(short_code):
+    return f"access_{hashlib.sha256(short_code.encode()).hexdigest()[:16]}"
+
+
+def issue_access_token(short_code, password):
+    return _serializer().dumps({"c": short_code, "p": _password_fingerprint(password)})
+
+
+def verify_access_token(token, short_code, password):
+    if not token or password is None:
+        return False
+    try:
+        payload = _serializer().loads(token, max_age=ACCESS_TOKEN_MAX_AGE)
+    except BadSignature:
+        return False
+    return payload.get("c") == short_code and hmac.compare_digest(
+        payload.get("p", ""), _password_fingerprint(password)
+    )
+
+
+def get_access_token(short_code):
+    """
+    Token sent with the current request, either as `?token=` or in the
+    link's access cookie.
+    """
+    return request.values.get("token") or request.cookies.get(
+        access_cookie_name(short_code)
+    )
+
+
+def has_valid_access_token(short_code, password):
+    return verify_access_token(get_access_token(short_code), short_code, password)
+
+
+def set_access_cookie(response, short_code, password, token=None):
+    response.set_cookie(
+        access_cookie_name(short_code),
+        token or issue_access_token(short_code, password),
+        max_age=ACCESS_TOKEN_MAX_AGE,
+        httponly=True,
+        secure=request.is_secure,
+        samesite="Lax",
+    )
+    return response
+
+
+def _download_serializer():
+    return URLSafeTimedSerializer(current_app.secret_key, salt="export-download")
+
+
+def issue_download_token(job_id):
+    return _download_serializer().dumps({"j": job_id})
+
+
+def verify_download_token(token, job_id, max_age):
+    if not token:
+        return False
+    try:
+        payload = _download_serializer().loads(token, max_age=max_age)
+    except BadSignature:
+        return False
+    return payload.get("j") == job_id
@@ -1,10 +1,17 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 import functools
+import heapq
+from operator import itemgetter
+import numpy as np
 import pycountry
 
 
-def convert_country_data(data):
-    return [{"id": convert_country_name(k), "value": v} for k, v in data.items()]
+def convert_country_data(data, country_codes=None):
+    country_codes = country_codes or {}
+    return [
+        {"id": country_codes.get(k) or convert_country_name(k), "value": v}
+        for k, v in data.items()
+    ]
 
 
 @functools.lru_cache(maxsize=None)
@@ -19,53 +26,206 @@ def convert_country_name(country_name: str) -> str:
         return "XX"
 
 
-def add_missing_dates(key, url_data):
-    counter = url_data[key]
+def to_daily_series(counter, start, end=None):
+    """
+    Dense daily array for a `{"YYYY-MM-DD": count}` map. Returns the first day
+    and an int64 array indexed by day offset from it, zero-filled, covering
+    `start` through `end` (default today) and any dates in `counter` outside it.
+    Keys that aren't dates are skipped.
+    """
+    start = np.datetime64(start, "D")
+    end = np.datetime64(end or datetime.now().date(), "D")
 
-    # Get the current date
+    try:
+        dates = np.array(list(counter), dtype="datetime64[D]")
+    except ValueError:
+        counter = {key: count for key, count in counter.items() if _is_day(key)}
+        dates = np.array(list(counter), dtype="datetime64[D]")
+    counts = np.fromiter(counter.values(), dtype=np.int64, count=len(counter))
+    if len(dates):
+        start = min(start, dates.min())
+        end = max(end, dates.max())
 
-    # Get the first and last click dates
-    first_click_date = url_data["creation-date"]  # next(iter(counter.keys()))
-    last_click_date = datetime.now().strftime("%Y-%m-%d")
+    values = np.zeros(max(int((end - start).astype(np.int64)) + 1, 0), np.int64)
+    np.add.at(values, (dates - start).astype(np.int64), counts)
+    return start, values
 
-    # Convert the click dates to datetime objects
-    first_date = datetime.strptime(first_click_date, "%Y-%m-%d")
-    last_date = datetime.strptime(last_click_date, "%Y-%m-%d")
 
-    # Generate a list of dates between the first and last click dates
-    date_range = [
-        first_date + timedelta(days=x) for x in range((last_date - first_date).days + 1)
-    ]
-    all_dates = [date.strftime("%Y-%m-%d") for date in date_range]
+def _is_day(key):
+    try:
+        np.datetime64(key, "D")
+    except ValueError:
+        return False
+    return True
+
+
+def series_to_dict(start, values):
+    labels = np.datetime_as_string(start + np.arange(len(values)), unit="D")
+    return dict(zip(labels.tolist(), values.tolist()))
+
+
+def to_hourly_series(hourly_counter, start, end):
+    """
+    Dense hourly array for a `{"YYYY-MM-DD": {"HH": count}}` map covering the
+    days `start` through `end`, indexed by hour offset from `start` 00:00.
+    Hours outside that range are dropped.
+    """
+    start = np.datetime64(start, "D")
+    days = max(int((np.datetime64(end, "D") - start).astype(np.int64)) + 1, 0)
+
+    dates, hours, counts = [], [], []
+    for date, by_hour in hourly_counter.items():
+        for hour, count in by_hour.items():
+            dates.append(date)
+            hours.append(int(hour))
+            counts.append(count)
+
+    offsets = (np.array(dates, dtype="datetime64[D]") - start).astype(np.int64)
+    offsets = offsets * 24 + np.array(hours, dtype=np.int64)
+    counts = np.array(counts, dtype=np.int64)
+    in_range = (offsets >= 0) & (offsets < days * 24)
+
+    values = np.zeros(days * 24, np.int64)
+    np.add.at(values, offsets[in_range], counts[in_range])
+    return start.astype("datetime64[h]"), values
+
+
+def bucket_series(start, values, granularity):
+    """
+    Downsample a daily series to weeks (starting Monday) or calendar months.
+    Returns the first day of every bucket and the per-bucket totals.
+    """
+    days = start + np.arange(len(values))
+    if granularity == "week":
+        # 1970-01-01 was a Thursday
+        keys = days - (days.astype(np.int64) + 3) % 7
+    elif granularity == "month":
+        keys = days.astype("datetime64[M]")
+    else:
+        return days, values
+
+    if not len(values):
+        return keys, values
+    boundaries = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return keys[boundaries], np.add.reduceat(values, boundaries)
+
+
+def apply_window(url_data, start, end, granularity="day"):
+    """
+    Limit `counter` and `unique_counter` to the days `start` through `end` and
+    bucket them by `granularity`. Unique visitors are only tracked per day, so
+    for "hour" the `unique_counter` stays daily.
+    """
+    first_day = np.datetime64(start, "D")
+    days = int((np.datetime64(end, "D") - first_day).astype(np.int64)) + 1
+
+    for key in ("counter", "unique_counter"):
+        series_start, values = to_daily_series(url_data.get(key) or {}, start, end)
+        offset = int((first_day - series_start).astype(np.int64))
+        keys, values = bucket_series(
+            first_day, values[offset : offset + days], granularity
+        )
+        url_data[key] = dict(zip(np.datetime_as_string(keys).tolist(), values.tolist()))
+
+    if granularity == "hour":
+        hour_start, values = to_hourly_series(
+            url_data.get("hourly_counter") or {}, start, end
+        )
+        labels = np.datetime_as_string(hour_start + np.arange(len(values)))
+        url_data["counter"] = {
+            f"{label[:10]} {label[11:13]}:00": count
+            for label, count in zip(labels.tolist(), values.tolist())
+        }
+
+    url_data.pop("hourly_counter", None)
+    url_data["window"] = {"from": start, "to": end, "granularity": granularity}
+    return url_data
 
-    # Add missing dates with a counter value of 0
-    for date in all_dates:
-        if date not in counter:
-            counter[date] = 0
 
-    # Sort the counter dictionary by dates
-    sorted_counter = {date: counter[date] for date in sorted(counter.keys())}
+def add_missing_dates(key, url_data):
+    start, values = to_daily_series(url_data[key], url_data["creation-date"])
+    url_data[key] = series_to_dict(start, values)
+    return url_data
 
-    # Update the url_data with the modified counter
-    url_data[key] = sorted_counter
 
+def cap_dimensions(url_data, fields, limit):
+    """
+    Keep only the `limit` largest entries of each of the `fields` count maps.
+    The full size of every map that was cut is reported under "truncated".
+    """
+    url_data = dict(url_data)
+    truncated = {}
+    for field in fields:
+        counts = url_data.get(field)
+        if counts and len(counts) > limit:
+            truncated[field] = len(counts)
+            url_data[field] = dict(
+                heapq.nlargest(limit, counts.items(), key=itemgetter(1))
+            )
+    if truncated:
+        url_data["truncated"] = truncated
     return url_data
 
 
-def top_four(dictionary):
-    if len(dictionary) < 6:
-        return dictionary
-    sorted_dict = dict(sorted(dictionary.items(), key=lambda x: x[1], reverse=True))
-    new_dict = {}
-    others = 0
-    for i, (key, value) in enumerate(sorted_dict.items()):
-        if i < 4:
-            new_dict[key] = value
-        else:
-            others += value
-
-    new_dict["others"] = others
-    return new_dict
+def _compact_series(counter, step):
+    """
+    `{"start": first label, "step": step, "values": [...]}` for a counter map.
+    Daily series are densified so missing days don't shift the values.
+    """
+    if not counter:
+        return {"start": None, "step": step, "values": []}
+    first = min(counter)
+    if step == "day":
+        start, values = to_daily_series(counter, first, max(counter))
+        return {"start": str(start), "step": step, "values": values.tolist()}
+    return {
+        "start": first,
+        "step": step,
+        "values": [counter[key] for key in sorted(counter)],
+    }
+
+
+def to_compact_stats(url_data, dimensions):
+    """
+    Columnar form of a stats payload: time series become a start label plus
+    an array of counts at a fixed step, and each dimension's count and unique
+    maps share one array of keys with parallel value arrays. Each series
+    carries its own step, as unique visitors stay daily in hourly windows.
+    """
+    time_series = ("counter", "unique_counter")
+    granularity = (url_data.get("window") or {}).get("granularity", "day")
+    compact = {
+        key: value
+        for key, value in url_data.items()
+        if key not in time_series
+        and key not in dimensions
+        and not (key.startswith("unique_") and key[7:] in dimensions)
+        and key != "country_code"
+    }
+    compact["format"] = "compact"
+
+    for key in time_series:
+        if key in url_data:
+            step = granularity
+            if key == "unique_counter" and granularity == "hour":
+                step = "day"
+            compact[key] = _compact_series(url_data[key], step)
+
+    country_codes = url_data.get("country_code") or {}
+    for field in dimensions:
+        if field not in url_data and f"unique_{field}" not in url_data:
+            continue
+        counts = url_data.get(field) or {}
+        unique = url_data.get(f"unique_{field}") or {}
+        keys = list(counts) + [key for key in unique if key not in counts]
+        columns = {"keys": keys, "counts": [counts.get(key, 0) for key in keys]}
+        if f"unique_{field}" in url_data:
+            columns["unique"] = [unique.get(key, 0) for key in keys]
+        if field == "country":
+            columns["codes"] = [country_codes.get(key) for key in keys]
+        compact[field] = columns
+
+    return compact
 
 
 def calculate_click_averages(data):
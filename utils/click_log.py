@@ -0,0 +1,301 @@
+import atexit
+import hashlib
+import heapq
+import json
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# Raw click events are appended to hourly segment files under this directory,
+# one folder per UTC day, so questions the counters can't answer can still be
+# asked about past clicks. Each hour is split into 256 buckets by link, so
+# reading one link's clicks only scans the links that share its bucket.
+CLICK_LOG_DIR = os.environ.get("CLICK_LOG_DIR") or os.path.join(
+    tempfile.gettempdir(), "ket-horse-click-log"
+)
+# Queued events are written at least this often, and as soon as this many wait
+CLICK_LOG_BATCH_SIZE = int(os.environ.get("CLICK_LOG_BATCH_SIZE", 500))
+CLICK_LOG_FLUSH_SECONDS = float(os.environ.get("CLICK_LOG_FLUSH_SECONDS", 1))
+# Events waiting to be written; beyond this, new ones are dropped rather than
+# slowing down redirects
+CLICK_LOG_QUEUE_SIZE = int(os.environ.get("CLICK_LOG_QUEUE_SIZE", 10_000))
+# Days of segments kept; 0 keeps them forever
+CLICK_LOG_RETENTION_DAYS = int(os.environ.get("CLICK_LOG_RETENTION_DAYS", 90))
+
+# Written batches waiting for the subscribers, and how often and how long
+# apart a subscriber is retried before its batch is given up
+CLICK_LOG_PENDING_BATCHES = 100
+CLICK_LOG_SUBSCRIBER_RETRIES = 3
+CLICK_LOG_RETRY_SECONDS = 1.0
+# Longest wait at exit for the subscribers to catch up
+CLICK_LOG_EXIT_SECONDS = 10.0
+
+
+class ClickLog:
+    """
+    Append-only, time-partitioned log of click events. Redirects only put
+    events on an in-memory queue; one writer thread per process appends them
+    to `<day>/<hour>.<bucket>.<pid>.ndjson` every `flush_seconds`, or as soon
+    as `batch_size` events are waiting. Each process has its own segment files,
+    so writers never interleave, and every file is in the order its clicks
+    happened. Written batches are handed to the subscribers on a thread of
+    their own, so a slow subscriber never holds up writing.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        batch_size: int = 500,
+        flush_seconds: float = 1.0,
+        queue_size: int = 10_000,
+        retention_days: int = 90,
+    ) -> None:
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.retention_days = retention_days
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._swept: Optional[date] = None
+        self._subscribers: List[Callable[[List[Dict[str, Any]]], Any]] = []
+        self._pending: queue.Queue = queue.Queue(maxsize=CLICK_LOG_PENDING_BATCHES)
+        atexit.register(self.close)
+
+    def append(self, event: Dict[str, Any]) -> None:
+        """
+        Queue a click event (with its POSIX time as `t`) for writing.
+        """
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self._queue.qsize() >= self.batch_size:
+            self._wake.set()
+
+    def subscribe(self, callback: Callable[[List[Dict[str, Any]]], Any]) -> None:
+        """
+        Have `callback(events)` called with every batch once it is written.
+        A callback that raises or returns False is retried with the batch.
+        """
+        self._subscribers.append(callback)
+
+    def _ensure_writer(self) -> None:
+        # Threads don't survive a fork; start one per worker process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(
+                    target=self._run, name="click-log", daemon=True
+                )
+                self._thread.start()
+                threading.Thread(
+                    target=self._dispatch, name="click-log-subscribers", daemon=True
+                ).start()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write out everything queued so far. Once it returns, every event
+        appended before the call is on disk.
+        """
+        with self._write_lock:
+            batch = []
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every batch written so far has been through the
+        subscribers. Returns False if `timeout` seconds passed first.
+        """
+        self._ensure_writer()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._pending.all_tasks_done:
+            while self._pending.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._pending.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self) -> None:
+        self.flush()
+        if not self.drain(CLICK_LOG_EXIT_SECONDS):
+            print("[ClickLog] Exiting with click batches not yet handed on")
+
+    def _dispatch(self) -> None:
+        while True:
+            batch = self._pending.get()
+            try:
+                for callback in self._subscribers:
+                    self._deliver(callback, batch)
+            finally:
+                self._pending.task_done()
+
+    def _deliver(self, callback: Callable[[List[Dict[str, Any]]], Any], batch) -> None:
+        for attempt in range(CLICK_LOG_SUBSCRIBER_RETRIES + 1):
+            if attempt:
+                time.sleep(CLICK_LOG_RETRY_SECONDS * attempt)
+            try:
+                if callback(batch) is not False:
+                    return
+            except Exception as e:
+                print(f"[ClickLog] Error handing {len(batch)} clicks on: {e}")
+        print(f"[ClickLog] Gave up handing {len(batch)} clicks to {callback}")
+
+    @staticmethod
+    def _bucket(short_code: str) -> str:
+        return hashlib.sha256(short_code.encode()).hexdigest()[:2]
+
+    def _segment_path(self, timestamp: float, short_code: str) -> str:
+        moment = datetime.fromtimestamp(timestamp, timezone.utc)
+        return os.path.join(
+            self.directory,
+            f"{moment:%Y-%m-%d}",
+            f"{moment:%H}.{self._bucket(short_code)}.{os.getpid()}.ndjson",
+        )
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        segments: Dict[str, List[str]] = {}
+        batch = sorted(batch, key=lambda event: event["t"])
+        for event in batch:
+            line = json.dumps(event, separators=(",", ":"), default=str)
+            path = self._segment_path(event["t"], str(event.get("code")))
+            segments.setdefault(path, []).append(line)
+
+        for path, lines in segments.items():
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "a") as file:
+                    file.write("\n".join(lines) + "\n")
+            except OSError as e:
+                print(f"[ClickLog] Error writing {len(lines)} clicks: {e}")
+
+        if self._subscribers:
+            try:
+                self._pending.put_nowait(batch)
+            except queue.Full:
+                print(f"[ClickLog] Subscribers behind, skipped {len(batch)} clicks")
+
+        if self.dropped:
+            print(f"[ClickLog] Dropped {self.dropped} clicks, queue full")
+            self.dropped = 0
+
+        today = datetime.now(timezone.utc).date()
+        if self._swept != today:
+            self._swept = today
+            self.sweep(today)
+
+    def sweep(self, today: date) -> None:
+        """
+        Delete the segments of days past the retention period.
+        """
+        if not self.retention_days:
+            return
+        oldest = (today - timedelta(days=self.retention_days)).isoformat()
+        try:
+            days = os.listdir(self.directory)
+        except OSError:
+            return
+        for day in days:
+            if day < oldest:
+                shutil.rmtree(os.path.join(self.directory, day), ignore_errors=True)
+
+    def _iter_segment(self, path: str, needle: str) -> Iterator[Dict[str, Any]]:
+        try:
+            with open(path) as file:
+                for line in file:
+                    # Cheap substring test before parsing every other link's clicks
+                    if needle not in line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        # A line still being written by another process
+                        continue
+        except OSError:
+            return
+
+    def _segments(self, short_code: str, start: date, end: date) -> Iterator[List[str]]:
+        """
+        Paths of the segments that may hold clicks of a link, one list per
+        hour from `start` to `end`. Only the link's bucket is listed.
+        """
+        bucket = self._bucket(short_code)
+        day = start
+        while day <= end:
+            day_dir = os.path.join(self.directory, day.isoformat())
+            try:
+                names = sorted(os.listdir(day_dir))
+            except OSError:
+                names = []
+
+            hours: Dict[str, List[str]] = {}
+            for name in names:
+                parts = name.split(".")
+                if len(parts) != 4 or parts[3] != "ndjson" or parts[1] != bucket:
+                    continue
+                hours.setdefault(parts[0], []).append(os.path.join(day_dir, name))
+            for hour in sorted(hours):
+                yield hours[hour]
+            day += timedelta(days=1)
+
+    def scan_size(self, short_code: str, start: date, end: date) -> int:
+        """
+        Bytes `iter_clicks` reads for the same link and days.
+        """
+        size = 0
+        for paths in self._segments(short_code, start, end):
+            for path in paths:
+                try:
+                    size += os.path.getsize(path)
+                except OSError:
+                    continue
+        return size
+
+    def iter_clicks(
+        self, short_code: str, start: date, end: date
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Click events of a link from `start` to `end` (UTC days, inclusive) in
+        the order they happened.
+        """
+        needle = json.dumps(short_code)
+        for paths in self._segments(short_code, start, end):
+            segments = [self._iter_segment(path, needle) for path in paths]
+            for event in heapq.merge(*segments, key=lambda event: event["t"]):
+                if event.get("code") == short_code:
+                    yield event
+
+
+click_log = ClickLog(
+    CLICK_LOG_DIR,
+    CLICK_LOG_BATCH_SIZE,
+    CLICK_LOG_FLUSH_SECONDS,
+    CLICK_LOG_QUEUE_SIZE,
+    CLICK_LOG_RETENTION_DAYS,
+)
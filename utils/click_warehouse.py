@@ -0,0 +1,270 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import date, datetime, time as dt_time, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from utils.click_log import click_log
+
+# Embedded SQL store of click events for analytics across links, one per
+# host, fed from the click log's write batches instead of the primary database
+CLICK_WAREHOUSE_PATH = os.environ.get("CLICK_WAREHOUSE_PATH") or os.path.join(
+    tempfile.gettempdir(), "ket-horse-clicks.sqlite3"
+)
+# Days of clicks kept; 0 keeps them forever
+CLICK_WAREHOUSE_RETENTION_DAYS = int(
+    os.environ.get("CLICK_WAREHOUSE_RETENTION_DAYS", 90)
+)
+# Ad-hoc queries are cancelled after this many seconds and capped at this
+# many rows
+ANALYTICS_QUERY_TIMEOUT = float(os.environ.get("ANALYTICS_QUERY_TIMEOUT", 5))
+ANALYTICS_QUERY_MAX_ROWS = int(os.environ.get("ANALYTICS_QUERY_MAX_ROWS", 10_000))
+
+# Event fields stored as dictionary-encoded columns. Whether a click was
+# unique isn't among them: redirects served from the URL cache only learn
+# that later, in the database.
+WAREHOUSE_DIMENSIONS = ("browser", "os_name", "country", "referrer", "bot")
+
+INSERT_CLICKS = (
+    "INSERT INTO clicks (t, link, tsdice, browser, os_name, country, referrer, bot)"
+    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dims (
+    id INTEGER PRIMARY KEY,
+    value TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS clicks (
+    t INTEGER NOT NULL,
+    link INTEGER NOT NULL,
+    tsdice INTEGER NOT NULL,
+    browser INTEGER,
+    os_name INTEGER,
+    country INTEGER,
+    referrer INTEGER,
+    bot INTEGER
+);
+CREATE INDEX IF NOT EXISTS clicks_t ON clicks (t);
+CREATE INDEX IF NOT EXISTS clicks_link_t ON clicks (link, t);
+CREATE VIEW IF NOT EXISTS click_events AS
+SELECT
+    c.t AS t,
+    link.value AS short_code,
+    c.tsdice AS tsdice,
+    browser.value AS browser,
+    os_name.value AS os_name,
+    country.value AS country,
+    referrer.value AS referrer,
+    bot.value AS bot
+FROM clicks c
+JOIN dims link ON link.id = c.link
+LEFT JOIN dims browser ON browser.id = c.browser
+LEFT JOIN dims os_name ON os_name.id = c.os_name
+LEFT JOIN dims country ON country.id = c.country
+LEFT JOIN dims referrer ON referrer.id = c.referrer
+LEFT JOIN dims bot ON bot.id = c.bot;
+"""
+
+# Predefined reports: the grouping expression over `clicks`, and whether the
+# group is a dictionary id to decode (top lists, most clicks first) or a
+# time bucket (in time order)
+REPORTS = {
+    "top_countries": ("c.country", True),
+    "top_browsers": ("c.browser", True),
+    "top_os": ("c.os_name", True),
+    "top_referrers": ("c.referrer", True),
+    "top_bots": ("c.bot", True),
+    "top_links": ("c.link", True),
+    "clicks_by_hour": ("strftime('%H', c.t, 'unixepoch')", False),
+    "clicks_by_day": ("date(c.t, 'unixepoch')", False),
+}
+
+
+class QueryError(Exception):
+    pass
+
+
+class ClickWarehouse:
+    """
+    Click events in SQLite (WAL mode, so the worker processes of a host can
+    share one file), one row per click, with every text value stored once
+    in `dims` and referenced by id. Ad-hoc queries go through the decoded `click_events`
+    view on a read-only connection.
+    """
+
+    def __init__(self, path: str, retention_days: int = 90) -> None:
+        self.path = path
+        self.retention_days = retention_days
+        self._local = threading.local()
+        self._dim_ids: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+        self._pruned: Optional[date] = None
+
+    def _connect(self, readonly: bool = False) -> sqlite3.Connection:
+        # One connection per thread, and per process after a fork
+        key = (self.path, os.getpid(), readonly)
+        connection = getattr(self._local, "connections", {}).get(key)
+        if connection is not None:
+            return connection
+
+        if readonly:
+            # Creates the file and schema on first use
+            self._connect()
+            connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+            connection.execute("PRAGMA query_only = ON")
+            connection.execute("PRAGMA busy_timeout = 5000")
+            # No ATTACH, PRAGMA or anything else that isn't reading
+            connection.set_authorizer(_read_only_authorizer)
+        else:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            connection.execute("PRAGMA busy_timeout = 5000")
+            connection.executescript(SCHEMA)
+
+        if not hasattr(self._local, "connections"):
+            self._local.connections = {}
+        self._local.connections[key] = connection
+        return connection
+
+    def _dim_id(self, connection: sqlite3.Connection, value: Any) -> Optional[int]:
+        if value is None:
+            return None
+        value = str(value)
+        dim_id = self._dim_ids.get((self.path, value))
+        if dim_id is None:
+            connection.execute(
+                "INSERT OR IGNORE INTO dims (value) VALUES (?)", (value,)
+            )
+            dim_id = connection.execute(
+                "SELECT id FROM dims WHERE value = ?", (value,)
+            ).fetchone()[0]
+            self._dim_ids[(self.path, value)] = dim_id
+        return dim_id
+
+    def ingest(self, events: Sequence[Dict[str, Any]]) -> bool:
+        """
+        Insert a batch of click log events in one transaction. Returns False
+        when it was rolled back, so the batch can be tried again.
+        """
+        with self._lock:
+            try:
+                connection = self._connect()
+                with connection:
+                    rows = [
+                        (
+                            int(event["t"]),
+                            self._dim_id(connection, event["code"]),
+                            1 if event.get("tsdice") else 0,
+                            *(
+                                self._dim_id(connection, event.get(field))
+                                for field in WAREHOUSE_DIMENSIONS
+                            ),
+                        )
+                        for event in events
+                    ]
+                    connection.executemany(INSERT_CLICKS, rows)
+            except sqlite3.Error as e:
+                # A rolled back transaction may have taken new dims with it
+                self._dim_ids.clear()
+                print(f"[ClickWarehouse] Error ingesting {len(events)} clicks: {e}")
+                return False
+
+            try:
+                self._prune(connection)
+            except sqlite3.Error as e:
+                print(f"[ClickWarehouse] Error pruning old clicks: {e}")
+            return True
+
+    def _prune(self, connection: sqlite3.Connection) -> None:
+        today = datetime.now(timezone.utc).date()
+        if not self.retention_days or self._pruned == today:
+            return
+        self._pruned = today
+        oldest = today - timedelta(days=self.retention_days)
+        with connection:
+            connection.execute("DELETE FROM clicks WHERE t < ?", (_timestamp(oldest),))
+
+    def report(
+        self,
+        name: str,
+        start: date,
+        end: date,
+        tsdice_only: bool = False,
+        limit: int = 10,
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        Rows `{"key", "clicks"}` of a predefined report over
+        `start` to `end` (UTC days, inclusive), or None when the store
+        couldn't be read.
+        """
+        group, decode = REPORTS[name]
+        key = "d.value" if decode else "g"
+        join = "JOIN dims d ON d.id = g" if decode else ""
+        order = "clicks DESC, d.value" if decode else "g"
+        sql = f"""
+            SELECT {key}, clicks FROM (
+                SELECT {group} AS g, COUNT(*) AS clicks
+                FROM clicks c
+                WHERE c.t >= ? AND c.t < ? AND (? = 0 OR c.tsdice = 1)
+                  AND {group} IS NOT NULL
+                GROUP BY g
+            ) {join}
+            ORDER BY {order}
+            LIMIT ?
+        """
+        params = (
+            _timestamp(start),
+            _timestamp(end + timedelta(days=1)),
+            int(tsdice_only),
+            limit,
+        )
+        try:
+            rows = self._connect(readonly=True).execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            print(f"[ClickWarehouse] Error running report {name}: {e}")
+            return None
+        return [{"key": key, "clicks": clicks} for key, clicks in rows]
+
+    def query(
+        self, sql: str, params: Sequence[Any] = ()
+    ) -> Tuple[List[str], List[Tuple[Any, ...]]]:
+        """
+        Columns and rows of a read-only ad-hoc query. Raises QueryError when
+        the query is invalid, writes, runs too long or returns too many rows.
+        """
+        connection = self._connect(readonly=True)
+        deadline = time.monotonic() + ANALYTICS_QUERY_TIMEOUT
+        connection.set_progress_handler(lambda: time.monotonic() > deadline, 10_000)
+        try:
+            cursor = connection.execute(sql, params)
+            rows = cursor.fetchmany(ANALYTICS_QUERY_MAX_ROWS + 1)
+        except sqlite3.Error as e:
+            raise QueryError(str(e)) from e
+        finally:
+            connection.set_progress_handler(None, 0)
+
+        if len(rows) > ANALYTICS_QUERY_MAX_ROWS:
+            raise QueryError(f"queries are limited to {ANALYTICS_QUERY_MAX_ROWS} rows")
+        columns = [column[0] for column in cursor.description or ()]
+        return columns, rows
+
+
+def _read_only_authorizer(action, *args) -> int:
+    if action in (sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION):
+        return sqlite3.SQLITE_OK
+    if action == getattr(sqlite3, "SQLITE_RECURSIVE", None):
+        return sqlite3.SQLITE_OK
+    return sqlite3.SQLITE_DENY
+
+
+def _timestamp(day: date) -> int:
+    return int(datetime.combine(day, dt_time(), timezone.utc).timestamp())
+
+
+click_warehouse = ClickWarehouse(CLICK_WAREHOUSE_PATH, CLICK_WAREHOUSE_RETENTION_DAYS)
+click_log.subscribe(click_warehouse.ingest)
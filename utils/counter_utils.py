@@ -0,0 +1,130 @@
+import os
+import threading
+import time
+
+from utils.mongo_utils import (
+    GLOBAL_COUNTERS_ID,
+    BulkheadFullError,
+    aggregate_emoji_urls,
+    aggregate_urls,
+    claim_counters_sync,
+    load_counters,
+    set_counters,
+)
+
+COUNTER_SCOPES = ("urls", "emojis", "tsdice")
+
+# Links and clicks are added to the global counters as they happen; every so
+# often a background thread recounts them from the collections, so anything
+# an update missed doesn't stay missing
+GLOBAL_COUNTERS_SYNC_SECONDS = int(os.environ.get("GLOBAL_COUNTERS_SYNC_SECONDS", 3600))
+# Time a recount may take, and the wait after a failed one, doubling with
+# every failure in a row up to GLOBAL_COUNTERS_SYNC_SECONDS
+GLOBAL_COUNTERS_MAX_TIME_MS = 60_000
+GLOBAL_COUNTERS_RETRY_SECONDS = 60
+
+COUNTER_GROUP_STAGE = {
+    "$group": {
+        "_id": None,
+        "links": {"$sum": 1},
+        "clicks": {"$sum": "$total-clicks"},
+    }
+}
+
+_sync_lock = threading.Lock()
+_sync_thread = None
+
+
+def _count_global_counters():
+    """
+    Links and clicks of both collections per scope, or None when a query
+    failed.
+    """
+    max_time_ms = GLOBAL_COUNTERS_MAX_TIME_MS
+    try:
+        results = {
+            "urls": aggregate_urls([COUNTER_GROUP_STAGE], max_time_ms),
+            "emojis": aggregate_emoji_urls([COUNTER_GROUP_STAGE], max_time_ms),
+            "tsdice": aggregate_emoji_urls(
+                [{"$match": {"tsdice-config": True}}, COUNTER_GROUP_STAGE],
+                max_time_ms,
+            ),
+        }
+    except BulkheadFullError:
+        return None
+    if any(result is None for result in results.values()):
+        return None
+
+    counters = {}
+    for scope, result in results.items():
+        totals = result[0] if result else {}
+        counters[scope] = {
+            "links": totals.get("links", 0),
+            "clicks": totals.get("clicks", 0),
+        }
+    return counters
+
+
+def _sync_global_counters(synced, failures):
+    """
+    Recount the global counters last synced at `synced` (None if never),
+    unless another worker already is. After `failures` failed recounts in a
+    row, the next one is tried after a doubled backoff, not by the next read.
+    """
+    now = time.time()
+    if not claim_counters_sync(GLOBAL_COUNTERS_ID, synced, now):
+        return
+
+    counters = _count_global_counters()
+    if counters is None:
+        backoff = min(
+            GLOBAL_COUNTERS_RETRY_SECONDS * 2**failures, GLOBAL_COUNTERS_SYNC_SECONDS
+        )
+        print(f"[Counters] Recount failed, retrying in {backoff}s")
+        set_counters(
+            GLOBAL_COUNTERS_ID,
+            {
+                "synced": now - GLOBAL_COUNTERS_SYNC_SECONDS + backoff,
+                "sync_failures": failures + 1,
+            },
+        )
+        return
+    set_counters(GLOBAL_COUNTERS_ID, {**counters, "recounted": now, "sync_failures": 0})
+
+
+def _start_sync(counters):
+    global _sync_thread
+    # One recount at a time per process; a thread inherited from the parent
+    # of a forked worker is never alive, so each worker starts its own
+    with _sync_lock:
+        if _sync_thread is not None and _sync_thread.is_alive():
+            return
+        _sync_thread = threading.Thread(
+            target=_sync_global_counters,
+            args=(counters.get("synced"), counters.get("sync_failures", 0)),
+            name="global-counters",
+            daemon=True,
+        )
+        _sync_thread.start()
+
+
+def get_global_counters():
+    """
+    Site-wide `{scope: {"links": n, "clicks": n}}` for urls, emojis and
+    tsdice links with a single document read, or None when unavailable or
+    not counted yet. Recounts run in the background.
+    """
+    counters = load_counters(GLOBAL_COUNTERS_ID) or {}
+    synced = counters.get("synced")
+    if synced is None or time.time() - synced >= GLOBAL_COUNTERS_SYNC_SECONDS:
+        _start_sync(counters)
+    if "recounted" not in counters:
+        # Increments alone would show partial totals, starting from zero
+        return None
+    return {
+        scope: {
+            "links": (counters.get(scope) or {}).get("links", 0),
+            "clicks": (counters.get(scope) or {}).get("clicks", 0),
+        }
+        for scope in COUNTER_SCOPES
+    }
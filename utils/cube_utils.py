@@ -0,0 +1,171 @@
+from datetime import datetime, timezone
+import os
+import re
+
+from pymongo import UpdateOne
+
+from utils.click_log import click_log
+from utils.mongo_utils import load_cubes, update_cubes
+
+# Dimensions crossed in the daily per-link cubes, in cell key order
+CUBE_DIMENSIONS = ("country", "browser", "os_name")
+# Distinct values broken out per dimension per link and day. Every value is
+# counted on its own under `counts`; only the most clicked ones get cells of
+# their own and the rest are crossed as CUBE_OTHER, which bounds a cube at
+# (max + 1) ** 3 cells
+CUBE_MAX_VALUES = int(os.environ.get("CUBE_MAX_VALUES", 20))
+CUBE_OTHER = "other"
+CUBE_UNKNOWN = "unknown"
+
+
+def cube_id(short_code, day):
+    """
+    `_id` of the cube of a link for a day (YYYY-MM-DD). Sorting by it groups
+    the cubes of a link in date order, so date ranges are `_id` ranges.
+    """
+    return f"{short_code}|{day}"
+
+
+def _cube_value(value):
+    if value is None or value == "":
+        return CUBE_UNKNOWN
+    # Values are joined with "|" into field names
+    return re.sub(r"[.$|\x00-\x1F\x7F-\x9F]", "_", str(value))
+
+
+def _event_day(event):
+    return datetime.fromtimestamp(event["t"], timezone.utc).strftime("%Y-%m-%d")
+
+
+def _top_values(counts):
+    """
+    The CUBE_MAX_VALUES most clicked values of a `{value: clicks}` map.
+    """
+    ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    return {value for value, _ in ranked[:CUBE_MAX_VALUES]}
+
+
+def get_cube_updates(events, counts):
+    """
+    Bulk updates adding click log `events` to their cubes. `counts` maps the
+    `_id` of each cube to its `{dimension: {value: clicks}}` so far. A value
+    gets cells of its own once it is among the most clicked of its cube,
+    whenever in the day it first shows up.
+    """
+    cubes = {}
+    for event in events:
+        day = _event_day(event)
+        cube = cubes.setdefault(
+            cube_id(event["code"], day),
+            {"link": event["code"], "day": day, "clicks": [], "counts": {}},
+        )
+        values = [_cube_value(event.get(dimension)) for dimension in CUBE_DIMENSIONS]
+        cube["clicks"].append(values)
+        for dimension, value in zip(CUBE_DIMENSIONS, values):
+            added = cube["counts"].setdefault(dimension, {})
+            added[value] = added.get(value, 0) + 1
+
+    operations = []
+    for _id, cube in cubes.items():
+        stored = counts.get(_id) or {}
+        top = []
+        for dimension in CUBE_DIMENSIONS:
+            totals = dict(stored.get(dimension) or {})
+            for value, clicks in cube["counts"][dimension].items():
+                totals[value] = totals.get(value, 0) + clicks
+            top.append(_top_values(totals))
+
+        cells = {}
+        for values in cube["clicks"]:
+            key = "|".join(
+                value if value in admitted else CUBE_OTHER
+                for value, admitted in zip(values, top)
+            )
+            cells[key] = cells.get(key, 0) + 1
+
+        increments = {
+            "total": len(cube["clicks"]),
+            **{f"cells.{key}": clicks for key, clicks in cells.items()},
+            **{
+                f"counts.{dimension}.{value}": clicks
+                for dimension, added in cube["counts"].items()
+                for value, clicks in added.items()
+            },
+        }
+        operations.append(
+            UpdateOne(
+                {"_id": _id},
+                {
+                    "$setOnInsert": {"link": cube["link"], "day": cube["day"]},
+                    "$inc": increments,
+                },
+                upsert=True,
+            )
+        )
+    return operations
+
+
+def add_to_cubes(events):
+    """
+    Roll a batch of click log events up into their daily cubes with one
+    read of the value counts already in them and one bulk write. Returns
+    False when nothing was written.
+    """
+    ids = sorted({cube_id(event["code"], _event_day(event)) for event in events})
+    docs = load_cubes(ids=ids, projection={"counts": 1})
+    if docs is None:
+        print(f"[Cubes] Cubes unavailable for {len(events)} clicks")
+        return False
+
+    # Other processes write to the same cubes, so which values have cells can
+    # lag by a batch; load_breakdown folds by the exact counts either way
+    counts = {doc["_id"]: doc.get("counts") or {} for doc in docs}
+    return update_cubes(get_cube_updates(events, counts))
+
+
+def load_breakdown(short_code, dimensions, start, end):
+    """
+    Clicks of a link from `start` to `end` (UTC days, YYYY-MM-DD, inclusive)
+    broken down by `dimensions`, a subset of CUBE_DIMENSIONS, as
+    `[{dimension: value, ..., "clicks": n}]`, most clicks first. Only the
+    CUBE_MAX_VALUES most clicked values of each dimension over the range are
+    broken out; the rest are folded into CUBE_OTHER. Returns None when the
+    cubes couldn't be read.
+    """
+    docs = load_cubes(
+        id_range=(cube_id(short_code, start), cube_id(short_code, end)),
+        projection={"cells": 1, "counts": 1},
+    )
+    if docs is None:
+        return None
+
+    top = {}
+    for dimension in dimensions:
+        counts = {}
+        for doc in docs:
+            for value, clicks in (
+                (doc.get("counts") or {}).get(dimension) or {}
+            ).items():
+                counts[value] = counts.get(value, 0) + clicks
+        top[dimension] = _top_values(counts)
+
+    positions = [CUBE_DIMENSIONS.index(dimension) for dimension in dimensions]
+    totals = {}
+    for doc in docs:
+        for key, clicks in (doc.get("cells") or {}).items():
+            cell = key.split("|")
+            group = tuple(
+                cell[position] if cell[position] in top[dimension] else CUBE_OTHER
+                for dimension, position in zip(dimensions, positions)
+            )
+            totals[group] = totals.get(group, 0) + clicks
+
+    rows = [
+        {**dict(zip(dimensions, group)), "clicks": clicks}
+        for group, clicks in totals.items()
+    ]
+    rows.sort(key=lambda row: (-row["clicks"], [row[d] for d in dimensions]))
+    return rows
+
+
+click_log.subscribe(add_to_cubes)
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+# Finished exports are written here and kept for EXPORT_JOB_TTL seconds. All
+# workers of a host share the directory, which is also how they share jobs.
+EXPORT_JOB_DIR = os.environ.get("EXPORT_JOB_DIR") or os.path.join(
+    tempfile.gettempdir(), "ket-horse-exports"
+)
+EXPORT_JOB_WORKERS = int(os.environ.get("EXPORT_JOB_WORKERS", 2))
+EXPORT_JOB_TTL = int(os.environ.get("EXPORT_JOB_TTL", 60 * 60))
+# A job that hasn't finished after this long is assumed lost with its worker
+EXPORT_JOB_TIMEOUT = int(os.environ.get("EXPORT_JOB_TIMEOUT", 10 * 60))
+# Least time between two sweeps of the job directory by one worker process
+EXPORT_JOB_SWEEP_SECONDS = 60
+
+
+class ExportJobs:
+    """
+    Export files built in the background. A job is identified by a digest of
+    what it exports, so identical requests made while it is queued, running
+    or finished all land on the same job and file. Job state lives in a
+    small JSON file next to the artifact.
+    """
+
+    def __init__(self, directory: str, workers: int = 2, ttl: int = 3600) -> None:
+        self.directory = directory
+        self.workers = workers
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pid: Optional[int] = None
+        self._swept = 0.0
+
+    @staticmethod
+    def job_id(key: str) -> str:
+        return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+    def _status_path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def artifact_path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.export")
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # Threads don't survive a fork; start a pool per worker process
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="export-job"
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def _write_status(self, job: Dict[str, Any]) -> None:
+        job["updated"] = time.time()
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as file:
+            json.dump(job, file)
+        os.replace(tmp_path, self._status_path(job["id"]))
+
+    def _claim(self, job: Dict[str, Any]) -> bool:
+        """
+        Create the status file of a new job unless it already exists.
+        Hard-linking a complete temporary file makes this atomic.
+        """
+        job["updated"] = time.time()
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump(job, file)
+            os.link(tmp_path, self._status_path(job["id"]))
+            return True
+        except FileExistsError:
+            return False
+        finally:
+            os.unlink(tmp_path)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._status_path(job_id)) as file:
+                job = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if self._is_expired(job):
+            return None
+        if job["status"] in ("queued", "running") and self._is_lost(job):
+            job["status"] = "failed"
+        return job
+
+    def _is_expired(self, job: Dict[str, Any]) -> bool:
+        return job["status"] == "done" and time.time() - job["updated"] > self.ttl
+
+    def _is_lost(self, job: Dict[str, Any]) -> bool:
+        return time.time() - job["updated"] > EXPORT_JOB_TIMEOUT
+
+    def remove(self, job_id: str) -> None:
+        for path in (self._status_path(job_id), self.artifact_path(job_id)):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def sweep(self) -> None:
+        """
+        Delete expired artifacts and the state of lost or failed jobs.
+        """
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith(".json"):
+                job_id = name[: -len(".json")]
+                job = self.get(job_id)
+                if job is None or job["status"] == "failed":
+                    self.remove(job_id)
+
+    def submit(
+        self,
+        key: str,
+        build: Callable[[Any], None],
+        **meta: Any,
+    ) -> Dict[str, Any]:
+        """
+        Job for `key`, queueing `build(file)` to write its artifact unless an
+        identical job already exists. `meta` is stored with the job.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        if time.monotonic() - self._swept >= EXPORT_JOB_SWEEP_SECONDS:
+            self._swept = time.monotonic()
+            self.sweep()
+
+        job_id = self.job_id(key)
+        job = {"id": job_id, "status": "queued", "created": time.time(), **meta}
+        for _ in range(2):
+            if self._claim(job):
+                self._get_executor().submit(self._run, dict(job), build)
+                return job
+            existing = self.get(job_id)
+            if existing is not None and existing["status"] != "failed":
+                return existing
+            # Expired, failed or lost: start over
+            self.remove(job_id)
+        return job
+
+    def _heartbeat(self, job: Dict[str, Any], finished: threading.Event) -> None:
+        # Keeps a long build from being taken for lost and started again
+        while not finished.wait(EXPORT_JOB_TIMEOUT / 4):
+            self._write_status(dict(job))
+
+    def _run(self, job: Dict[str, Any], build: Callable[[Any], None]) -> None:
+        job["status"] = "running"
+        self._write_status(job)
+        finished = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(job, finished), daemon=True
+        )
+        heartbeat.start()
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                build(file)
+            os.replace(tmp_path, self.artifact_path(job["id"]))
+        except Exception as e:
+            print(f"[ExportJobs] Job {job['id']} failed: {e}")
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            job["status"] = "failed"
+        else:
+            job["status"] = "done"
+            job["size"] = os.path.getsize(self.artifact_path(job["id"]))
+        finally:
+            finished.set()
+            heartbeat.join()
+        self._write_status(job)
+
+
+export_jobs = ExportJobs(EXPORT_JOB_DIR, EXPORT_JOB_WORKERS, EXPORT_JOB_TTL)
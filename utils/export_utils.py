@@ -1,23 +1,80 @@
 import io
 from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font, NamedStyle
 import csv
+import functools
+import itertools
+import numbers
+import os
+import re
+import tempfile
+import time
 import zipfile
-from dicttoxml import dicttoxml
 import json
-from flask import send_file
+from flask import Response, send_file
+import numpy as np
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # parquet and arrow exports are optional
+    pa = None
+
+# Bytes buffered before a chunk of a streamed export is handed to the server
+EXPORT_CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE", 64 * 1024))
+
+
+EXCEL_SHEETS = [
+    ("Browser", "browser", ["Browser", "Count"]),
+    ("Counter", "counter", ["Date", "Count"]),
+    ("Country", "country", ["Country", "Count"]),
+    ("OS_Name", "os_name", ["OS_Name", "Count"]),
+    ("Referrer", "referrer", ["Referrer", "Count"]),
+    ("Unique_Browser", "unique_browser", ["Browser", "Count"]),
+    ("Unique_Counter", "unique_counter", ["Date", "Count"]),
+    ("Unique_Country", "unique_country", ["Country", "Count"]),
+    ("Unique_OS_Name", "unique_os_name", ["OS_Name", "Count"]),
+    ("Unique_Referrer", "unique_referrer", ["Referrer", "Count"]),
+    ("Bots", "bots", ["Bot", "Count"]),
+]
+
+
+def _excel_styles():
+    """
+    Named styles shared by every styled cell, so the workbook stores each
+    style once instead of one font/alignment record per cell.
+    """
+    label = NamedStyle(name="export_label", font=Font(bold=True))
+    value = NamedStyle(name="export_value", alignment=Alignment(horizontal="right"))
+    header = NamedStyle(
+        name="export_header",
+        font=Font(bold=True),
+        alignment=Alignment(horizontal="center"),
+    )
+    return label, value, header
 
-def export_to_excel(data):
-    output = io.BytesIO()
-    wb = Workbook()
 
-    # Bold font style
-    bold_font = Font(bold=True)
+def _styled(ws, value, style):
+    cell = WriteOnlyCell(ws, value=value)
+    cell.style = style
+    return cell
+
+
+def write_excel(data, output):
+    """
+    Write the XLSX export to the file object `output` with a write-only
+    workbook: rows go straight to per-sheet temporary files instead of being
+    held as cell objects, so memory stays flat however large the maps are.
+    """
+    wb = Workbook(write_only=True)
+    for style in _excel_styles():
+        wb.add_named_style(style)
 
     # General Info Sheet
-    ws_general_info = wb.active
-    ws_general_info.title = "General_Info"
+    ws_general_info = wb.create_sheet("General_Info")
+    ws_general_info.column_dimensions["A"].width = 25
+    ws_general_info.column_dimensions["B"].width = 20
     general_info = [
         ["TOTAL CLICKS", data["total-clicks"]],
         ["TOTAL UNIQUE CLICKS", data["total_unique_clicks"]],
@@ -39,50 +96,28 @@ def export_to_excel(data):
         ["LAST CLICK OS", data["last-click-os"]],
         ["LAST CLICK COUNTRY", data["last-click-country"]],
     ]
-    for row in general_info:
-        ws_general_info.append(row)
-
-    # Apply bold font style to the first column (headers)
-    for cell in ws_general_info["A"]:
-        cell.font = bold_font
-
-    # Set column widths
-    ws_general_info.column_dimensions["A"].width = 25
-    ws_general_info.column_dimensions["B"].width = 20
+    for label, value in general_info:
+        ws_general_info.append(
+            [
+                _styled(ws_general_info, label, "export_label"),
+                _styled(ws_general_info, value, "export_value"),
+            ]
+        )
 
-    # Align the second column to the right
-    for cell in ws_general_info["B"]:
-        cell.alignment = Alignment(horizontal="right")
-
-    # Helper function to add data to sheets
-    def add_sheet(wb, title, data, columns):
+    for title, field, columns in EXCEL_SHEETS:
         ws = wb.create_sheet(title)
-        ws.append(columns)
-
         ws.column_dimensions["A"].width = 20
-
-        for key, value in data.items():
+        ws.append([_styled(ws, column, "export_header") for column in columns])
+        for key, value in data.get(field, {}).items():
             ws.append([key, value])
 
-        # Apply bold font style to the first row (headers) and center align them
-        for cell in ws[1]:
-            cell.font = bold_font
-            cell.alignment = Alignment(horizontal="center")
-
-    # Adding other sheets
-    add_sheet(wb, "Browser", data["browser"], ["Browser", "Count"])
-    add_sheet(wb, "Counter", data["counter"], ["Date", "Count"])
-    add_sheet(wb, "Country", data["country"], ["Country", "Count"])
-    add_sheet(wb, "OS_Name", data["os_name"], ["OS_Name", "Count"])
-    add_sheet(wb, "Referrer", data["referrer"], ["Referrer", "Count"])
-    add_sheet(wb, "Unique_Browser", data["unique_browser"], ["Browser", "Count"])
-    add_sheet(wb, "Unique_Counter", data["unique_counter"], ["Date", "Count"])
-    add_sheet(wb, "Unique_Country", data["unique_country"], ["Country", "Count"])
-    add_sheet(wb, "Unique_OS_Name", data["unique_os_name"], ["OS_Name", "Count"])
-    add_sheet(wb, "Unique_Referrer", data["unique_referrer"], ["Referrer", "Count"])
-    add_sheet(wb, "Bots", data["bots"], ["Bot", "Count"])
-
     wb.save(output)
+
+
+def export_to_excel(data):
+    # Spooled to disk and streamed back from there by send_file
+    output = tempfile.TemporaryFile()
+    write_excel(data, output)
     output.seek(0)
 
     return send_file(
@@ -93,114 +128,497 @@ def export_to_excel(data):
     )
 
 
-def export_to_csv(data):
-    output = io.BytesIO()
+def _stream_file(chunks, mimetype, download_name):
+    return Response(
+        chunks,
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={download_name}"},
+    )
 
-    # Helper function to write a dictionary to a CSV file in the zip
-    def write_dict_to_csv(zipf, filename, dictionary, key_field, value_field):
-        with zipf.open(filename, "w") as file:
-            # Use TextIOWrapper to handle encoding and newline characters properly
-            with io.TextIOWrapper(file, encoding="utf-8", newline="") as text_file:
-                writer = csv.writer(text_file)
-                writer.writerow([key_field, value_field])
-                for key, value in dictionary.items():
-                    if isinstance(value, dict):
-                        # Handle nested dictionaries
-                        value = value.get("counts", 0)
-                    writer.writerow([key, value])
-
-    # Create a zip file in memory
-    with zipfile.ZipFile(output, mode="w", compression=zipfile.ZIP_DEFLATED) as zipf:
-        # Write general info CSV
-        general_info = {
-            "TOTAL CLICKS": data.get("total-clicks", "N/A"),
-            "TOTAL UNIQUE CLICKS": data.get("total_unique_clicks", "N/A"),
-            "URL": data.get("url", "N/A"),
-            "SHORT CODE": data.get("_id", "N/A"),
-            "MAX CLICKS": data.get("max-clicks", "N/A"),
-            "EXPIRATION TIME": data.get("expiration-time", "N/A"),
-            "PASSWORD": data.get("password", "N/A"),
-            "CREATION DATE": data.get("creation-date", "N/A"),
-            "CREATION TIME": data.get("creation-time", "N/A"),
-            "EXPIRED": data.get("expired", "N/A"),
-            "BLOCK BOTS": data.get("block-bots", "N/A"),
-            "AVERAGE DAILY CLICKS": data.get("average_daily_clicks", "N/A"),
-            "AVERAGE MONTHLY CLICKS": data.get("average_monthly_clicks", "N/A"),
-            "AVERAGE WEEKLY CLICKS": data.get("average_weekly_clicks", "N/A"),
-            "AVERAGE REDIRECTION TIME (in s)": data.get(
-                "average_redirection_time", "N/A"
-            ),
-            "LAST CLICK": data.get("last-click", "N/A"),
-            "LAST CLICK BROWSER": data.get("last-click-browser", "N/A"),
-            "LAST CLICK COUNTRY": data.get("last-click-country", "N/A"),
-            "LAST CLICK OS": data.get("last-click-os", "N/A"),
-        }
-        with zipf.open("general_info.csv", "w") as file:
+
+def _buffered(pieces, size=EXPORT_CHUNK_SIZE):
+    """
+    Join small text pieces into UTF-8 chunks of about `size` bytes.
+    """
+    buffer = []
+    buffered = 0
+    for piece in pieces:
+        buffer.append(piece)
+        buffered += len(piece)
+        if buffered >= size:
+            yield "".join(buffer).encode("utf-8")
+            buffer.clear()
+            buffered = 0
+    if buffer:
+        yield "".join(buffer).encode("utf-8")
+
+
+class _ChunkSink:
+    """
+    Write-only, non-seekable file object collecting what ZipFile writes until
+    it is drained. ZipFile falls back to data descriptors for such targets,
+    so entries never have to be rewound.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+        self.pending = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        self.pending += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        self.pending = 0
+        return data
+
+
+CSV_EXPORT_FIELDS = {
+    "counter": ("Date", "Count"),
+    "browser": ("Browser", "Count"),
+    "country": ("Country", "Count"),
+    "os_name": ("OS_Name", "Count"),
+    "referrer": ("Referrer", "Count"),
+    "unique_counter": ("Date", "Count"),
+    "unique_browser": ("Browser", "Count"),
+    "unique_country": ("Country", "Count"),
+    "unique_os_name": ("OS_Name", "Count"),
+    "unique_referrer": ("Referrer", "Count"),
+    "bots": ("Bot", "Count"),
+}
+
+
+def _csv_files(data):
+    """
+    `(filename, rows)` of every CSV file in the export bundle.
+    """
+    general_info = {
+        "TOTAL CLICKS": data.get("total-clicks", "N/A"),
+        "TOTAL UNIQUE CLICKS": data.get("total_unique_clicks", "N/A"),
+        "URL": data.get("url", "N/A"),
+        "SHORT CODE": data.get("_id", "N/A"),
+        "MAX CLICKS": data.get("max-clicks", "N/A"),
+        "EXPIRATION TIME": data.get("expiration-time", "N/A"),
+        "PASSWORD": data.get("password", "N/A"),
+        "CREATION DATE": data.get("creation-date", "N/A"),
+        "CREATION TIME": data.get("creation-time", "N/A"),
+        "EXPIRED": data.get("expired", "N/A"),
+        "BLOCK BOTS": data.get("block-bots", "N/A"),
+        "AVERAGE DAILY CLICKS": data.get("average_daily_clicks", "N/A"),
+        "AVERAGE MONTHLY CLICKS": data.get("average_monthly_clicks", "N/A"),
+        "AVERAGE WEEKLY CLICKS": data.get("average_weekly_clicks", "N/A"),
+        "AVERAGE REDIRECTION TIME (in s)": data.get("average_redirection_time", "N/A"),
+        "LAST CLICK": data.get("last-click", "N/A"),
+        "LAST CLICK BROWSER": data.get("last-click-browser", "N/A"),
+        "LAST CLICK COUNTRY": data.get("last-click-country", "N/A"),
+        "LAST CLICK OS": data.get("last-click-os", "N/A"),
+    }
+    yield "general_info.csv", general_info.items()
+
+    for field_name, header in CSV_EXPORT_FIELDS.items():
+        yield f"{field_name}.csv", _csv_rows(header, data.get(field_name, {}))
+
+
+def _csv_rows(header, dictionary):
+    yield header
+    for key, value in dictionary.items():
+        if isinstance(value, dict):
+            # Handle nested dictionaries
+            value = value.get("counts", 0)
+        yield key, value
+
+
+def _zip_entry(zipf, name, compress_type):
+    info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+    info.compress_type = compress_type
+    info.external_attr = 0o600 << 16
+    return zipf.open(info, "w")
+
+
+def _iter_csv_entries(zipf, sink, data, prefix=""):
+    for filename, rows in _csv_files(data):
+        with _zip_entry(zipf, f"{prefix}{filename}", zipfile.ZIP_DEFLATED) as file:
             with io.TextIOWrapper(file, encoding="utf-8", newline="") as text_file:
                 writer = csv.writer(text_file)
-                for key, value in general_info.items():
-                    writer.writerow([key, value])
-
-        # Write other CSV files dynamically
-        fields = {
-            "counter": ("Date", "Count"),
-            "browser": ("Browser", "Count"),
-            "country": ("Country", "Count"),
-            "os_name": ("OS_Name", "Count"),
-            "referrer": ("Referrer", "Count"),
-            "unique_counter": ("Date", "Count"),
-            "unique_browser": ("Browser", "Count"),
-            "unique_country": ("Country", "Count"),
-            "unique_os_name": ("OS_Name", "Count"),
-            "unique_referrer": ("Referrer", "Count"),
-            "bots": ("Bot", "Count"),
-        }
-
-        for field_name, (key_field, value_field) in fields.items():
-            write_dict_to_csv(
-                zipf,
-                f"{field_name}.csv",
-                data.get(field_name, {}),
-                key_field,
-                value_field,
-            )
+                for row in rows:
+                    writer.writerow(row)
+                    if sink.pending >= EXPORT_CHUNK_SIZE:
+                        yield sink.drain()
+        yield sink.drain()
 
-    output.seek(0)
 
-    return send_file(
-        output,
-        mimetype="application/zip",
-        as_attachment=True,
-        download_name="my-ket-horse-export-csv.zip",
+def iter_csv_zip(data, prefix=""):
+    """
+    The CSV bundle as a zip archive, produced chunk by chunk. `prefix` is
+    prepended to every file name inside the archive.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, mode="w") as zipf:
+        yield from _iter_csv_entries(zipf, sink, data, prefix)
+    yield sink.drain()
+
+
+def export_to_csv(data):
+    return _stream_file(
+        iter_csv_zip(data), "application/zip", "my-ket-horse-export-csv.zip"
     )
 
 
+def iter_json(data):
+    return _buffered(json.JSONEncoder(indent=4).iterencode(data))
+
+
 def export_to_json(data):
-    output = io.StringIO()
+    return _stream_file(iter_json(data), "application/json", "my-ket-horse-export.json")
 
-    json.dump(data, output, indent=4)
-    output.seek(0)
 
-    output_bytes = io.BytesIO(output.getvalue().encode())
+# XML names without a namespace prefix (NCName), for telling which keys can
+# be used as element names as they are
+_XML_NAME_START = (
+    "A-Z_a-z\xc0-\xd6\xd8-\xf6\xf8-\u02ff\u0370-\u037d\u037f-\u1fff"
+    "\u200c-\u200d\u2070-\u218f\u2c00-\u2fef\u3001-\ud7ff\uf900-\ufdcf"
+    "\ufdf0-\ufffd\U00010000-\U000effff"
+)
+_XML_NAME = re.compile(
+    f"[{_XML_NAME_START}][{_XML_NAME_START}\\-.0-9\xb7\u0300-\u036f\u203f-\u2040]*"
+)
 
-    return send_file(
-        output_bytes,
-        mimetype="application/json",
-        as_attachment=True,
-        download_name="my-ket-horse-export.json",
+
+def _escape_xml(value):
+    return (
+        value.replace("&", "&amp;")
+        .replace('"', "&quot;")
+        .replace("'", "&apos;")
+        .replace("<", "&lt;")
+        .replace(">", "&gt;")
+    )
+
+
+@functools.lru_cache(maxsize=4096)
+def _xml_tag(key):
+    """
+    Element name and extra attributes for a dictionary key, following the
+    rules of the dicttoxml layout the export has always had: numeric keys
+    get an "n" prefix, spaces become underscores, and anything else is kept
+    in a `name` attribute.
+    """
+    key = _escape_xml(str(key))
+    if _XML_NAME.fullmatch(key):
+        return key, ""
+    if key.isdigit():
+        return f"n{key}", ""
+    try:
+        return f"n{float(key)}", ""
+    except ValueError:
+        pass
+    if _XML_NAME.fullmatch(key.replace(" ", "_")):
+        return key.replace(" ", "_"), ""
+    return "key", f' name="{key}"'
+
+
+def _xml_type(value):
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, str):
+        return "str"
+    if isinstance(value, int):
+        return "int"
+    if isinstance(value, float):
+        return "float"
+    if isinstance(value, numbers.Number):
+        return "number"
+    if isinstance(value, dict):
+        return "dict"
+    if isinstance(value, (list, tuple)):
+        return "list"
+    return type(value).__name__
+
+
+def _iter_xml_element(tag, attrs, value):
+    if isinstance(value, dict):
+        yield f'<{tag}{attrs} type="dict">'
+        yield from _iter_xml_dict(value)
+        yield f"</{tag}>"
+    elif isinstance(value, (list, tuple)):
+        yield f'<{tag}{attrs} type="list">'
+        for item in value:
+            yield from _iter_xml_element("item", "", item)
+        yield f"</{tag}>"
+    elif value is None:
+        yield f'<{tag}{attrs} type="null"></{tag}>'
+    elif isinstance(value, bool):
+        yield f'<{tag}{attrs} type="bool">{str(value).lower()}</{tag}>'
+    else:
+        if hasattr(value, "isoformat"):
+            value = value.isoformat()
+        text = _escape_xml(value) if isinstance(value, str) else str(value)
+        yield f'<{tag}{attrs} type="{_xml_type(value)}">{text}</{tag}>'
+
+
+def _iter_xml_dict(data):
+    for key, value in data.items():
+        yield from _iter_xml_element(*_xml_tag(key), value)
+
+
+def iter_xml(data):
+    """
+    `data` as XML in the layout dicttoxml produces (a `<root>` element with
+    typed children), written incrementally.
+    """
+    return _buffered(
+        itertools.chain(
+            ['<?xml version="1.0" encoding="UTF-8" ?><root>'],
+            _iter_xml_dict(data),
+            ["</root>"],
+        )
     )
 
 
 def export_to_xml(data):
-    # Convert dictionary to XML
-    xml = dicttoxml(data)
+    return _stream_file(iter_xml(data), "application/xml", "data.xml")
 
-    # Create BytesIO object and write XML data to it
-    output = io.BytesIO()
-    output.write(xml)
-    output.seek(0)
 
-    # Send file
-    return send_file(
-        output, mimetype="application/xml", as_attachment=True, download_name="data.xml"
+# Dimension maps exported as one long table by the columnar formats
+COLUMNAR_DIMENSIONS = ["browser", "country", "os_name", "referrer", "bots"]
+GENERAL_INFO_FIELDS = [
+    "_id",
+    "url",
+    "total-clicks",
+    "total_unique_clicks",
+    "max-clicks",
+    "expiration-time",
+    "password",
+    "creation-date",
+    "creation-time",
+    "expired",
+    "block-bots",
+    "average_daily_clicks",
+    "average_weekly_clicks",
+    "average_monthly_clicks",
+    "average_redirection_time",
+    "last-click",
+    "last-click-browser",
+    "last-click-os",
+    "last-click-country",
+]
+
+
+def _counts(mapping, keys):
+    return np.fromiter(
+        (mapping.get(key, 0) for key in keys), dtype=np.int64, count=len(keys)
+    )
+
+
+def _columnar_tables(data):
+    """
+    `(name, table)` of every Arrow table in a columnar export: one row of
+    link details, the daily click series, and all dimension counts.
+    """
+    general_info = pa.table({field: [data.get(field)] for field in GENERAL_INFO_FIELDS})
+    yield "general_info", general_info
+
+    counter = data.get("counter") or {}
+    unique_counter = data.get("unique_counter") or {}
+    dates = sorted(counter.keys() | unique_counter.keys())
+    yield (
+        "counter",
+        pa.table(
+            {
+                "date": pa.array(np.array(dates, dtype="datetime64[D]")),
+                "clicks": _counts(counter, dates),
+                "unique_clicks": _counts(unique_counter, dates),
+            }
+        ),
+    )
+
+    dimensions, keys, clicks, unique_clicks = [], [], [], []
+    for index, dimension in enumerate(COLUMNAR_DIMENSIONS):
+        counts = data.get(dimension) or {}
+        dimension_keys = list(counts)
+        dimensions.append(np.full(len(dimension_keys), index, dtype=np.int8))
+        keys.extend(dimension_keys)
+        clicks.append(_counts(counts, dimension_keys))
+        if f"unique_{dimension}" in data:
+            unique_clicks.append(_counts(data[f"unique_{dimension}"], dimension_keys))
+        else:
+            # bots have no unique counts
+            unique_clicks.append(np.full(len(dimension_keys), -1, dtype=np.int64))
+
+    unique_clicks = np.concatenate(unique_clicks)
+    yield (
+        "dimensions",
+        pa.table(
+            {
+                "dimension": pa.DictionaryArray.from_arrays(
+                    np.concatenate(dimensions), COLUMNAR_DIMENSIONS
+                ),
+                "key": pa.array(keys, type=pa.string()),
+                "clicks": np.concatenate(clicks),
+                "unique_clicks": pa.array(unique_clicks, mask=unique_clicks < 0),
+            }
+        ),
+    )
+
+
+def _iter_columnar_entries(zipf, sink, data, format, prefix=""):
+    # Stored as is: both formats compress their own column data
+    for name, table in _columnar_tables(data):
+        with _zip_entry(zipf, f"{prefix}{name}.{format}", zipfile.ZIP_STORED) as file:
+            if format == "parquet":
+                pq.write_table(table, file, compression="zstd")
+            else:
+                with pa.ipc.new_file(file, table.schema) as writer:
+                    writer.write_table(table)
+        yield sink.drain()
+
+
+def iter_columnar_zip(data, format, prefix=""):
+    """
+    The link's tables as Parquet files or Arrow IPC files in a zip archive,
+    produced chunk by chunk.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, mode="w") as zipf:
+        yield from _iter_columnar_entries(zipf, sink, data, format, prefix)
+    yield sink.drain()
+
+
+# Mimetype and download name of every export format
+EXPORT_FORMATS = {
+    "csv": ("application/zip", "my-ket-horse-export-csv.zip"),
+    "json": ("application/json", "my-ket-horse-export.json"),
+    "xlsx": (
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        "my-ket-horse-export.xlsx",
+    ),
+    "xml": ("application/xml", "data.xml"),
+}
+if pa is not None:
+    EXPORT_FORMATS["parquet"] = ("application/zip", "my-ket-horse-export-parquet.zip")
+    EXPORT_FORMATS["arrow"] = ("application/zip", "my-ket-horse-export-arrow.zip")
+
+
+def _export_chunks(data, format):
+    if format in ("parquet", "arrow"):
+        return iter_columnar_zip(data, format)
+    return {"csv": iter_csv_zip, "json": iter_json, "xml": iter_xml}[format](data)
+
+
+def write_export(data, format, output):
+    """
+    Write the `format` export of `data` to the binary file object `output`.
+    """
+    if format == "xlsx":
+        write_excel(data, output)
+        return
+    for chunk in _export_chunks(data, format):
+        output.write(chunk)
+
+
+def export_response(data, format):
+    """
+    The `format` export of `data` as a download built while it is sent.
+    """
+    if format == "xlsx":
+        return export_to_excel(data)
+    return _stream_file(_export_chunks(data, format), *EXPORT_FORMATS[format])
+
+
+def _iter_link_entries(zipf, sink, data, format, prefix):
+    """
+    The `format` export of one link written into `zipf` under `prefix`.
+    Bundles (csv, parquet, arrow) keep their files; single-file formats are
+    one `export.<format>` entry.
+    """
+    if format == "csv":
+        yield from _iter_csv_entries(zipf, sink, data, prefix)
+    elif format in ("parquet", "arrow"):
+        yield from _iter_columnar_entries(zipf, sink, data, format, prefix)
+    elif format == "xlsx":
+        with _zip_entry(zipf, f"{prefix}export.xlsx", zipfile.ZIP_STORED) as file:
+            write_excel(data, file)
+        yield sink.drain()
+    else:
+        name = f"{prefix}export.{format}"
+        with _zip_entry(zipf, name, zipfile.ZIP_DEFLATED) as file:
+            for chunk in _export_chunks(data, format):
+                file.write(chunk)
+                if sink.pending >= EXPORT_CHUNK_SIZE:
+                    yield sink.drain()
+        yield sink.drain()
+
+
+def _iter_copied_entry(source, file, sink):
+    for chunk in iter(functools.partial(source.read, EXPORT_CHUNK_SIZE), b""):
+        file.write(chunk)
+        if sink.pending >= EXPORT_CHUNK_SIZE:
+            yield sink.drain()
+    yield sink.drain()
+
+
+def _iter_artifact_entries(zipf, sink, path, format, prefix):
+    """
+    A link's `format` export already written to `path` by `write_export`,
+    copied into `zipf` as the same entries `_iter_link_entries` writes.
+    """
+    if format in ("csv", "parquet", "arrow"):
+        with zipfile.ZipFile(path) as bundle:
+            for info in bundle.infolist():
+                name = f"{prefix}{info.filename}"
+                with bundle.open(info) as source:
+                    with _zip_entry(zipf, name, info.compress_type) as file:
+                        yield from _iter_copied_entry(source, file, sink)
+        return
+    name = f"{prefix}export.{format}"
+    compress_type = zipfile.ZIP_STORED if format == "xlsx" else zipfile.ZIP_DEFLATED
+    with open(path, "rb") as source:
+        with _zip_entry(zipf, name, compress_type) as file:
+            yield from _iter_copied_entry(source, file, sink)
+
+
+def iter_bulk_zip(links, format):
+    """
+    One zip archive with a folder per link, produced chunk by chunk from
+    `links`, an iterable of `(short_code, data, error)` where `data` is the
+    link's stats or the path of its already built export. Links that could
+    not be exported are listed with their error in `errors.json`.
+    """
+    sink = _ChunkSink()
+    errors = {}
+    with zipfile.ZipFile(sink, mode="w") as zipf:
+        for short_code, data, error in links:
+            if error is not None:
+                errors[short_code] = error
+                continue
+            prefix = f"{short_code}/"
+            if isinstance(data, str):
+                yield from _iter_artifact_entries(zipf, sink, data, format, prefix)
+            else:
+                yield from _iter_link_entries(zipf, sink, data, format, prefix)
+        if errors:
+            zipf.writestr("errors.json", json.dumps(errors, indent=4))
+    yield sink.drain()
+
+
+def bulk_export_response(links, format):
+    """
+    Archive of the `format` exports of many links, built while it is sent.
+    """
+    return _stream_file(
+        iter_bulk_zip(links, format),
+        "application/zip",
+        f"my-ket-horse-bulk-export-{format}.zip",
     )
@@ -1,57 +1,231 @@
-from pymongo import MongoClient
+from contextlib import contextmanager
+from pymongo import MongoClient, UpdateOne
 from dotenv import load_dotenv
 import os
 import re
+import threading
 
 load_dotenv(override=True)
 
 MONGO_URI = os.environ["MONGODB_URI"]
+MONGO_DB_NAME = os.environ.get("MONGO_DB_NAME", "url-shortener")
 
-client = MongoClient(MONGO_URI)
+# Explicit timeouts so an unreachable primary fails fast instead of hanging a
+# worker for pymongo's 30s default.
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(
+    os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", 2000)
+)
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", 2000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get("MONGO_SOCKET_TIMEOUT_MS", 10000))
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", 50))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", 0))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get("MONGO_MAX_IDLE_TIME_MS", 60000))
+MONGO_STATS_MAX_TIME_MS = int(os.environ.get("MONGO_STATS_MAX_TIME_MS", 5000))
 
-try:
-    client.admin.command("ping")
-    print("Pinged your deployment. You successfully connected to MongoDB!")
-except Exception as e:
-    print(e)
 
-db = client["url-shortener"]
+class BulkheadFullError(Exception):
+    pass
 
-urls_collection = db["urls"]
-blocked_urls_collection = db["blocked-urls"]
-emoji_urls_collection = db["emojis"]
-ip_bypasses = db["ip-exceptions"]
 
+class Bulkhead:
+    """
+    Caps the number of concurrent MongoDB operations of one workload class so
+    a slow class (e.g. stats aggregations) cannot hold every pooled connection.
+    """
 
-def load_url(id, projection=None):
+    def __init__(self, name: str, max_concurrent: int, timeout: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.rejected = 0
+
+    @contextmanager
+    def slot(self):
+        if not self._semaphore.acquire(timeout=self.timeout):
+            with self._lock:
+                self.rejected += 1
+            raise BulkheadFullError(f"[MongoDB] {self.name} bulkhead is full")
+        with self._lock:
+            self.in_use += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_use -= 1
+            self._semaphore.release()
+
+    def stats(self):
+        return {
+            "max_concurrent": self.max_concurrent,
+            "in_use": self.in_use,
+            "rejected": self.rejected,
+        }
+
+
+# Per-workload limits; together they stay below MONGO_MAX_POOL_SIZE so redirect
+# reads always have connections available.
+bulkheads = {
+    "redirect": Bulkhead(
+        "redirect", int(os.environ.get("MONGO_BULKHEAD_REDIRECT", 24)), 1.0
+    ),
+    "click": Bulkhead("click", int(os.environ.get("MONGO_BULKHEAD_CLICK", 16)), 2.0),
+    "stats": Bulkhead("stats", int(os.environ.get("MONGO_BULKHEAD_STATS", 6)), 5.0),
+}
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> MongoClient:
+    """
+    Return the MongoClient for the current process, creating it on first use.
+    Clients are never shared across a fork: a worker that inherited the
+    master's client builds its own.
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                _client = MongoClient(
+                    MONGO_URI,
+                    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                    socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+                    maxPoolSize=MONGO_MAX_POOL_SIZE,
+                    minPoolSize=MONGO_MIN_POOL_SIZE,
+                    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+                )
+                _client_pid = os.getpid()
+    return _client
+
+
+def close_client():
+    global _client
+    if _client is not None and _client_pid == os.getpid():
+        _client.close()
+    _client = None
+
+
+def get_db():
+    return get_client()[MONGO_DB_NAME]
+
+
+class LazyCollection:
+    """
+    Module-level stand-in for a collection that resolves against the current
+    process's client on each access.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(get_db()[self.name], attr)
+
+
+urls_collection = LazyCollection("urls")
+blocked_urls_collection = LazyCollection("blocked-urls")
+emoji_urls_collection = LazyCollection("emojis")
+ip_bypasses = LazyCollection("ip-exceptions")
+stats_cubes_collection = LazyCollection("stats-cubes")
+counters_collection = LazyCollection("counters")
+
+# Document of `counters` holding site-wide totals, as
+# `{scope: {"links": n, "clicks": n}}` for urls, emojis and tsdice links, and
+# the POSIX time they were last recounted as `synced`
+GLOBAL_COUNTERS_ID = "global"
+
+
+def get_bulkhead_stats():
+    return {name: bulkhead.stats() for name, bulkhead in bulkheads.items()}
+
+
+def load_url(id, projection=None, workload="redirect"):
+    """
+    A link document, or None when it doesn't exist or couldn't be read.
+    Raises BulkheadFullError when the lookup was turned away, so a busy
+    database is not mistaken for a missing link. Stats reads pass
+    `workload="stats"` so they don't compete with redirects.
+    """
     try:
-        url_data = urls_collection.find_one({"_id": id}, projection)
+        with bulkheads[workload].slot():
+            url_data = urls_collection.find_one({"_id": id}, projection)
+    except BulkheadFullError:
+        raise
     except Exception:
         url_data = None
     return url_data
 
 
 def aggregate_url(pipeline):
+    """
+    First document produced by `pipeline`, or None when there is none or the
+    query failed. Raises BulkheadFullError like load_url.
+    """
     try:
-        url_data = urls_collection.aggregate(pipeline)
-        url_data = list(url_data)[0]
+        with bulkheads["stats"].slot():
+            url_data = urls_collection.aggregate(
+                pipeline, maxTimeMS=MONGO_STATS_MAX_TIME_MS
+            )
+            url_data = list(url_data)[0]
+    except BulkheadFullError:
+        raise
     except Exception:
         url_data = None
     return url_data
 
 
+def aggregate_urls(pipeline, max_time_ms=MONGO_STATS_MAX_TIME_MS):
+    """
+    All documents produced by `pipeline`, or None when the query failed.
+    Raises BulkheadFullError like load_url.
+    """
+    try:
+        with bulkheads["stats"].slot():
+            return list(urls_collection.aggregate(pipeline, maxTimeMS=max_time_ms))
+    except BulkheadFullError:
+        raise
+    except Exception:
+        return None
+
+
 def insert_url(id, url_data):
     try:
         urls_collection.insert_one({"_id": id, **url_data})
     except Exception:
-        pass
+        return
+    update_counters(GLOBAL_COUNTERS_ID, {"urls.links": 1})
+
+
+def _count_global_clicks(updates, scopes):
+    clicks = updates.get("$inc", {}).get("total-clicks")
+    if clicks:
+        update_counters(
+            GLOBAL_COUNTERS_ID, {f"{scope}.clicks": clicks for scope in scopes}
+        )
 
 
-def update_url(id, updates):
+def update_url(id, updates, operations=None):
+    """
+    Apply `updates` to a link. Extra `operations` (e.g. conditional stats
+    updates) are sent ahead of it in the same ordered bulk write. Clicks
+    added to `total-clicks` are added to the global counters too.
+    """
     try:
-        urls_collection.update_one({"_id": id}, updates)
+        with bulkheads["click"].slot():
+            if operations:
+                urls_collection.bulk_write(
+                    [*operations, UpdateOne({"_id": id}, updates)], ordered=True
+                )
+            else:
+                urls_collection.update_one({"_id": id}, updates)
     except Exception:
-        pass
+        return
+    _count_global_clicks(updates, ["urls"])
 
 
 def check_if_slug_exists(slug):
@@ -63,9 +237,15 @@ def check_if_slug_exists(slug):
     return url_data is not None
 
 
-def load_emoji_url(alias, projection=None):
+def load_emoji_url(alias, projection=None, workload="redirect"):
+    """
+    Like load_url, for emoji links.
+    """
     try:
-        emoji_data = emoji_urls_collection.find_one({"_id": alias}, projection)
+        with bulkheads[workload].slot():
+            emoji_data = emoji_urls_collection.find_one({"_id": alias}, projection)
+    except BulkheadFullError:
+        raise
     except Exception:
         emoji_data = None
     return emoji_data
@@ -73,25 +253,133 @@ def load_emoji_url(alias, projection=None):
 
 def aggregate_emoji_url(pipeline):
     try:
-        emoji_data = emoji_urls_collection.aggregate(pipeline)
-        emoji_data = list(emoji_data)[0]
+        with bulkheads["stats"].slot():
+            emoji_data = emoji_urls_collection.aggregate(
+                pipeline, maxTimeMS=MONGO_STATS_MAX_TIME_MS
+            )
+            emoji_data = list(emoji_data)[0]
+    except BulkheadFullError:
+        raise
     except Exception:
         emoji_data = None
     return emoji_data
 
 
+def aggregate_emoji_urls(pipeline, max_time_ms=MONGO_STATS_MAX_TIME_MS):
+    try:
+        with bulkheads["stats"].slot():
+            return list(
+                emoji_urls_collection.aggregate(pipeline, maxTimeMS=max_time_ms)
+            )
+    except BulkheadFullError:
+        raise
+    except Exception:
+        return None
+
+
 def insert_emoji_url(alias, emoji_data):
     try:
         emoji_urls_collection.insert_one({"_id": alias, **emoji_data})
     except Exception:
-        pass
+        return
+    increments = {"emojis.links": 1}
+    if emoji_data.get("tsdice-config"):
+        increments["tsdice.links"] = 1
+    update_counters(GLOBAL_COUNTERS_ID, increments)
+
+
+def update_emoji_url(alias, updates, operations=None, tsdice=False):
+    """
+    Like update_url, for emoji links; `tsdice` links count towards the
+    tsdice totals as well.
+    """
+    try:
+        with bulkheads["click"].slot():
+            if operations:
+                emoji_urls_collection.bulk_write(
+                    [*operations, UpdateOne({"_id": alias}, updates)], ordered=True
+                )
+            else:
+                emoji_urls_collection.update_one({"_id": alias}, updates)
+    except Exception:
+        return
+    _count_global_clicks(updates, ["emojis", "tsdice"] if tsdice else ["emojis"])
 
 
-def update_emoji_url(alias, updates):
+def load_cubes(ids=None, id_range=None, projection=None):
+    """
+    Stats cube documents by `_id` list or inclusive `(first, last)` range, or
+    None when the query failed.
+    """
+    if ids is not None:
+        query = {"_id": {"$in": ids}}
+    else:
+        query = {"_id": {"$gte": id_range[0], "$lte": id_range[1]}}
     try:
-        emoji_urls_collection.update_one({"_id": alias}, updates)
+        with bulkheads["stats"].slot():
+            return list(stats_cubes_collection.find(query, projection))
     except Exception:
-        pass
+        return None
+
+
+def update_cubes(operations):
+    """
+    Apply cube updates in one unordered bulk write. Returns False only when
+    nothing was written, so trying again can't count a click twice.
+    """
+    try:
+        with bulkheads["click"].slot():
+            stats_cubes_collection.bulk_write(operations, ordered=False)
+    except BulkheadFullError as e:
+        print(e)
+        return False
+    except Exception as e:
+        print(f"[MongoDB] Error updating stats cubes: {e}")
+    return True
+
+
+def load_counters(id):
+    try:
+        with bulkheads["stats"].slot():
+            return counters_collection.find_one({"_id": id})
+    except Exception:
+        return None
+
+
+def claim_counters_sync(id, synced, now):
+    """
+    Move the `synced` time of a counters document from `synced` (None for a
+    document that doesn't exist yet) to `now`. Only one of several workers
+    trying at once succeeds; returns whether this one did.
+    """
+    try:
+        counters_collection.update_one(
+            {"_id": id, "synced": synced}, {"$set": {"synced": now}}, upsert=True
+        )
+    except Exception:
+        # A duplicate key: the document exists with another `synced` time
+        return False
+    return True
+
+
+def set_counters(id, values):
+    try:
+        counters_collection.update_one({"_id": id}, {"$set": values})
+    except Exception as e:
+        print(f"[MongoDB] Error setting counters {id}: {e}")
+
+
+def update_counters(id, increments):
+    """
+    Atomically `$inc` the fields of an existing counters document. Nothing
+    is created: until a document is seeded from the collections, there is
+    nothing to add to.
+    """
+    try:
+        with bulkheads["click"].slot():
+            counters_collection.update_one({"_id": id}, {"$inc": increments})
+    except Exception as e:
+        print(f"[MongoDB] Error updating counters {id}: {e}")
 
 
 def check_if_emoji_alias_exists(emoji_alias):
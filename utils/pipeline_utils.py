@@ -1,5 +1,436 @@
-def _create_field_transform(field_name):
+from datetime import date, timedelta
+
+from pymongo import UpdateOne
+
+# Dimensions tracked with per-value counts and unique visitors
+STATS_DIMENSIONS = ["browser", "os_name", "country", "referrer"]
+
+# Bumped whenever the layout of the materialized `stats` subdocument changes;
+# documents with an older (or missing) schema are rebuilt on first read.
+STATS_SCHEMA_VERSION = 1
+
+# Clicks kept in each link's `recent_clicks` ring for incremental stats polls
+RECENT_CLICKS_LIMIT = 200
+
+# Days of per-hour click counts kept in each link's `hourly_counter`
+HOURLY_COUNTER_DAYS = 31
+
+# Everything the stats views need from a link document that maintains the
+# materialized `stats` subdocument. The raw per-dimension IP arrays are never
+# read.
+STATS_PROJECTION = {
+    "url": 1,
+    "total-clicks": 1,
+    "max-clicks": 1,
+    "expiration-time": 1,
+    "password": 1,
+    "short_code": 1,
+    "last-click": 1,
+    "last-click-browser": 1,
+    "last-click-os": 1,
+    "last-click-country": 1,
+    "block-bots": 1,
+    "bots": 1,
+    "counter": 1,
+    "unique_counter": 1,
+    "average_redirection_time": 1,
+    "creation-date": 1,
+    "creation-time": 1,
+    "stats": 1,
+}
+
+# Top-level fields of the stats payload that clients can select with `fields=`
+STATS_FIELDS = [
+    "url",
+    "short_code",
+    "total-clicks",
+    "total_unique_clicks",
+    "max-clicks",
+    "expiration-time",
+    "expired",
+    "password",
+    "block-bots",
+    "creation-date",
+    "creation-time",
+    "last-click",
+    "last-click-browser",
+    "last-click-os",
+    "last-click-country",
+    "average_redirection_time",
+    "average_daily_clicks",
+    "average_weekly_clicks",
+    "average_monthly_clicks",
+    "counter",
+    "unique_counter",
+    "bots",
+    "country_code",
+    *STATS_DIMENSIONS,
+    *[f"unique_{field}" for field in STATS_DIMENSIONS],
+]
+
+# Payload fields computed after the read, and the fields they are derived from
+STATS_DERIVED_FIELDS = {
+    "expired": ["max-clicks", "expiration-time", "total-clicks"],
+    "average_daily_clicks": ["total-clicks", "creation-date"],
+    "average_weekly_clicks": ["total-clicks", "creation-date"],
+    "average_monthly_clicks": ["total-clicks", "creation-date"],
+    # gap filling starts at the creation date
+    "counter": ["counter", "creation-date"],
+    "unique_counter": ["unique_counter", "creation-date"],
+}
+
+# Where payload fields live in a document carrying the materialized view
+STATS_MATERIALIZED_PATHS = {
+    "total_unique_clicks": "stats.total_unique_clicks",
+    "country_code": "stats.country_code",
+    **{field: f"stats.{field}" for field in STATS_DIMENSIONS},
+    **{f"unique_{field}": f"stats.unique_{field}" for field in STATS_DIMENSIONS},
+}
+
+
+def get_stats_source_fields(fields):
+    """
+    Stored fields that have to be read to serve the payload `fields`.
+    """
+    source_fields = set()
+    for field in fields:
+        source_fields.update(STATS_DERIVED_FIELDS.get(field, [field]))
+    return source_fields
+
+
+def get_stats_projection(fields=None):
+    """
+    Projection for reading the materialized view, narrowed to `fields`.
+    """
+    if fields is None:
+        return STATS_PROJECTION
+    projection = {"stats.schema": 1}
+    for field in get_stats_source_fields(fields):
+        # counters are stored too; only purely computed fields are skipped
+        if field in STATS_DERIVED_FIELDS.get(field, [field]):
+            projection[STATS_MATERIALIZED_PATHS.get(field, field)] = 1
+    return projection
+
+
+# Just enough to authorize a stats request and tell whether anything changed
+# since the last time it was served.
+STATS_VERSION_PROJECTION = {
+    "password": 1,
+    "total-clicks": 1,
+    "last-click": 1,
+    "expiration-time": 1,
+    "stats.schema": 1,
+}
+
+
+def get_delta_projection(recent_clicks):
+    """
+    Projection reading only the current values of the counters touched by
+    `recent_clicks`.
+    """
+    projection = {
+        "total-clicks": 1,
+        "last-click": 1,
+        "stats.total_unique_clicks": 1,
+    }
+    for click in recent_clicks:
+        projection[f"counter.{click['date']}"] = 1
+        projection[f"unique_counter.{click['date']}"] = 1
+        for field, value in click["dims"].items():
+            projection[f"stats.{field}.{value}"] = 1
+            projection[f"stats.unique_{field}.{value}"] = 1
+        if click.get("bot"):
+            projection[f"bots.{click['bot']}"] = 1
+    return projection
+
+
+def empty_stats():
+    return {"schema": STATS_SCHEMA_VERSION, "total_unique_clicks": 0}
+
+
+def get_hourly_trim_operation(short_code, today):
+    """
+    Conditional update that, ahead of the first click of `today`, drops the
+    hourly counts of days that have left the HOURLY_COUNTER_DAYS window, so
+    `hourly_counter` stays at most 24 keys per kept day.
+    """
+    oldest = date.fromisoformat(today) - timedelta(days=HOURLY_COUNTER_DAYS - 1)
+    return UpdateOne(
+        {"_id": short_code, f"hourly_counter.{today}": {"$exists": False}},
+        [
+            {
+                "$set": {
+                    "hourly_counter": _date_window_filter(
+                        "$hourly_counter", oldest.isoformat()
+                    )
+                }
+            }
+        ],
+    )
+
+
+def get_unique_stats_operations(short_code, ip, dimensions, today=None):
+    """
+    Conditional updates that bump the materialized unique counts for every
+    dimension value this IP has not been seen with yet. They match against the
+    raw IP arrays, so they must run before the click's own `$addToSet`.
+    When `today` is given the link-wide unique counters are checked as well.
+    """
+    operations = []
+    if today is not None:
+        operations.append(
+            UpdateOne(
+                {"_id": short_code, "ips": {"$ne": ip}},
+                {
+                    "$inc": {
+                        f"unique_counter.{today}": 1,
+                        "stats.total_unique_clicks": 1,
+                    }
+                },
+            )
+        )
+    for field, value in dimensions.items():
+        operations.append(
+            UpdateOne(
+                {"_id": short_code, f"{field}.{value}.ips": {"$ne": ip}},
+                {"$inc": {f"stats.unique_{field}.{value}": 1}},
+            )
+        )
+    return operations
+
+
+# Maps the stats page renders as a top-N chart with an "others" bucket, and
+# where each one lives in a link document carrying the materialized view.
+TOP_N_FIELDS = {
+    "browser": "$stats.browser",
+    "os_name": "$stats.os_name",
+    "referrer": "$stats.referrer",
+    "unique_browser": "$stats.unique_browser",
+    "unique_os_name": "$stats.unique_os_name",
+    "unique_referrer": "$stats.unique_referrer",
+    "bots": "$bots",
+}
+
+
+def _sorted_items(source):
+    """
+    `{k, v}` entries of a count map, largest count first (ties by key).
+    """
+    return {
+        "$sortArray": {
+            "input": {"$objectToArray": {"$ifNull": [source, {}]}},
+            "sortBy": {"v": -1, "k": 1},
+        }
+    }
+
+
+def _create_top_n_transform(field_name, n, source=None):
+    """
+    `sorted_<field>`: the `n` largest entries of a count map plus an "others"
+    total for the rest. Maps with at most n + 1 entries are returned as is.
+    """
+    items = _sorted_items(source or f"${field_name}")
     return {
+        f"sorted_{field_name}": {
+            "$let": {
+                "vars": {"items": items},
+                "in": {
+                    "$cond": [
+                        {"$lte": [{"$size": "$$items"}, n + 1]},
+                        {"$arrayToObject": "$$items"},
+                        {
+                            "$mergeObjects": [
+                                {"$arrayToObject": {"$slice": ["$$items", n]}},
+                                {
+                                    "others": {
+                                        "$sum": {
+                                            "$slice": [
+                                                "$$items.v",
+                                                n,
+                                                {"$size": "$$items"},
+                                            ]
+                                        }
+                                    }
+                                },
+                            ]
+                        },
+                    ]
+                },
+            }
+        }
+    }
+
+
+def get_top_n_stage(n, materialized=False, fields=None):
+    add_fields = {}
+    for field, source in TOP_N_FIELDS.items():
+        if fields is not None and field not in fields:
+            continue
+        add_fields |= _create_top_n_transform(
+            field, n, source if materialized else None
+        )
+    return {"$addFields": add_fields}
+
+
+# Dimensions that can be paged through, and where each one lives in a link
+# document carrying the materialized view.
+PAGED_DIMENSIONS = {
+    "referrer": "$stats.referrer",
+    "bots": "$bots",
+    "country": "$stats.country",
+    "browser": "$stats.browser",
+    "os_name": "$stats.os_name",
+}
+
+
+def get_dimension_page_pipeline(short_code, dimension, limit, after=None):
+    """
+    One page of a dimension's entries sorted by count (then key), starting
+    after the `(count, key)` entry that ended the previous page. Returns
+    `limit + 1` items so the caller can tell whether another page follows.
+    """
+    source = {"$ifNull": [PAGED_DIMENSIONS[dimension], {}]}
+    items = _sorted_items(source)
+    if after is not None:
+        count, key = after
+        items = {
+            "$filter": {
+                "input": items,
+                "cond": {
+                    "$or": [
+                        {"$lt": ["$$this.v", count]},
+                        {
+                            "$and": [
+                                {"$eq": ["$$this.v", count]},
+                                {"$gt": ["$$this.k", key]},
+                            ]
+                        },
+                    ]
+                },
+            }
+        }
+    return [
+        {"$match": {"_id": short_code}},
+        {
+            "$project": {
+                "_id": 0,
+                "total": {"$size": {"$objectToArray": source}},
+                "items": {"$slice": [items, limit + 1]},
+            }
+        },
+    ]
+
+
+# Count maps of the stats payload that are cut to their largest entries, and
+# where each one lives in a link document carrying the materialized view
+CAPPED_FIELDS = {
+    "bots": "bots",
+    **{field: STATS_MATERIALIZED_PATHS[field] for field in STATS_DIMENSIONS},
+    **{
+        f"unique_{field}": STATS_MATERIALIZED_PATHS[f"unique_{field}"]
+        for field in STATS_DIMENSIONS
+    },
+}
+
+
+def get_dimension_cap_stage(limit, fields=None):
+    """
+    Keep only the `limit` largest entries of each count map, reporting the
+    full size of every map that was cut under `truncated.<field>`. None when
+    none of the `fields` is a count map.
+    """
+    add_fields = {}
+    for field, path in CAPPED_FIELDS.items():
+        if fields is not None and field not in fields:
+            continue
+        size = {"$size": {"$objectToArray": {"$ifNull": [f"${path}", {}]}}}
+        add_fields[path] = {
+            "$arrayToObject": {"$slice": [_sorted_items(f"${path}"), limit]}
+        }
+        add_fields[f"truncated.{field}"] = {
+            "$cond": [{"$gt": [size, limit]}, size, "$$REMOVE"]
+        }
+    return {"$addFields": add_fields} if add_fields else None
+
+
+def get_stats_meta_batch_pipeline(short_codes):
+    """
+    `STATS_VERSION_PROJECTION` of many links in one query, enough to check
+    access before any stats are read.
+    """
+    return [
+        {"$match": {"_id": {"$in": list(short_codes)}}},
+        {"$project": STATS_VERSION_PROJECTION},
+    ]
+
+
+def get_stats_batch_pipeline(short_codes, fields=None, dimension_limit=None):
+    """
+    Materialized stats of many links in one query. The password is always
+    read so access can be checked per link.
+    """
+    projection = {**get_stats_projection(fields), "password": 1}
+    pipeline = [
+        {"$match": {"_id": {"$in": list(short_codes)}}},
+        {"$project": projection},
+    ]
+    cap_stage = dimension_limit and get_dimension_cap_stage(dimension_limit, fields)
+    if cap_stage:
+        pipeline.append(cap_stage)
+    return pipeline
+
+
+def _date_window_filter(source, start=None, end=None):
+    """
+    Keep only the entries of a date-keyed map whose "YYYY-MM-DD" key falls
+    within [start, end]; either bound may be omitted.
+    """
+    conditions = []
+    if start:
+        conditions.append({"$gte": ["$$this.k", start]})
+    if end:
+        conditions.append({"$lte": ["$$this.k", end]})
+    return {
+        "$arrayToObject": {
+            "$filter": {
+                "input": {"$objectToArray": {"$ifNull": [source, {}]}},
+                "cond": {"$and": conditions},
+            }
+        }
+    }
+
+
+def get_materialized_stats_pipeline(
+    short_code, top_n=None, window=None, fields=None, dimension_limit=None
+):
+    """
+    Single-document read of the materialized view with the top-N buckets,
+    the click counters limited to a date `window` and/or the count maps cut
+    to `dimension_limit` entries computed server-side.
+    """
+    projection = dict(get_stats_projection(fields))
+    if window:
+        start, end = window.get("from"), window.get("to")
+        for counter in ("counter", "unique_counter"):
+            if counter in projection:
+                projection[counter] = _date_window_filter(f"${counter}", start, end)
+        if window.get("granularity") == "hour" and "counter" in projection:
+            projection["hourly_counter"] = _date_window_filter(
+                "$hourly_counter", start, end
+            )
+
+    pipeline = [{"$match": {"_id": short_code}}, {"$project": projection}]
+    if top_n:
+        pipeline.append(get_top_n_stage(top_n, materialized=True, fields=fields))
+    # after the top-N stage, so "others" still covers the entries cut here
+    cap_stage = dimension_limit and get_dimension_cap_stage(dimension_limit, fields)
+    if cap_stage:
+        pipeline.append(cap_stage)
+    return pipeline
+
+
+def _create_field_transform(field_name, fields=None):
+    transforms = {
         f"{field_name}": {
             "$arrayToObject": {
                 "$map": {
@@ -22,43 +453,64 @@ def _create_field_transform(field_name):
             }
         },
     }
+    if fields is None:
+        return transforms
+    return {key: value for key, value in transforms.items() if key in fields}
 
 
-def get_stats_pipeline(short_code):
-    fields = ["browser", "os_name", "country", "referrer"]
+def get_stats_pipeline(short_code, top_n=None, fields=None):
+    """
+    Full stats aggregation over the raw per-dimension maps. With `fields`, only
+    the requested subtrees are projected and only their transforms (notably
+    the `$setUnion` unique counts) are computed.
+    """
+    source_fields = None if fields is None else get_stats_source_fields(fields)
     add_fields = {}
-    for field in fields:
-        add_fields |= _create_field_transform(field)
+    for field in STATS_DIMENSIONS:
+        add_fields |= _create_field_transform(field, source_fields)
 
-    return [
-        {"$match": {"_id": short_code}},
-        {
-            "$project": {
-                "url": 1,
-                "browser": {"$ifNull": ["$browser", {}]},
-                "os_name": {"$ifNull": ["$os_name", {}]},
-                "country": {"$ifNull": ["$country", {}]},
-                "referrer": {"$ifNull": ["$referrer", {}]},
-                "total_unique_clicks": {"$size": "$ips"},
-                "total-clicks": {"$ifNull": ["$total-clicks", 0]},
-                "max-clicks": {"$ifNull": ["$max-clicks", None]},
-                "expiration-time": {"$ifNull": ["$expiration-time", None]},
-                "password": {"$ifNull": ["$password", None]},
-                "short_code": {"$ifNull": ["$short_code", None]},
-                "last-click-browser": {"$ifNull": ["$last-click-browser", None]},
-                "last-click-os": {"$ifNull": ["$last-click-os", None]},
-                "last-click-country": {"$ifNull": ["$last-click-country", None]},
-                "block-bots": {"$ifNull": ["$block-bots", False]},
-                "bots": {"$ifNull": ["$bots", {}]},
-                "counter": {"$ifNull": ["$counter", {}]},
-                "unique_counter": {"$ifNull": ["$unique_counter", {}]},
-                "average_redirection_time": {
-                    "$ifNull": ["$average_redirection_time", 0]
-                },
-                "creation-date": {"$ifNull": ["$creation-date", None]},
-                "creation-time": {"$ifNull": ["$creation-time", None]},
-                "last-click": {"$ifNull": ["$last-click", None]},
-            }
-        },
-        {"$addFields": add_fields},
-    ]
+    projection = {
+        "url": 1,
+        "browser": {"$ifNull": ["$browser", {}]},
+        "os_name": {"$ifNull": ["$os_name", {}]},
+        "country": {"$ifNull": ["$country", {}]},
+        "referrer": {"$ifNull": ["$referrer", {}]},
+        "total_unique_clicks": {"$size": "$ips"},
+        "total-clicks": {"$ifNull": ["$total-clicks", 0]},
+        "max-clicks": {"$ifNull": ["$max-clicks", None]},
+        "expiration-time": {"$ifNull": ["$expiration-time", None]},
+        "password": {"$ifNull": ["$password", None]},
+        "short_code": {"$ifNull": ["$short_code", None]},
+        "last-click-browser": {"$ifNull": ["$last-click-browser", None]},
+        "last-click-os": {"$ifNull": ["$last-click-os", None]},
+        "last-click-country": {"$ifNull": ["$last-click-country", None]},
+        "block-bots": {"$ifNull": ["$block-bots", False]},
+        "bots": {"$ifNull": ["$bots", {}]},
+        "counter": {"$ifNull": ["$counter", {}]},
+        "unique_counter": {"$ifNull": ["$unique_counter", {}]},
+        "average_redirection_time": {"$ifNull": ["$average_redirection_time", 0]},
+        "creation-date": {"$ifNull": ["$creation-date", None]},
+        "creation-time": {"$ifNull": ["$creation-time", None]},
+        "last-click": {"$ifNull": ["$last-click", None]},
+        "country_code": {"$ifNull": ["$stats.country_code", {}]},
+    }
+
+    # Raw dimension maps only needed as input for a unique_* transform
+    dropped = []
+    if source_fields is not None:
+        for field in STATS_DIMENSIONS:
+            if field not in source_fields and f"unique_{field}" in source_fields:
+                source_fields.add(field)
+                dropped.append(field)
+        projection = {
+            key: value for key, value in projection.items() if key in source_fields
+        }
+
+    pipeline = [{"$match": {"_id": short_code}}, {"$project": projection}]
+    if add_fields:
+        pipeline.append({"$addFields": add_fields})
+    if dropped:
+        pipeline.append({"$project": {field: 0 for field in dropped}})
+    if top_n:
+        pipeline.append(get_top_n_stage(top_n, fields=fields))
+    return pipeline
@@ -0,0 +1,363 @@
+import base64
+from datetime import datetime, timezone
+import hashlib
+import json
+
+from utils.mongo_utils import (
+    BulkheadFullError,
+    aggregate_emoji_url,
+    aggregate_emoji_urls,
+    aggregate_url,
+    aggregate_urls,
+    load_emoji_url,
+    load_url,
+    update_emoji_url,
+    update_url,
+)
+from utils.analytics_utils import cap_dimensions
+from utils.pipeline_utils import (
+    CAPPED_FIELDS,
+    STATS_DIMENSIONS,
+    STATS_SCHEMA_VERSION,
+    TOP_N_FIELDS,
+    get_delta_projection,
+    get_dimension_page_pipeline,
+    get_materialized_stats_pipeline,
+    get_stats_batch_pipeline,
+    get_stats_meta_batch_pipeline,
+    get_stats_pipeline,
+    get_stats_projection,
+)
+from utils.url_utils import convert_to_gmt, validate_emoji_alias
+
+
+def build_stats(url_doc):
+    """
+    Flatten a link document carrying the materialized `stats` subdocument into
+    the same shape `get_stats_pipeline` produces.
+    """
+    stats = url_doc.get("stats") or {}
+    url_data = {
+        "_id": url_doc["_id"],
+        "url": url_doc.get("url"),
+        "total_unique_clicks": stats.get("total_unique_clicks", 0),
+        "total-clicks": url_doc.get("total-clicks", 0),
+        "max-clicks": url_doc.get("max-clicks"),
+        "expiration-time": url_doc.get("expiration-time"),
+        "password": url_doc.get("password"),
+        "short_code": url_doc.get("short_code"),
+        "last-click-browser": url_doc.get("last-click-browser"),
+        "last-click-os": url_doc.get("last-click-os"),
+        "last-click-country": url_doc.get("last-click-country"),
+        "block-bots": url_doc.get("block-bots", False),
+        "bots": url_doc.get("bots", {}),
+        "counter": url_doc.get("counter", {}),
+        "unique_counter": url_doc.get("unique_counter", {}),
+        "average_redirection_time": url_doc.get("average_redirection_time", 0),
+        "creation-date": url_doc.get("creation-date"),
+        "creation-time": url_doc.get("creation-time"),
+        "last-click": url_doc.get("last-click"),
+        "country_code": stats.get("country_code", {}),
+    }
+    for field in STATS_DIMENSIONS:
+        url_data[field] = stats.get(field, {})
+        url_data[f"unique_{field}"] = stats.get(f"unique_{field}", {})
+    if "hourly_counter" in url_doc:
+        url_data["hourly_counter"] = url_doc["hourly_counter"]
+    for field in TOP_N_FIELDS:
+        if f"sorted_{field}" in url_doc:
+            url_data[f"sorted_{field}"] = url_doc[f"sorted_{field}"]
+    if url_doc.get("truncated"):
+        url_data["truncated"] = url_doc["truncated"]
+    return url_data
+
+
+def materialize_stats(url_data):
+    """
+    Build the `stats` subdocument from the output of `get_stats_pipeline`.
+    """
+    stats = {
+        "schema": STATS_SCHEMA_VERSION,
+        "total_unique_clicks": url_data.get("total_unique_clicks", 0),
+    }
+    for field in STATS_DIMENSIONS:
+        stats[field] = url_data.get(field, {})
+        stats[f"unique_{field}"] = url_data.get(f"unique_{field}", {})
+    return stats
+
+
+def load_stats(short_code, top_n=None, window=None, fields=None, dimension_limit=None):
+    """
+    Load the stats of a link from its materialized view with a single indexed
+    find_one. Links created before the view existed are rebuilt once with the
+    full aggregation and written back.
+
+    With `top_n`, the `sorted_*` maps (top N entries plus "others") are
+    computed by the database as part of the same read. With a `window`
+    (`from`/`to` dates, `granularity`) only the click counters inside it are
+    read. With `fields`, only what is needed to serve those payload fields is
+    read and computed. With `dimension_limit`, the count maps are cut to
+    their largest entries by the database (see `cap_dimensions`).
+    """
+    is_emoji = validate_emoji_alias(short_code)
+
+    if top_n or window or dimension_limit:
+        pipeline = get_materialized_stats_pipeline(
+            short_code, top_n, window, fields, dimension_limit
+        )
+        if is_emoji:
+            url_doc = aggregate_emoji_url(pipeline)
+        else:
+            url_doc = aggregate_url(pipeline)
+    elif is_emoji:
+        url_doc = load_emoji_url(
+            short_code, get_stats_projection(fields), workload="stats"
+        )
+    else:
+        url_doc = load_url(short_code, get_stats_projection(fields), workload="stats")
+
+    if not url_doc:
+        return None
+
+    if (url_doc.get("stats") or {}).get("schema") == STATS_SCHEMA_VERSION:
+        return build_stats(url_doc)
+
+    pipeline = get_stats_pipeline(short_code, top_n, fields)
+    if is_emoji:
+        url_data = aggregate_emoji_url(pipeline)
+    else:
+        url_data = aggregate_url(pipeline)
+
+    if not url_data:
+        return url_data
+
+    # A partial aggregation can't be written back as the materialized view
+    if fields is not None:
+        return _cap(url_data, dimension_limit)
+
+    # Field by field, so country codes recorded by clicks since the link was
+    # created are kept
+    stats = materialize_stats(url_data)
+    updates = {"$set": {f"stats.{key}": value for key, value in stats.items()}}
+    if is_emoji:
+        update_emoji_url(short_code, updates)
+    else:
+        update_url(short_code, updates)
+
+    return _cap(url_data, dimension_limit)
+
+
+def _cap(url_data, dimension_limit):
+    # Only for the one-off full aggregation of a link without the view
+    if not dimension_limit:
+        return url_data
+    return cap_dimensions(url_data, CAPPED_FIELDS, dimension_limit)
+
+
+def load_stats_meta_batch(short_codes):
+    """
+    Version and access fields of many links, as `{short_code: url_meta}` for
+    the links that exist, or None when a query failed.
+    """
+    emoji_codes = [code for code in short_codes if validate_emoji_alias(code)]
+    url_codes = [code for code in short_codes if not validate_emoji_alias(code)]
+
+    url_metas = {}
+    for codes, aggregate in (
+        (url_codes, aggregate_urls),
+        (emoji_codes, aggregate_emoji_urls),
+    ):
+        if not codes:
+            continue
+        try:
+            docs = aggregate(get_stats_meta_batch_pipeline(codes))
+        except BulkheadFullError:
+            return None
+        if docs is None:
+            return None
+        url_metas.update((url_meta["_id"], url_meta) for url_meta in docs)
+    return url_metas
+
+
+def load_stats_batch(short_codes, fields=None, dimension_limit=None):
+    """
+    Stats documents of many links with one `$in` aggregation per collection.
+    Returns `{short_code: url_doc}` for the links that exist, or None when a
+    query failed. Documents without the materialized view are loaded one by
+    one through `load_stats` (which backfills it).
+    """
+    emoji_codes = [code for code in short_codes if validate_emoji_alias(code)]
+    url_codes = [code for code in short_codes if not validate_emoji_alias(code)]
+
+    url_docs = {}
+    for codes, aggregate in (
+        (url_codes, aggregate_urls),
+        (emoji_codes, aggregate_emoji_urls),
+    ):
+        if not codes:
+            continue
+        try:
+            docs = aggregate(get_stats_batch_pipeline(codes, fields, dimension_limit))
+        except BulkheadFullError:
+            return None
+        if docs is None:
+            return None
+        for url_doc in docs:
+            if (url_doc.get("stats") or {}).get("schema") == STATS_SCHEMA_VERSION:
+                url_data = build_stats(url_doc)
+            else:
+                try:
+                    url_data = load_stats(
+                        url_doc["_id"], fields=fields, dimension_limit=dimension_limit
+                    )
+                except BulkheadFullError:
+                    return None
+                if not url_data:
+                    continue
+            url_data["password"] = url_doc.get("password")
+            url_docs[url_doc["_id"]] = url_data
+
+    return url_docs
+
+
+def load_stats_delta(short_code, since):
+    """
+    Current values of the counters that changed since `since`: either the
+    version (total clicks, an int) a client last saw, or a POSIX timestamp
+    (a float).
+
+    Returns `{"version", "full", "changes"}`, where `full` means the changes
+    go back further than the `recent_clicks` ring and the client has to
+    fetch the complete stats again, or None when the link doesn't exist.
+    """
+    load = load_emoji_url if validate_emoji_alias(short_code) else load_url
+
+    url_doc = load(
+        short_code, {"total-clicks": 1, "recent_clicks": 1}, workload="stats"
+    )
+    if not url_doc:
+        return None
+
+    total_clicks = url_doc.get("total-clicks", 0)
+    recent_clicks = url_doc.get("recent_clicks") or []
+    delta = {"version": str(total_clicks), "full": False, "changes": {}}
+
+    if isinstance(since, int):
+        new_clicks = total_clicks - since
+        if new_clicks < 0 or new_clicks > len(recent_clicks):
+            delta["full"] = True
+            return delta
+        recent_clicks = recent_clicks[len(recent_clicks) - new_clicks :]
+    else:
+        if total_clicks > len(recent_clicks) and (
+            not recent_clicks or recent_clicks[0]["t"] > since
+        ):
+            delta["full"] = True
+            return delta
+        recent_clicks = [click for click in recent_clicks if click["t"] > since]
+
+    if not recent_clicks:
+        return delta
+
+    url_doc = load(short_code, get_delta_projection(recent_clicks), workload="stats")
+    if not url_doc:
+        return None
+
+    stats = url_doc.get("stats") or {}
+    changes = {
+        "total-clicks": url_doc.get("total-clicks", 0),
+        "total_unique_clicks": stats.get("total_unique_clicks", 0),
+        "last-click": url_doc.get("last-click"),
+    }
+    for key in ("counter", "unique_counter", "bots"):
+        if url_doc.get(key):
+            changes[key] = url_doc[key]
+    for field in STATS_DIMENSIONS:
+        for key in (field, f"unique_{field}"):
+            if stats.get(key):
+                changes[key] = stats[key]
+
+    delta["changes"] = changes
+    return delta
+
+
+def encode_cursor(count, key):
+    raw = json.dumps([count, key]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    `(count, key)` of the last entry of the previous page, or None when the
+    cursor is malformed.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        count, key = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(count, int) or not isinstance(key, str):
+        return None
+    return count, key
+
+
+def load_dimension_page(short_code, dimension, limit, after=None):
+    """
+    One page of a dimension breakdown, largest counts first, as
+    `{"items": [...], "total": n, "next_cursor": str | None}`.
+    """
+    pipeline = get_dimension_page_pipeline(short_code, dimension, limit, after)
+    if validate_emoji_alias(short_code):
+        page = aggregate_emoji_url(pipeline)
+    else:
+        page = aggregate_url(pipeline)
+
+    if page is None:
+        return None
+
+    items = page["items"]
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1]["v"], items[-1]["k"])
+
+    return {
+        "items": [{"key": item["k"], "count": item["v"]} for item in items],
+        "total": page["total"],
+        "next_cursor": next_cursor,
+    }
+
+
+def get_stats_version(url_meta):
+    """
+    Cheap version stamp for a link's stats. It changes with every click, at
+    midnight, since gap-filled counters and averages depend on the date, and
+    when the expiration time passes, since `expired` does.
+    """
+    version = "{}:{}:{}".format(
+        url_meta.get("total-clicks", 0),
+        url_meta.get("last-click"),
+        datetime.now().strftime("%Y-%m-%d"),
+    )
+    if _has_expired(url_meta.get("expiration-time")):
+        version += ":expired"
+    return version
+
+
+def _has_expired(expiration_time):
+    if not expiration_time:
+        return False
+    try:
+        expiration_time = convert_to_gmt(expiration_time)
+    except (TypeError, ValueError):
+        return False
+    return expiration_time is not None and expiration_time <= datetime.now(timezone.utc)
+
+
+def get_stats_etag(short_code, version, password=None, variant=""):
+    """
+    ETag for one representation (`variant`) of a link's stats. The password
+    is mixed in so a password change invalidates previously issued tags.
+    """
+    raw = f"{short_code}|{version}|{password or ''}|{variant}"
+    return hashlib.sha256(raw.encode()).hexdigest()[:32]
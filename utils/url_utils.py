@@ -17,18 +17,24 @@ with open("bot_user_agents.txt", "r") as file:
     ]
 
 
-def get_country(ip_address):
+def get_country_info(ip_address):
+    """
+    Country name and ISO 3166-1 alpha-2 code for an IP address.
+    """
     reader = geoip2.database.Reader("misc/GeoLite2-Country.mmdb")
     try:
         response = reader.country(ip_address)
-        country = response.country.name
-        return country
+        return response.country.name, response.country.iso_code
     except geoip2.errors.AddressNotFoundError:
-        return "Unknown"
+        return "Unknown", None
     finally:
         reader.close()
 
 
+def get_country(ip_address):
+    return get_country_info(ip_address)[0]
+
+
 def get_client_ip() -> str:
     # Check for common proxy headers first
     headers_to_check: list[str] = [